@@ -0,0 +1,305 @@
+"""Versioned JSON API: timelines, profiles, messages, likes and follows.
+
+Lists are paged with the same cursors as the HTML pages: each response
+has a `next_cursor` to pass back as `before` for the next page (null on
+the last one), and `limit` asks for a smaller or larger page (up to
+MAX_PER_PAGE).
+
+Queries select only the columns a response needs and rows are serialized
+as they come back, without building ORM objects. The session login is
+the authentication, as for the HTML pages; errors come back as JSON
+like {"error": "..."} with the matching status code.
+"""
+
+from flask import Blueprint, g, jsonify, request
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound, Unauthorized
+
+from http_cache import not_modified
+import jobs
+from models import db, User, Message, Follows, Like, TimelineEntry, TIMELINE_BACKFILL
+from pagination import paginate, MESSAGES_PER_PAGE, USERS_PER_PAGE
+
+MAX_PER_PAGE = 100
+
+# each new follow copies up to TIMELINE_BACKFILL messages in the request
+MAX_FOLLOWS_PER_REQUEST = 100
+
+MESSAGE_COLUMNS = (
+    Message.id,
+    Message.text,
+    Message.timestamp,
+    User.id.label('user_id'),
+    User.username,
+    User.image_url,
+)
+
+USER_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.header_image_url,
+    User.bio,
+    User.location,
+)
+
+PROFILE_COLUMNS = USER_COLUMNS + tuple(getattr(User, name) for name in User.COUNTERS)
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def message_json(row):
+    """A message row (MESSAGE_COLUMNS) as a dict."""
+
+    return {
+        "id": row.id,
+        "text": row.text,
+        "timestamp": row.timestamp.isoformat(),
+        "user": {
+            "id": row.user_id,
+            "username": row.username,
+            "image_url": row.image_url,
+        },
+        "liked": g.viewer.likes(row),
+    }
+
+
+def user_json(row):
+    """A user row (USER_COLUMNS or PROFILE_COLUMNS) as a dict."""
+
+    user = row._asdict()
+    user["following"] = g.viewer.follows(row)
+    return user
+
+
+def limit_arg(default):
+    """The page size asked for in 'limit', or `default`."""
+
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        raise BadRequest("'limit' must be a number.")
+
+    if not 1 <= limit <= MAX_PER_PAGE:
+        raise BadRequest(f"'limit' must be between 1 and {MAX_PER_PAGE}.")
+
+    return limit
+
+
+def require_login():
+    if not g.user:
+        raise Unauthorized("Log in to see this.")
+
+
+def ensure_user_exists(user_id):
+    if not db.session.query(User.active().filter_by(id=user_id).exists()).scalar():
+        raise NotFound("No such user.")
+
+
+def queue_timeline_backfill(user_id, author_ids):
+    """Queue the rest of following or unfollowing `author_ids` for
+    `user_id`'s timeline, for the authors with more messages than
+    Follows.add and remove move in the request."""
+
+    authors = [author_id for author_id, in (db.session
+                                            .query(User.id)
+                                            .filter(User.id.in_(author_ids),
+                                                    User.messages_count > TIMELINE_BACKFILL))]
+
+    if authors:
+        jobs.queue.enqueue('backfill-timeline', {'user_id': user_id, 'author_ids': authors})
+
+
+def messages_page(query, columns, key):
+    """Respond with a page of message rows from `query`."""
+
+    page = paginate(query, columns, key=key,
+                    cursor=request.args.get('before'),
+                    per_page=limit_arg(MESSAGES_PER_PAGE))
+    g.viewer.scope(messages=page)
+
+    cached = not_modified([(row.id, row.username, row.image_url) for row in page],
+                          page.next_cursor)
+    if cached:
+        return cached
+
+    return jsonify(messages=[message_json(row) for row in page],
+                   next_cursor=page.next_cursor)
+
+
+def users_page(query, column):
+    """Respond with a page of user rows from `query`, ordered by `column`."""
+
+    page = paginate(query, (column,), key=lambda row: (row.id,),
+                    cursor=request.args.get('before'),
+                    per_page=limit_arg(USERS_PER_PAGE))
+    g.viewer.scope(users=page)
+
+    cached = not_modified([tuple(row) for row in page], page.next_cursor)
+    if cached:
+        return cached
+
+    return jsonify(users=[user_json(row) for row in page],
+                   next_cursor=page.next_cursor)
+
+
+@api.errorhandler(HTTPException)
+def json_error(error):
+    """Errors as JSON rather than HTML pages."""
+
+    return jsonify(error=error.description), error.code
+
+
+@api.route('/timeline')
+def timeline():
+    """The logged-in user's home timeline, newest first."""
+
+    require_login()
+
+    query = (db.session
+             .query(*MESSAGE_COLUMNS)
+             .select_from(TimelineEntry)
+             .join(Message, Message.id == TimelineEntry.message_id)
+             .join(User, User.id == TimelineEntry.author_id)
+             .filter(TimelineEntry.user_id == g.user.id,
+                     User.deleted_at.is_(None)))
+
+    return messages_page(query,
+                         (TimelineEntry.timestamp, TimelineEntry.message_id),
+                         key=lambda row: (row.timestamp, row.id))
+
+
+@api.route('/users/<int:user_id>')
+def user_profile(user_id):
+    """A user's profile, with their counts."""
+
+    row = (db.session
+           .query(*PROFILE_COLUMNS)
+           .filter(User.id == user_id, User.deleted_at.is_(None))
+           .first())
+
+    if row is None:
+        raise NotFound("No such user.")
+
+    g.viewer.scope(users=[row])
+
+    cached = not_modified(tuple(row))
+    if cached:
+        return cached
+
+    return jsonify(user=user_json(row))
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """A user's messages, newest first."""
+
+    ensure_user_exists(user_id)
+
+    query = (db.session
+             .query(*MESSAGE_COLUMNS)
+             .join(User, User.id == Message.user_id)
+             .filter(Message.user_id == user_id))
+
+    return messages_page(query,
+                         (Message.timestamp, Message.id),
+                         key=lambda row: (row.timestamp, row.id))
+
+
+@api.route('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    """The messages a user has liked, most recently liked first."""
+
+    require_login()
+    ensure_user_exists(user_id)
+
+    query = (db.session
+             .query(*MESSAGE_COLUMNS, Like.id.label('like_id'))
+             .select_from(Like)
+             .join(Message, Message.id == Like.message_id)
+             .join(User, User.id == Message.user_id)
+             .filter(Like.user_id == user_id, User.deleted_at.is_(None)))
+
+    return messages_page(query, (Like.id,), key=lambda row: (row.like_id,))
+
+
+@api.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    """The users a user follows."""
+
+    require_login()
+    ensure_user_exists(user_id)
+
+    query = (db.session
+             .query(*USER_COLUMNS)
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .filter(Follows.user_following_id == user_id,
+                     User.deleted_at.is_(None)))
+
+    return users_page(query, Follows.user_being_followed_id)
+
+
+@api.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    """The users following a user."""
+
+    require_login()
+    ensure_user_exists(user_id)
+
+    query = (db.session
+             .query(*USER_COLUMNS)
+             .join(Follows, Follows.user_following_id == User.id)
+             .filter(Follows.user_being_followed_id == user_id,
+                     User.deleted_at.is_(None)))
+
+    return users_page(query, Follows.user_following_id)
+
+
+@api.route('/messages/<int:message_id>')
+def message(message_id):
+    """A single message."""
+
+    row = (db.session
+           .query(*MESSAGE_COLUMNS)
+           .join(User, User.id == Message.user_id)
+           .filter(Message.id == message_id, User.deleted_at.is_(None))
+           .first())
+
+    if row is None:
+        raise NotFound("No such message.")
+
+    g.viewer.scope(messages=[row])
+
+    cached = not_modified(tuple(row))
+    if cached:
+        return cached
+
+    return jsonify(message=message_json(row))
+
+
+@api.route('/following', methods=['POST'])
+def follow_users():
+    """Follow many users at once, e.g. suggested accounts at onboarding.
+
+    Takes {"user_ids": [...]} as JSON only, which a cross-site form can't
+    send. Users already followed and ids with no user are skipped; the
+    response has how many follows were added.
+    """
+
+    require_login()
+
+    body = request.get_json(silent=True)
+    user_ids = body.get('user_ids') if isinstance(body, dict) else None
+
+    if not isinstance(user_ids, list) or not all(
+            type(user_id) is int and 0 < user_id < 2 ** 31 for user_id in user_ids):
+        raise BadRequest("Send {\"user_ids\": [...]} as JSON.")
+
+    if len(user_ids) > MAX_FOLLOWS_PER_REQUEST:
+        raise BadRequest(f"Follow at most {MAX_FOLLOWS_PER_REQUEST} users at a time.")
+
+    added = Follows.add((g.user.id, user_id) for user_id in user_ids)
+    if added:
+        queue_timeline_backfill(g.user.id, user_ids)
+    db.session.commit()
+
+    return jsonify(added=added)
@@ -1,33 +1,73 @@
-import os
-
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for
+import csv
+import hmac
+import signal
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+import click
+from flask import (Flask, Response, render_template, request, flash, redirect, session, g,
+                   url_for, jsonify, stream_with_context)
 from flask_debugtoolbar import DebugToolbarExtension
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 
+from api import api, json_error
+from assets import Assets, build, STATIC_ENDPOINTS
+from compression import CompressionMiddleware, SKIP_COMPRESSION
+from config import configure
+import dbpool
+import deletion
+import instrumentation
+import jobs
+import schema
+import tasks  # noqa: F401 -- registers the job handlers with jobs.queue
 from forms import ChangePasswordForm, UserAddForm, LoginForm, MessageForm, OnlyCsrfForm, UserEditForm
-from models import db, connect_db, User, Message
-from werkzeug.exceptions import Unauthorized
+from current_user import CurrentUserCache
+from fragments import FragmentCache
+from http_cache import init_cache_policy, message_versions, not_modified, user_versions
+from loaders import prime_authors
+from models import (db, connect_db, User, Message, Follows, Like, TimelineEntry,
+                    TIMELINE_BACKFILL)
+from viewer import ViewerContext
+from search import clean_search, search_messages, search_users
+from pagination import Page, paginate, next_page_url, USERS_PER_PAGE
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound, Unauthorized
 
 CURR_USER_KEY = "curr_user"
 
+# template events per streamed chunk; small enough that the page's head
+# and nav go out before the cards are rendered
+STREAM_BUFFER_SIZE = 20
+
 app = Flask(__name__)
+configure(app)
+#app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
+#toolbar = DebugToolbarExtension(app)
 
-database_url = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
+connect_db(app)
+dbpool.init_app(app, db.engine)
+instrumentation.init_app(app, db.engine)
+init_cache_policy(app)
+jobs.queue.init_app(app)
 
-# fix incorrect database URIs currently returned by Heroku's pg setup
-database_url = database_url.replace('postgres://', 'postgresql://')
+app.register_blueprint(api)
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+assets = Assets(app)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-#app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-#toolbar = DebugToolbarExtension(app)
+app.wsgi_app = CompressionMiddleware(
+    app.wsgi_app,
+    min_size=app.config['COMPRESSION_MIN_SIZE'],
+    gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+    brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'])
 
-connect_db(app)
+app.add_template_global(next_page_url)
+
+current_users = CurrentUserCache(maxsize=app.config['CURRENT_USER_CACHE_SIZE'],
+                                 ttl=app.config['CURRENT_USER_CACHE_TTL'])
+
+message_fragments = FragmentCache(app.jinja_env,
+                                  maxsize=app.config['MESSAGE_FRAGMENT_CACHE_SIZE'])
+app.add_template_global(message_fragments.message_body, 'message_body')
 
 
 ##############################################################################
@@ -36,19 +76,106 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a cached CurrentUser snapshot, not a User; call g.user.load()
+    for the full User when a route needs to change it.
+
+    Also adds g.viewer, the ViewerContext routes scope to their page so
+    templates can check the user's likes and follows cheaply.
+    """
+
+    # static files and built assets never look at the user
+    if request.endpoint in STATIC_ENDPOINTS:
+        return
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get_or_404(session[CURR_USER_KEY])
+        g.user = current_users.get(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
+    g.viewer = ViewerContext(g.user.id if g.user else None)
+
+
+@app.before_request
+def guard_csrf_token():
+    """Leave pages uncompressed when they may echo request input next to
+    the session's CSRF token.
+
+    The token's session part is the same on every page, so compressed sizes
+    of pages echoing input an attacker chose (search terms, re-rendered
+    forms) would leak it a guess at a time (BREACH). Pages requested
+    without input are compressed as usual.
+    """
+
+    if (request.args or request.form) and 'csrf_token' in session:
+        request.environ[SKIP_COMPRESSION] = True
+
+
+def render_page(template, fragment, **context):
+    """Render a paginated page, or only its items for infinite scroll.
+
+    Requests with `?fragment=1` get just the list items (and the link to
+    the next page) so the client can append them to the page it has.
+    """
+
+    if request.args.get('fragment'):
+        return render_template(fragment, **context)
+
+    return render_template(template, **context)
+
+
+def stream_page(template, fragment, **context):
+    """Like render_page, but send the page while it renders.
+
+    The rows are a page already read in one query (and checked against
+    the client's ETag), but the HTML goes out in chunks as it renders, so
+    the head and nav reach the browser before the cards are built and the
+    whole document is never held in memory.
+
+    Pages with flashed messages are rendered whole, since showing a flash
+    changes the session, and the session cookie can't be set once the
+    response has started.
+    """
+
+    name = fragment if request.args.get('fragment') else template
+
+    if '_flashes' in session:
+        return render_template(name, **context)
+
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+
+    return Response(stream_with_context(stream))
+
+
+def date_arg(name, days=0):
+    """Parse a YYYY-MM-DD querystring arg as midnight of that date.
+
+    `days` shifts the result, e.g. days=1 for an inclusive end date. Returns
+    None if the arg is missing; raises BadRequest if it isn't a date.
+    """
+
+    value = request.args.get(name)
+
+    if not value:
+        return None
+
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' must be a date like 2021-08-31.")
+
+    return datetime.combine(day, time()) + timedelta(days=days)
+
 
 def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    current_users.remember(user)
 
 
 def do_logout():
@@ -105,6 +232,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # saves the password if authenticate upgraded its hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -133,26 +262,68 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search users by username, bio
+    and location, and a 'before' cursor to page through the results.
     """
 
     search = request.args.get('q')
+    cursor = request.args.get('before')
 
     if not search:
-        users = User.query.all()
+        page = paginate(User.active(),
+                        (User.id,),
+                        key=lambda user: (user.id,),
+                        cursor=cursor,
+                        per_page=USERS_PER_PAGE)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = search_users(search, cursor)
+
+    g.viewer.scope(users=page)
+
+    cached = not_modified(user_versions(page), page.next_cursor)
+    if cached:
+        return cached
+
+    return stream_page('users/index.html', 'users/_cards.html', users=page)
+
+
+@app.route('/users/search')
+def users_search():
+    """Search users as JSON.
+
+    Takes 'q' (the search terms) and 'before' (a cursor from a previous
+    response's next_cursor) in the querystring. Returns JSON like:
+        {"users": [{id, username, image_url, ...}, ...],
+         "next_cursor": "0.0607927_42" or null}
+    """
 
-    return render_template('users/index.html', users=users)
+    page = search_users(request.args.get('q', ''), request.args.get('before'))
+
+    return jsonify(users=[user.serialize() for user in page],
+                   next_cursor=page.next_cursor)
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
-    user = User.query.get_or_404(user_id)
+    """Show user profile with a page of their messages."""
+
+    user = User.active().filter_by(id=user_id).first_or_404()
     form = OnlyCsrfForm()
-   
-    return render_template('users/show.html', user=user, form=form)
+
+    messages = paginate(Message.query.filter(Message.user_id == user.id),
+                        (Message.timestamp, Message.id),
+                        key=lambda msg: (msg.timestamp, msg.id),
+                        cursor=request.args.get('before'))
+    g.viewer.scope(messages=messages, users=[user])
+
+    cached = not_modified(user_versions([user]),
+                          message_versions(messages),
+                          messages.next_cursor)
+    if cached:
+        return cached
+
+    return render_page('users/show.html', 'messages/_items.html',
+                       user=user, messages=messages, form=form)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -163,8 +334,26 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.active().filter_by(id=user_id).first_or_404()
+
+    following = (User.active()
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .filter(Follows.user_following_id == user.id))
+
+    users = paginate(following,
+                     (Follows.user_being_followed_id,),
+                     key=lambda listed_user: (listed_user.id,),
+                     cursor=request.args.get('before'),
+                     per_page=USERS_PER_PAGE)
+    g.viewer.scope(users=users.items + [user])
+
+    cached = not_modified(user_versions(users.items + [user]),
+                          users.next_cursor)
+    if cached:
+        return cached
+
+    return stream_page('users/following.html', 'users/_cards.html',
+                       user=user, users=users)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -175,8 +364,44 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.active().filter_by(id=user_id).first_or_404()
+
+    followers = (User.active()
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user.id))
+
+    users = paginate(followers,
+                     (Follows.user_following_id,),
+                     key=lambda listed_user: (listed_user.id,),
+                     cursor=request.args.get('before'),
+                     per_page=USERS_PER_PAGE)
+    g.viewer.scope(users=users.items + [user])
+
+    cached = not_modified(user_versions(users.items + [user]),
+                          users.next_cursor)
+    if cached:
+        return cached
+
+    return stream_page('users/followers.html', 'users/_cards.html',
+                       user=user, users=users)
+
+
+def followable(user_id):
+    """The messages_count of the (active) user `user_id`; 404 if none.
+
+    Following or unfollowing someone with more messages than
+    TIMELINE_BACKFILL leaves the rest to a backfill-timeline job.
+    """
+
+    messages_count = (db.session
+                      .query(User.messages_count)
+                      .filter(User.id == user_id, User.deleted_at.is_(None))
+                      .scalar())
+
+    if messages_count is None:
+        raise NotFound("No such user.")
+
+    return messages_count
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -187,8 +412,9 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    messages_count = followable(follow_id)
+    if Follows.add([(g.user.id, follow_id)]) and messages_count > TIMELINE_BACKFILL:
+        jobs.queue.enqueue('backfill-timeline', {'user_id': g.user.id, 'author_ids': [follow_id]})
     db.session.commit()
 
     return redirect(f'/users/{g.user.id}/following')
@@ -202,12 +428,14 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.remove(followed_user)
+    messages_count = followable(follow_id)
+    if Follows.remove([(g.user.id, follow_id)]) and messages_count > TIMELINE_BACKFILL:
+        jobs.queue.enqueue('backfill-timeline', {'user_id': g.user.id, 'author_ids': [follow_id]})
     db.session.commit()
 
     return redirect(f'/users/{g.user.id}/following')
 
+
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
@@ -220,23 +448,24 @@ def profile():
     form2 = ChangePasswordForm()
 
     if form.validate_on_submit():
-        g.user.username = form.username.data  
-        g.user.email = form.email.data   
-        g.user.image_url = form.image_url.data or User.image_url.default.arg
-        g.user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
-        g.user.bio = form.bio.data   
-        g.user.location = form.location.data  
-
-        user = User.authenticate(form.username.data, form.password.data)
-
-        if not user:
+        user = g.user.load()
+        user.username = form.username.data  
+        user.email = form.email.data   
+        user.image_url = form.image_url.data or User.image_url.default.arg
+        user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
+        user.bio = form.bio.data   
+        user.location = form.location.data  
+        # re-renders this user's cached messages
+        user.profile_version = User.profile_version + 1
+
+        if not User.authenticate(form.username.data, form.password.data):
             flash("Access unauthorized.", "danger")
             return redirect("/")
 
         db.session.commit()
+        current_users.forget(user.id)
 
-        id = g.user.id
-        return redirect(f'/users/{id}')
+        return redirect(f'/users/{user.id}')
 
     else:
         return render_template("users/edit.html", form=form, form2=form2)
@@ -253,14 +482,16 @@ def change_password():
     form2 = ChangePasswordForm()
     
     if form2.validate_on_submit():
-        g.user.current = form2.current.data
-        g.user.new_password = form2.new_password.data
-        g.user.confirm_password = form2.confirm_password.data
-        g.user.password = g.user.change_password(g.user.current, 
-                                                 g.user.new_password, 
-                                                 g.user.confirm_password)
+        user = g.user.load()
+        user.current = form2.current.data
+        user.new_password = form2.new_password.data
+        user.confirm_password = form2.confirm_password.data
+        user.password = user.change_password(user.current, 
+                                             user.new_password, 
+                                             user.confirm_password)
       
         db.session.commit()
+        current_users.forget(user.id)
         flash("Password changed successfully!")
         return redirect('/')
     else:
@@ -276,39 +507,37 @@ def user_show_likes(user_id):
         return redirect("/")
     
     form = OnlyCsrfForm()
-    user = User.query.get_or_404(user_id)
-    
-    return render_template('users/all_likes.html', user=user, form=form)
+    user = User.active().filter_by(id=user_id).first_or_404()
 
+    # newest likes first, so page on the like's id rather than the message's
+    liked = (Message
+             .visible()
+             .add_columns(Like.id.label('like_id'))
+             .join(Like, Like.message_id == Message.id)
+             .filter(Like.user_id == user.id))
 
-@app.route('/users/<int:message_id>/like', methods=["POST"])
-def user_like(message_id):
-    """Shows a User's liked messages and handles unliking a message."""
-    
-    form = OnlyCsrfForm()
+    messages = paginate(liked,
+                        (Like.id,),
+                        key=lambda row: (row.like_id,),
+                        cursor=request.args.get('before'))
+    messages.items = prime_authors([row.Message for row in messages.items])
+    g.viewer.scope(messages=messages)
 
-    if not g.user:  
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-    
-    if form.validate_on_submit():
-        msg = Message.query.get_or_404(message_id)
+    cached = not_modified(user_versions([user]),
+                          message_versions(messages),
+                          messages.next_cursor)
+    if cached:
+        return cached
 
-        if msg.user_id != g.user.id:
-            if msg in g.user.likes:
-                g.user.likes.remove(msg) 
-            
-            else:
-                g.user.likes.append(msg)
+    return render_page('users/all_likes.html', 'messages/_items.html',
+                       user=user, messages=messages, form=form)
 
-            db.session.commit()
 
-            return redirect(f'/users/{g.user.id}/')
-        else:
-            flash("You can't like your own posts!")
-            return redirect("/")
-    else:
-        raise Unauthorized()
+@app.route('/users/<int:message_id>/like', methods=["POST"])
+def user_like(message_id):
+    """Like or unlike a message from a user's likes page."""
+
+    return toggle_like(message_id, next_url=f'/users/{g.user.id}/likes' if g.user else "/")
 
 
 @app.route('/users/delete', methods=["POST"])
@@ -323,8 +552,12 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # hidden now; their messages, likes and follows go in the background
+    deletion.tombstone(g.user.id)
+    jobs.queue.enqueue('purge-account', {'user_id': g.user.id},
+                       key=f'purge-account:{g.user.id}')
     db.session.commit()
+    current_users.forget(g.user.id)
 
     return redirect("/signup")
 
@@ -347,8 +580,14 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        # flush so the message has an id and timestamp to fan out
+        db.session.flush()
+        # the author sees it now; their followers once the job has run
+        TimelineEntry.fan_out(msg, followers=False)
+        jobs.queue.enqueue('fan-out', {'message_id': msg.id}, key=f'fan-out:{msg.id}')
+        User.adjust_counts(g.user.id, messages_count=1)
         db.session.commit()
 
         id = g.user.id
@@ -358,45 +597,127 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Search messages.
+
+    Takes 'q' (search terms) in the querystring, and optionally 'author' (a
+    username), 'since' and 'until' (inclusive dates, YYYY-MM-DD) and a
+    'before' cursor to page through the results.
+    """
+
+    form = OnlyCsrfForm()
+
+    search = clean_search(request.args.get('q', ''))
+    author = clean_search(request.args.get('author', ''))
+    since = date_arg('since')
+    until = date_arg('until', days=1)
+
+    author_user = User.active().filter_by(username=author).first() if author else None
+
+    if author and not author_user:
+        messages = Page([], None)
+    else:
+        messages = search_messages(search,
+                                   author_id=author_user and author_user.id,
+                                   since=since,
+                                   until=until,
+                                   cursor=request.args.get('before'))
+        prime_authors(messages)
+        g.viewer.scope(messages=messages)
+
+    cached = not_modified(message_versions(messages), messages.next_cursor)
+    if cached:
+        return cached
+
+    return render_page('messages/search.html', 'messages/_items.html',
+                       messages=messages, form=form)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get_or_404(message_id)
+    msg = Message.visible().filter(Message.id == message_id).first_or_404()
+    prime_authors([msg])
+    g.viewer.scope(users=[msg.user])
+
+    cached = not_modified(message_versions([msg]))
+    if cached:
+        return cached
+
     return render_template('messages/show.html', message=msg)
 
 
 @app.route('/messages/<int:message_id>/togglelike', methods=["POST"])
 def messages_toggle_like(message_id):
     """Handles liking or unliking a message."""
-   
+
+    return toggle_like(message_id, next_url="/")
+
+
+def toggle_like(message_id, next_url):
+    """Like or unlike a message for g.user, and respond to suit the caller.
+
+    Scripts get the message's like form back (with `?fragment=1`) or
+    {liked, likes, likes_count} as JSON (when they accept it) -- the new
+    state, the message's like count and the user's -- rather than a
+    redirect to a full page.
+    """
+
+    fragment = request.args.get('fragment')
+    wants_json = request.accept_mimetypes.best == 'application/json'
+
+    try:
+        return like_or_unlike(message_id, next_url, fragment, wants_json)
+    except HTTPException as error:
+        # scripts asking for JSON get their errors as JSON too
+        if wants_json:
+            return json_error(error)
+        raise
+
+
+def like_or_unlike(message_id, next_url, fragment, wants_json):
+    """toggle_like's work; errors are left for it to answer."""
+
     form = OnlyCsrfForm()
-    
-    if not g.user:  
+
+    if not g.user:
+        if fragment or wants_json:
+            raise Unauthorized("Access unauthorized.")
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    if g.user and form.is_submitted:
-        msg = Message.query.get_or_404(message_id)
-        
-        if msg.user_id != g.user.id:
-            if msg in g.user.likes:
-                g.user.likes.remove(msg) 
-    
-            else:
-                g.user.likes.append(msg)
+    if not form.validate_on_submit():
+        raise Unauthorized()
 
-            db.session.commit()
+    author_id = (db.session
+                 .query(Message.user_id)
+                 .join(User, User.id == Message.user_id)
+                 .filter(Message.id == message_id, User.deleted_at.is_(None))
+                 .scalar())
 
-            return redirect("/")
-            # consider turning liked messages into a set() for faster retrieval 
-            # liked_messages = set(messages)
-            # and instead of redirecting to "/" we can render home.html with liked_messages passed in
-        else:
-            flash("You can't like your own posts!")
-            return redirect("/")
-    else:
-        raise Unauthorized()
+    if author_id is None:
+        raise NotFound()
+
+    if author_id == g.user.id:
+        if fragment or wants_json:
+            raise BadRequest("You can't like your own posts!")
+        flash("You can't like your own posts!")
+        return redirect("/")
+
+    liked, likes, likes_count = Like.toggle(g.user.id, message_id)
+    db.session.commit()
+
+    if fragment:
+        return render_template('messages/_like_form.html',
+                               message_id=message_id, liked=liked, form=form)
+
+    if wants_json:
+        return jsonify(message_id=message_id, liked=liked, likes=likes,
+                       likes_count=likes_count)
+
+    return redirect(next_url)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["GET", "POST"])
@@ -408,8 +729,13 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get_or_404(message_id)
+    TimelineEntry.remove_message(msg.id)
+    User.adjust_counts(msg.user_id, messages_count=-1)
+    User.adjust_counts(select(Like.user_id).where(Like.message_id == msg.id),
+                       likes_count=-1)
     db.session.delete(msg)
     db.session.commit()
+    message_fragments.forget_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -423,35 +749,230 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time
     """
     form = OnlyCsrfForm()
 
     if g.user:
-        user_ids = [user.id for user in g.user.following] + [g.user.id]
+        # counters change too often to cache with the rest of g.user
+        stats = (db.session
+                 .query(*[getattr(User, name) for name in User.COUNTERS])
+                 .filter(User.id == g.user.id)
+                 .one())
+
+        messages = paginate(TimelineEntry.messages_for(g.user.id),
+                            (TimelineEntry.timestamp, TimelineEntry.message_id),
+                            key=lambda msg: (msg.timestamp, msg.id),
+                            cursor=request.args.get('before'))
+        prime_authors(messages)
+        g.viewer.scope(messages=messages)
+
+        cached = not_modified(tuple(stats),
+                              message_versions(messages),
+                              messages.next_cursor)
+        if cached:
+            return cached
+
+        return render_page('home.html', 'messages/_items.html',
+                           messages=messages, stats=stats, form=form)
+    else:
+        return not_modified() or render_template('home-anon.html')
 
-        messages = (Message
-                    .query
-                    .order_by(Message.timestamp.desc())
-                    .filter(Message.user_id.in_(user_ids))
-                    .limit(100))
 
-        return render_template('home.html', messages=messages, form=form)
-    else:
-        return render_template('home-anon.html')
+@app.route('/_status/pool')
+def pool_status():
+    """This worker's database connection pool stats, as JSON.
+
+    Needs the STATUS_TOKEN config value in an X-Status-Token header; without
+    a STATUS_TOKEN configured, the page doesn't exist.
+    """
+
+    require_status_token()
+
+    return jsonify(dbpool.pool_stats.snapshot(db.engine.pool))
+
+
+@app.route('/_status/jobs')
+def jobs_status():
+    """The job queue's backlog and lag, as JSON; see jobs.JobQueue.stats.
+
+    Needs the STATUS_TOKEN, as /_status/pool does.
+    """
+
+    require_status_token()
+
+    return jsonify(jobs.queue.stats())
+
+
+def require_status_token():
+    """404 unless the request has the STATUS_TOKEN in X-Status-Token."""
+
+    token = app.config['STATUS_TOKEN']
+
+    if not token or not hmac.compare_digest(
+            request.headers.get('X-Status-Token', ''), token):
+        raise NotFound()
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
-
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+# CLI commands
+
+
+@app.cli.command('backfill-timelines')
+def backfill_timelines():
+    """Build home timelines from the existing messages and follows."""
+
+    count = TimelineEntry.backfill()
+    db.session.commit()
+
+    click.echo(f"Wrote {count} timeline entries.")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress static files into static/dist."""
+
+    manifest = build(app.static_folder)
+    assets.load_manifest()
+
+    click.echo(f"Built {len(manifest)} assets.")
+
+
+@app.cli.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True, help="Report drift without fixing it.")
+def reconcile_counters(dry_run):
+    """Recompute every user's counters and report any that had drifted."""
+
+    report = User.recount(fix=not dry_run)
+    db.session.commit()
+
+    for user_id, diffs in report:
+        details = ", ".join(f"{name} {stored} -> {actual}"
+                            for name, (stored, actual) in diffs.items())
+        click.echo(f"User #{user_id}: {details}")
+
+    verb = "Found" if dry_run else "Fixed"
+    click.echo(f"{verb} drift on {len(report)} users.")
+
+
+@app.cli.command('import-follows')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=10_000, show_default=True,
+              help="Follows added per statement (and per transaction).")
+def import_follows(path, batch_size):
+    """Add the follows in a CSV of user_following_id,user_being_followed_id.
+
+    Follows that already exist, and rows naming a missing user, are
+    skipped, so an interrupted import can simply be run again.
+    """
+
+    added = 0
+
+    with open(path, newline='') as file:
+        rows = csv.DictReader(file)
+        edges = ((int(row['user_following_id']), int(row['user_being_followed_id']))
+                 for row in rows)
+
+        while batch := list(islice(edges, batch_size)):
+            added += Follows.add(batch, limit=None)
+            db.session.commit()
+            click.echo(f"Read {rows.line_num - 1} rows, added {added} follows.")
+
+    click.echo(f"Added {added} follows.")
+
+
+@app.cli.command('purge-accounts')
+@click.option('--batch-size', default=deletion.BATCH_SIZE, show_default=True,
+              help="Rows deleted per statement (and per transaction).")
+def purge_accounts(batch_size):
+    """Purge every pending deleted account here, without waiting for a worker."""
+
+    user_ids = deletion.pending()
+
+    for user_id in user_ids:
+        progress = deletion.purge(user_id, batch_size=batch_size)
+        details = ", ".join(f"{getattr(progress, name)} {name.replace('_deleted', '')}"
+                            for name in progress.PROGRESS)
+        click.echo(f"User #{user_id}: deleted {details}.")
+
+    click.echo(f"Purged {len(user_ids)} accounts.")
+
+
+@app.cli.command('worker')
+@click.option('--concurrency', '-c', default=1, show_default=True,
+              help="Jobs run at once, each on its own thread.")
+@click.option('--poll-interval', default=1.0, show_default=True,
+              help="Seconds an idle thread waits before looking for jobs again.")
+@click.option('--report-interval', default=60, show_default=True,
+              help="Seconds between throughput and lag reports.")
+def worker(concurrency, poll_interval, report_interval):
+    """Run queued jobs until interrupted (see jobs.py)."""
+
+    runner = jobs.Worker(app, jobs.queue,
+                         concurrency=concurrency,
+                         poll_interval=poll_interval,
+                         report_interval=report_interval,
+                         echo=click.echo)
+
+    # finish the jobs in hand on SIGTERM, as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: runner.stop())
+
+    click.echo(f"Running jobs on {concurrency} threads.")
+    runner.run()
+
+
+@app.cli.group('jobs')
+def jobs_commands():
+    """The background job queue (see jobs.py)."""
+
+
+@jobs_commands.command('stats')
+def jobs_stats():
+    """Show jobs due, lag, and jobs by task and status."""
+
+    stats = jobs.queue.stats()
+
+    click.echo(f"{stats['due']} due, lag {stats['lag']:.1f}s.")
+    for name, counts in sorted(stats['by_task'].items()):
+        details = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        click.echo(f"{name}: {details}")
+
+
+@jobs_commands.command('prune')
+@click.option('--days', default=7, show_default=True,
+              help="Keep done jobs finished more recently than this.")
+def jobs_prune(days):
+    """Delete old done jobs."""
+
+    count = jobs.queue.prune(timedelta(days=days))
+    click.echo(f"Deleted {count} done jobs.")
+
+
+@app.cli.group('db')
+def db_commands():
+    """Schema migrations (see schema.py)."""
+
+
+@db_commands.command('status')
+def db_status():
+    """List migrations and whether they've run."""
+
+    for migration, applied_at in schema.status(db.engine):
+        state = f"applied {applied_at:%Y-%m-%d %H:%M}" if applied_at else "pending"
+        click.echo(f"{migration.version}_{migration.name}: {state}")
+
+
+@db_commands.command('upgrade')
+def db_upgrade():
+    """Run pending migrations."""
+
+    applied = schema.upgrade(db.engine, echo=click.echo)
+    click.echo(f"Applied {len(applied)} migrations.")
+
+
+@db_commands.command('stamp')
+def db_stamp():
+    """Record every migration as run, for a database made by create_all."""
+
+    schema.stamp(db.engine)
+    click.echo("Stamped.")
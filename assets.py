@@ -0,0 +1,197 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies everything under static/ into static/dist/
+with a hash of its contents in the filename (style.css becomes
+style.1f3a9c0e2b7d.css), writes gzip (and, if the `Brotli` package
+from requirements.txt is installed, brotli) versions of text assets next to them, and
+records the mapping in static/dist/manifest.json.
+
+Templates link to assets with asset_url('stylesheets/style.css'), which
+takes the same filename as url_for('static', ...). Built assets are
+served from /assets/ with a year-long, immutable Cache-Control -- a
+changed file gets a new name, so browsers never need to revalidate -- in
+the best encoding the browser accepts. Without a build (e.g. in
+development), asset_url falls back to the plain static URL.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from pathlib import Path, PurePosixPath
+
+from flask import request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_FOLDER = 'dist'
+MANIFEST = 'manifest.json'
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+# endpoints serving files rather than pages: they never need the current
+# user or per-request query stats
+STATIC_ENDPOINTS = {'static', 'assets'}
+
+# text formats worth precompressing; images are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+
+# preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+CSS_STATIC_URL = re.compile(r'''url\(\s*(['"]?)/static/([^'")]+)\1\s*\)''')
+
+
+def fingerprint(name, content):
+    """`name` with a hash of `content` before its extension."""
+
+    path = PurePosixPath(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+
+    return str(path.with_name(f'{path.stem}.{digest}{path.suffix}'))
+
+
+def rewrite_css_urls(name, content, manifest):
+    """Point a stylesheet's url(/static/...) at fingerprinted assets.
+
+    URLs are made relative to the stylesheet, so they work wherever the
+    assets are served from.
+    """
+
+    stylesheet_dir = PurePosixPath(manifest.get(name, name)).parent
+
+    def replace(match):
+        hashed = manifest.get(match.group(2))
+        if hashed is None:
+            return match.group(0)
+        return f'url("{os.path.relpath(hashed, stylesheet_dir)}")'
+
+    return CSS_STATIC_URL.sub(replace, content.decode()).encode()
+
+
+def precompress(path, content):
+    """Write the encoded variants of `path` that are smaller than it."""
+
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+
+    for suffix, encoded in variants.items():
+        if len(encoded) < len(content):
+            Path(f'{path}{suffix}').write_bytes(encoded)
+
+
+def build(static_folder, dist_folder=None):
+    """Fingerprint and precompress every file in `static_folder`.
+
+    Replaces `dist_folder` (static/dist by default) and returns the
+    manifest of original -> fingerprinted names it wrote there.
+    """
+
+    static = Path(static_folder)
+    dist = Path(dist_folder) if dist_folder else static / DIST_FOLDER
+
+    if dist.exists():
+        shutil.rmtree(dist)
+
+    sources = [path for path in static.rglob('*')
+               if path.is_file() and dist not in path.parents]
+
+    # stylesheets last, so the images they use already have their names
+    sources.sort(key=lambda path: (path.suffix == '.css', str(path)))
+
+    manifest = {}
+
+    for source in sources:
+        name = source.relative_to(static).as_posix()
+        content = source.read_bytes()
+
+        if source.suffix == '.css':
+            content = rewrite_css_urls(name, content, manifest)
+
+        hashed = fingerprint(name, content)
+        target = dist / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+
+        if source.suffix in COMPRESSIBLE:
+            precompress(target, content)
+
+        manifest[name] = hashed
+
+    (dist / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    return manifest
+
+
+class Assets:
+    """Serves built assets and gives templates their URLs."""
+
+    def __init__(self, app=None):
+        self.folder = None
+        self.manifest = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = os.path.join(app.static_folder, DIST_FOLDER)
+        self.load_manifest()
+
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.send_asset)
+        app.add_template_global(self.asset_url, 'asset_url')
+
+    def load_manifest(self):
+        """(Re)read the manifest; without one, assets are served as-is."""
+
+        try:
+            with open(os.path.join(self.folder, MANIFEST)) as manifest:
+                self.manifest = json.load(manifest)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def asset_url(self, filename):
+        """URL of a static file, fingerprinted if it has been built."""
+
+        hashed = self.manifest.get(filename)
+
+        if hashed is None:
+            return url_for('static', filename=filename)
+
+        return url_for('assets', filename=hashed)
+
+    def send_asset(self, filename):
+        """Send a built asset, precompressed if the client accepts it."""
+
+        path = safe_join(self.folder, filename)
+
+        if path is None:
+            raise NotFound()
+
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+                break
+        else:
+            encoding, suffix = None, ''
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(self.folder, filename + suffix,
+                                       mimetype=mimetype,
+                                       max_age=ONE_YEAR)
+
+        if encoding:
+            response.content_encoding = encoding
+
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+
+        return response
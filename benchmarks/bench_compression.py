@@ -0,0 +1,128 @@
+"""Compare bytes on the wire and CPU per request with response compression.
+
+Renders the main pages once as a logged-in user (the one following the
+most people, so the home timeline is full), then runs each body through
+compression.CompressionMiddleware for each encoding and level, reporting
+the compressed size and the CPU it added per request next to the CPU the
+request itself took.
+
+Run it from the project root against a seeded database like:
+
+    python benchmarks/bench_compression.py --database-url postgresql:///warbler
+
+brotli rows only appear if the optional `brotli` package is installed.
+Pass --json to get machine-readable results.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression
+from compression import CompressionMiddleware
+
+ROUTES = ["/", "/users", "/users/{user_id}", "/messages/{message_id}"]
+
+LEVELS = {"gzip": [1, 6, 9], "br": [1, 4, 11]}
+
+
+def render_pages(app, runs):
+    """Each route's body and the CPU seconds a request for it takes."""
+
+    from app import CURR_USER_KEY
+    from models import Message, User
+
+    with app.app_context():
+        user = User.query.order_by(User.following_count.desc()).first()
+        message = Message.query.order_by(Message.id.desc()).first()
+        ids = dict(user_id=user.id, message_id=message.id if message else 0)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = ids["user_id"]
+
+    pages = {}
+    for route in ROUTES:
+        path = route.format(**ids)
+        client.get(path)
+
+        began = time.process_time()
+        for _ in range(runs):
+            resp = client.get(path)
+            body = resp.get_data()
+        cpu = (time.process_time() - began) / runs
+
+        pages[path] = (body, cpu)
+
+    return pages
+
+
+def compress_cost(body, encoding, level, runs):
+    """Compressed size of `body` and CPU seconds it takes to compress."""
+
+    def page(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/html; charset=utf-8"),
+                                  ("Content-Length", str(len(body)))])
+        return [body]
+
+    middleware = CompressionMiddleware(page, gzip_level=level,
+                                       brotli_quality=level)
+    environ = {"REQUEST_METHOD": "GET", "HTTP_ACCEPT_ENCODING": encoding}
+
+    began = time.process_time()
+    for _ in range(runs):
+        compressed = b"".join(middleware(environ, lambda *args: None))
+    cpu = (time.process_time() - began) / runs
+
+    return len(compressed), cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="postgresql:///warbler")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    # as in the tests, point the app at its database before importing it
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from app import app
+
+    app.config["SQLALCHEMY_ECHO"] = False
+
+    encodings = ["gzip"] + (["br"] if compression.brotli else [])
+
+    results = []
+    for path, (body, request_cpu) in render_pages(app, args.runs).items():
+        for encoding in encodings:
+            for level in LEVELS[encoding]:
+                size, cpu = compress_cost(body, encoding, level, args.runs)
+                results.append(dict(path=path,
+                                    encoding=encoding,
+                                    level=level,
+                                    bytes=len(body),
+                                    compressed_bytes=size,
+                                    ratio=round(len(body) / size, 1),
+                                    request_cpu_ms=round(request_cpu * 1000, 2),
+                                    compress_cpu_ms=round(cpu * 1000, 3)))
+
+    if args.json:
+        print(json.dumps(dict(runs=args.runs, results=results), indent=2))
+        return
+
+    print(f"{args.runs} runs per measurement")
+    print(f"{'path':<16} {'enc':<5} {'lvl':>3} {'bytes':>9} {'on wire':>9} "
+          f"{'ratio':>6} {'request ms':>11} {'+compress ms':>13}")
+    for r in results:
+        print(f"{r['path']:<16} {r['encoding']:<5} {r['level']:>3} "
+              f"{r['bytes']:>9,} {r['compressed_bytes']:>9,} {r['ratio']:>6} "
+              f"{r['request_cpu_ms']:>11} {r['compress_cpu_ms']:>13}")
+
+
+if __name__ == "__main__":
+    main()
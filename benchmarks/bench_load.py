@@ -0,0 +1,497 @@
+"""Drive a realistic traffic mix at the app under gunicorn and time it.
+
+Three steps, each a subcommand:
+
+    seed      build a synthetic dataset of a given size in its own database
+    run       start gunicorn and a job worker on that database (or use
+              --url), log virtual users in and have them browse, search, like, follow and post
+              with weighted odds; report latency percentiles, throughput
+              and queries per request for each route, and save them as JSON
+    compare   diff two saved runs, e.g. from before and after a commit
+
+Run it from the project root like:
+
+    createdb warbler_load
+    python benchmarks/bench_load.py seed --users 10000
+    python benchmarks/bench_load.py run --users 10000 --concurrency 16 \\
+        --seconds 60 --output before.json
+    ... change something ...
+    python benchmarks/bench_load.py run --users 10000 --output after.json
+    python benchmarks/bench_load.py compare before.json after.json
+
+Query counts come from the app's Server-Timing header, so gunicorn runs
+with SERVER_TIMING on. Every seeded user's password is "password".
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "password"
+
+# relative odds of each action a virtual user takes
+MIX = {
+    "home": 35,
+    "profile": 20,
+    "user_search": 10,
+    "like_toggle": 12,
+    "follow": 8,
+    "post": 8,
+    "login": 7,
+}
+
+WORDS = """
+    bird song morning coffee rain garden city river night friend music book
+    dinner walk work sleep summer winter train ocean mountain sunset dream
+    """.split()
+
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+##############################################################################
+# Seeding
+
+
+def seed(args):
+    """Replace the load database's contents with a synthetic dataset."""
+
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from sqlalchemy import text
+
+    from app import app
+    from models import db, passwords, TimelineEntry, User
+    from schema import stamp
+
+    app.config["SQLALCHEMY_ECHO"] = False
+
+    def timed(label, statement, **params):
+        began = time.perf_counter()
+        rows = db.session.execute(text(statement), params).rowcount
+        db.session.commit()
+        print(f"{label}: {rows:,} rows in {time.perf_counter() - began:.1f}s",
+              file=sys.stderr)
+
+    db.drop_all()
+    db.create_all()
+    stamp(db.engine)
+
+    timed("users", """
+        INSERT INTO users (email, username, password, image_url, header_image_url,
+                           bio, location)
+        SELECT 'user' || g || '@example.com', 'user' || g, :password,
+               '/static/images/default-pic.png', '/static/images/warbler-hero.jpg',
+               'Bio of user ' || g, 'Somewhere'
+        FROM generate_series(1, :users) g
+    """, users=args.users, password=passwords.hash(PASSWORD))
+
+    # random()^3 skews toward low ids: a few users are followed by many
+    timed("follows", """
+        INSERT INTO follows (user_following_id, user_being_followed_id)
+        SELECT DISTINCT 1 + g % :users, 1 + floor(power(random(), 3) * :users)::int
+        FROM generate_series(1, :users * :follows) g
+        ON CONFLICT DO NOTHING
+    """, users=args.users, follows=args.follows_per_user)
+    timed("self-follows removed",
+          "DELETE FROM follows WHERE user_following_id = user_being_followed_id")
+
+    timed("messages", """
+        INSERT INTO messages (text, timestamp, user_id)
+        SELECT array_to_string(ARRAY(
+                   SELECT (:words)[1 + floor(random() * :num_words)::int]
+                   FROM generate_series(1, 6 + g % 10)), ' '),
+               now() - random() * interval '365 days',
+               1 + g % :users
+        FROM generate_series(1, :users * :messages) g
+    """, users=args.users, messages=args.messages_per_user,
+         words=WORDS, num_words=len(WORDS))
+
+    timed("likes", """
+        INSERT INTO likes (user_id, message_id)
+        SELECT DISTINCT 1 + g % :users,
+               1 + floor(power(random(), 2) * :num_messages)::int
+        FROM generate_series(1, :users * :likes) g
+    """, users=args.users, likes=args.likes_per_user,
+         num_messages=args.users * args.messages_per_user)
+
+    began = time.perf_counter()
+    TimelineEntry.backfill()
+    User.reset_counts()
+    db.session.commit()
+    print(f"timelines and counters: {time.perf_counter() - began:.1f}s",
+          file=sys.stderr)
+
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
+
+
+##############################################################################
+# Virtual users
+
+
+class NoRedirect(HTTPRedirectHandler):
+    """Time the POST itself, not the page it redirects to."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Results:
+    """Latencies, statuses and query counts by route, shared by threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def record(self, route, elapsed, status, queries):
+        if not self.recording:
+            return
+
+        with self.lock:
+            self.latencies[route].append(elapsed)
+            if queries is not None:
+                self.queries[route].append(queries)
+            if status >= 400:
+                self.errors[route] += 1
+
+
+class VirtualUser:
+    """One logged-in browser session working through the mix."""
+
+    def __init__(self, base_url, user_id, num_users, num_messages, results, rng):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.num_users = num_users
+        self.num_messages = num_messages
+        self.results = results
+        self.rng = rng
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), NoRedirect)
+        self.csrf_token = None
+        self.followed = set()
+
+    def request(self, route, path, data=None):
+        """Make a request, recording it under `route`; returns the body."""
+
+        body = urlencode(data).encode() if data is not None else None
+        began = time.perf_counter()
+
+        try:
+            with self.opener.open(Request(self.base_url + path, data=body)) as resp:
+                content, status, headers = resp.read(), resp.status, resp.headers
+        except HTTPError as error:
+            content, status, headers = error.read(), error.code, error.headers
+
+        elapsed = time.perf_counter() - began
+
+        match = SERVER_TIMING_QUERIES.search(headers.get("Server-Timing", ""))
+        self.results.record(route, elapsed, status,
+                            int(match.group(1)) if match else None)
+
+        return content.decode(errors="replace")
+
+    def login(self):
+        page = self.request("login_form", "/login")
+        token = CSRF_TOKEN.search(page).group(1)
+
+        self.request("login", "/login", {"csrf_token": token,
+                                         "username": f"user{self.user_id}",
+                                         "password": PASSWORD})
+
+        # the token is good for the whole session
+        page = self.request("new_message_form", "/messages/new")
+        self.csrf_token = CSRF_TOKEN.search(page).group(1)
+
+    def other_user(self):
+        return self.rng.randint(1, self.num_users)
+
+    def home(self):
+        self.request("home", "/")
+
+    def profile(self):
+        self.request("profile", f"/users/{self.other_user()}")
+
+    def user_search(self):
+        prefix = str(self.rng.randint(1, 999))
+        self.request("user_search", f"/users?q=user{prefix}")
+
+    def like_toggle(self):
+        message_id = self.rng.randint(1, self.num_messages)
+        self.request("like_toggle", f"/messages/{message_id}/togglelike",
+                     {"csrf_token": self.csrf_token})
+
+    def follow(self):
+        if self.followed and self.rng.random() < 0.5:
+            user_id = self.followed.pop()
+            self.request("unfollow", f"/users/stop-following/{user_id}", {})
+        else:
+            user_id = self.other_user()
+            if user_id != self.user_id:
+                self.followed.add(user_id)
+            self.request("follow", f"/users/follow/{user_id}", {})
+
+    def post(self):
+        text = " ".join(self.rng.choices(WORDS, k=8))
+        self.request("post", "/messages/new",
+                     {"csrf_token": self.csrf_token, "text": text})
+
+    def run_until(self, deadline):
+        actions = list(MIX)
+        weights = list(MIX.values())
+
+        self.login()
+
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(actions, weights)[0])()
+
+
+##############################################################################
+# Running
+
+
+def app_env(args):
+    """The environment for the app's processes, on the load database."""
+
+    return dict(os.environ,
+                DATABASE_URL=args.database_url,
+                WARBLER_CONFIG="production",
+                SERVER_TIMING="1",
+                SQL_STATS_LOG_LEVEL="WARNING",
+                FLASK_APP="app.py")
+
+
+def start_gunicorn(args):
+    """Start gunicorn on the load database; returns (process, base url)."""
+
+    env = app_env(args)
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app",
+         "--workers", str(args.workers),
+         "--threads", str(args.threads),
+         "--bind", f"127.0.0.1:{args.port}"],
+        cwd=ROOT, env=env)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 30
+
+    while time.monotonic() < deadline:
+        try:
+            build_opener().open(base_url + "/login").read()
+            return process, base_url
+        except (URLError, ConnectionError):
+            time.sleep(0.2)
+
+    process.terminate()
+    raise SystemExit("gunicorn didn't start within 30s")
+
+
+def start_job_worker(args):
+    """Start `flask worker`, so posts fan out and deletions purge as live."""
+
+    return subprocess.Popen(
+        [sys.executable, "-m", "flask", "worker",
+         "--concurrency", str(args.job_threads)],
+        cwd=ROOT, env=app_env(args))
+
+
+def percentiles(samples):
+    """p50/p95/p99 and mean of `samples` (seconds), in milliseconds."""
+
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return dict(p50=pct(0.50), p95=pct(0.95), p99=pct(0.99),
+                mean=round(statistics.mean(samples) * 1000, 2))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(args):
+    """Drive the mix at the app and report (and optionally save) the results."""
+
+    processes = []
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        process, base_url = start_gunicorn(args)
+        processes.append(process)
+        if args.job_threads:
+            processes.append(start_job_worker(args))
+
+    results = Results()
+    num_messages = args.users * args.messages_per_user
+    rng = random.Random(args.random_seed)
+    user_ids = rng.sample(range(1, args.users + 1), args.concurrency)
+
+    virtual_users = [VirtualUser(base_url, user_id, args.users, num_messages,
+                                 results, random.Random(rng.random()))
+                     for user_id in user_ids]
+
+    began = time.monotonic()
+    deadline = began + args.warmup + args.seconds
+    threads = [threading.Thread(target=vu.run_until, args=(deadline,))
+               for vu in virtual_users]
+
+    try:
+        for thread in threads:
+            thread.start()
+
+        time.sleep(args.warmup)
+        results.recording = True
+        recording_began = time.monotonic()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.monotonic() - recording_began
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    routes = {}
+    for route, latencies in sorted(results.latencies.items()):
+        queries = results.queries[route]
+        routes[route] = dict(requests=len(latencies),
+                             errors=results.errors[route],
+                             per_sec=round(len(latencies) / elapsed, 2),
+                             latency_ms=percentiles(latencies),
+                             queries=round(statistics.mean(queries), 2) if queries else None)
+
+    total = sum(route["requests"] for route in routes.values())
+    report = dict(commit=git_commit(),
+                  finished=datetime.now(timezone.utc).isoformat(),
+                  dataset=dict(users=args.users,
+                               messages_per_user=args.messages_per_user),
+                  concurrency=args.concurrency,
+                  workers=None if args.url else args.workers,
+                  threads=None if args.url else args.threads,
+                  seconds=round(elapsed, 1),
+                  requests=total,
+                  per_sec=round(total / elapsed, 2),
+                  routes=routes)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"commit {report['commit']}: {total:,} requests in {elapsed:.0f}s "
+          f"({report['per_sec']}/s), {args.concurrency} virtual users")
+    print(f"{'route':<17} {'reqs':>6} {'errs':>5} {'req/s':>7} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}")
+    for name, route in routes.items():
+        latency = route["latency_ms"]
+        print(f"{name:<17} {route['requests']:>6} {route['errors']:>5} "
+              f"{route['per_sec']:>7} {latency['p50']:>8} {latency['p95']:>8} "
+              f"{latency['p99']:>8} {route['queries'] if route['queries'] is not None else '-':>8}")
+
+
+def change(before, after):
+    if not before:
+        return "-"
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def compare(args):
+    """Print how each route's latency and throughput moved between runs."""
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{before['commit']} -> {after['commit']}: throughput "
+          f"{before['per_sec']}/s -> {after['per_sec']}/s "
+          f"({change(before['per_sec'], after['per_sec'])})")
+    print(f"{'route':<17} {'p50':>18} {'p95':>18} {'p99':>18} {'queries':>10}")
+
+    for name in sorted(set(before["routes"]) | set(after["routes"])):
+        old, new = before["routes"].get(name), after["routes"].get(name)
+        if not old or not new:
+            print(f"{name:<17} only in {'after' if new else 'before'}")
+            continue
+
+        cells = []
+        for p in ("p50", "p95", "p99"):
+            was, now = old["latency_ms"][p], new["latency_ms"][p]
+            cells.append(f"{was:.0f}->{now:.0f} {change(was, now):>5}")
+
+        queries = f"{old['queries']}->{new['queries']}" if old["queries"] is not None else "-"
+        print(f"{name:<17} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18} {queries:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_dataset_args(command):
+        command.add_argument("--database-url", default="postgresql:///warbler_load")
+        command.add_argument("--users", type=int, default=10_000)
+        command.add_argument("--messages-per-user", type=int, default=20)
+
+    seeder = commands.add_parser("seed", help=seed.__doc__)
+    add_dataset_args(seeder)
+    seeder.add_argument("--follows-per-user", type=int, default=50)
+    seeder.add_argument("--likes-per-user", type=int, default=20)
+    seeder.set_defaults(func=seed)
+
+    runner = commands.add_parser("run", help=run.__doc__)
+    add_dataset_args(runner)
+    runner.add_argument("--url", help="an already-running app to test instead")
+    runner.add_argument("--workers", type=int, default=2)
+    runner.add_argument("--threads", type=int, default=4)
+    runner.add_argument("--port", type=int, default=8765)
+    runner.add_argument("--job-threads", type=int, default=2,
+                        help="threads for the job worker (0 to run none)")
+    runner.add_argument("--concurrency", type=int, default=16,
+                        help="virtual users making requests at once")
+    runner.add_argument("--warmup", type=float, default=5)
+    runner.add_argument("--seconds", type=float, default=30)
+    runner.add_argument("--random-seed", type=int, default=1)
+    runner.add_argument("--output", help="save the results as JSON here")
+    runner.add_argument("--json", action="store_true")
+    runner.set_defaults(func=run)
+
+    comparer = commands.add_parser("compare", help=compare.__doc__)
+    comparer.add_argument("before")
+    comparer.add_argument("after")
+    comparer.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Measure password checks (logins) per second in one worker process.
+
+Simulates a worker's request threads all logging in at once: each thread
+checks a password through passwords.PasswordHasher as User.authenticate
+does, for a few work factors and hashing pool sizes. Logins that can't get
+a hashing slot within the queue timeout count as rejected (a 503).
+
+Run it from the project root like:
+
+    python benchmarks/bench_logins.py --threads 8 --seconds 5
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_bcrypt import Bcrypt
+
+from passwords import PasswordHasher, PasswordHasherBusy
+
+
+def run(rounds, pool_size, threads, seconds, queue_timeout):
+    """Log in as fast as possible from `threads` threads for `seconds`."""
+
+    hasher = PasswordHasher(Bcrypt(), rounds=rounds, max_workers=pool_size,
+                            queue_timeout=queue_timeout)
+    pw_hash = hasher.hash("password")
+
+    deadline = time.perf_counter() + seconds
+
+    def log_in_repeatedly():
+        done = rejected = 0
+        while time.perf_counter() < deadline:
+            try:
+                hasher.check(pw_hash, "password")
+                done += 1
+            except PasswordHasherBusy:
+                rejected += 1
+        return done, rejected
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as request_threads:
+        results = list(request_threads.map(lambda _: log_in_repeatedly(),
+                                           range(threads)))
+    elapsed = time.perf_counter() - began
+
+    logins = sum(done for done, _ in results)
+    rejected = sum(rejected for _, rejected in results)
+
+    return dict(rounds=rounds,
+                pool_size=pool_size,
+                threads=threads,
+                logins_per_sec=round(logins / elapsed, 1),
+                rejected=rejected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    parser.add_argument("--pool-sizes", type=int, nargs="+",
+                        default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--threads", type=int, default=8,
+                        help="concurrent request threads logging in")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--queue-timeout", type=float, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = [run(rounds, pool_size, args.threads, args.seconds,
+                   args.queue_timeout)
+               for rounds in args.rounds
+               for pool_size in sorted(set(args.pool_sizes))]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.threads} request threads, {args.seconds}s per run")
+    print(f"{'rounds':>6} {'pool':>5} {'logins/sec':>11} {'rejected':>9}")
+    for result in results:
+        print(f"{result['rounds']:>6} {result['pool_size']:>5} "
+              f"{result['logins_per_sec']:>11} {result['rejected']:>9}")
+
+
+if __name__ == "__main__":
+    main()
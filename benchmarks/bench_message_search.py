@@ -0,0 +1,181 @@
+"""Benchmark message search latency on a large messages table.
+
+Seeds a separate benchmark database with synthetic warbles (10M by default)
+if it doesn't already have that many, then times search.search_messages
+for a mix of common, rare, phrase and filtered queries.
+
+Run it from the project root like:
+
+    createdb warbler_bench
+    python benchmarks/bench_message_search.py --messages 10000000
+
+Seeding 10M rows takes a while; later runs against the same database reuse
+them. Pass --json to get machine-readable results.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VOCABULARY = """
+    bird song morning coffee rain garden city river night friend music book
+    dinner walk work sleep summer winter train ocean mountain sunset dream
+    cat dog pizza movie game travel weekend code python flask database warble
+    happy tired excited hungry quiet loud bright early late new old small big
+    feather nest wing flight branch tree forest meadow sky cloud storm wind
+    """.split()
+
+QUERIES = [
+    ("common word", dict(search="bird")),
+    ("rare word", dict(search="meadow")),
+    ("two words", dict(search="coffee morning")),
+    ("phrase", dict(search='"summer rain"')),
+    ("negation", dict(search="train -late")),
+    ("by author", dict(search="bird", author_id=1)),
+    ("last 30 days", dict(search="bird", since_days=30)),
+]
+
+CHUNK = 1_000_000
+
+
+def seed(db, Message, num_messages, num_users):
+    """Top the benchmark database up to `num_messages` synthetic messages."""
+
+    from sqlalchemy import text
+
+    have = db.session.query(Message.id).count()
+    if have >= num_messages:
+        return
+
+    users = db.session.execute(text("SELECT count(*) FROM users")).scalar()
+    if users < num_users:
+        db.session.execute(text("""
+            INSERT INTO users (email, username, password)
+            SELECT 'bench' || g || '@example.com', 'bench' || g, 'x'
+            FROM generate_series(:start, :stop) g
+        """), dict(start=users + 1, stop=num_users))
+        db.session.commit()
+
+    # building the GIN index once at the end is far faster than updating it
+    # for every inserted row
+    db.session.execute(text("DROP INDEX IF EXISTS ix_messages_search_vector"))
+    db.session.commit()
+
+    # word choice is skewed (random()^3) so some words are far more common
+    # than others, as in real text
+    insert = text("""
+        INSERT INTO messages (text, timestamp, user_id)
+        SELECT array_to_string(ARRAY(
+                   SELECT (:words)[1 + floor(power(random(), 3) * :num_words)::int]
+                   FROM generate_series(1, 8 + g % 12)), ' '),
+               now() - random() * interval '730 days',
+               1 + g % :num_users
+        FROM generate_series(:start, :stop) g
+    """)
+
+    for start in range(have + 1, num_messages + 1, CHUNK):
+        stop = min(start + CHUNK - 1, num_messages)
+        began = time.perf_counter()
+        db.session.execute(insert, dict(words=VOCABULARY,
+                                        num_words=len(VOCABULARY),
+                                        num_users=num_users,
+                                        start=start,
+                                        stop=stop))
+        db.session.commit()
+        rate = (stop - start + 1) / (time.perf_counter() - began)
+        print(f"seeded {stop:,} messages ({rate:,.0f} rows/sec)", file=sys.stderr)
+
+    print("building search index...", file=sys.stderr)
+    for index in Message.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE messages"))
+
+
+def time_query(search_messages, runs, since_days=None, **kwargs):
+    """Time the first and second page of a search, `runs` times each."""
+
+    from datetime import datetime, timedelta
+
+    if since_days:
+        kwargs["since"] = datetime.utcnow() - timedelta(days=since_days)
+
+    first, second = [], []
+
+    for _ in range(runs):
+        began = time.perf_counter()
+        page = search_messages(**kwargs)
+        first.append(time.perf_counter() - began)
+
+        if page.next_cursor:
+            began = time.perf_counter()
+            search_messages(cursor=page.next_cursor, **kwargs)
+            second.append(time.perf_counter() - began)
+
+    return first, second
+
+
+def summarize(samples):
+    """p50/p95/p99 of `samples` (seconds) in milliseconds."""
+
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return dict(p50=pct(0.50), p95=pct(0.95), p99=pct(0.99),
+                mean=round(statistics.mean(samples) * 1000, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="postgresql:///warbler_bench")
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    # as in the tests, point the app at its database before importing it
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from app import app
+    from models import db, Message
+    from search import search_messages
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    db.create_all()
+    seed(db, Message, args.messages, args.users)
+
+    results = {}
+    for name, kwargs in QUERIES:
+        search_messages(**{k: v for k, v in kwargs.items() if k != "since_days"})
+        first, second = time_query(search_messages, args.runs, **kwargs)
+        results[name] = dict(first_page=summarize(first),
+                             next_page=summarize(second))
+        db.session.rollback()
+
+    if args.json:
+        print(json.dumps(dict(messages=args.messages, runs=args.runs,
+                              results=results), indent=2))
+        return
+
+    print(f"{args.messages:,} messages, {args.runs} runs per query (ms)")
+    print(f"{'query':<14} {'p50':>8} {'p95':>8} {'p99':>8} {'next p50':>9}")
+    for name, result in results.items():
+        first, second = result["first_page"], result["next_page"]
+        print(f"{name:<14} {first['p50']:>8} {first['p95']:>8} {first['p99']:>8} "
+              f"{second['p50'] if second else '-':>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Load CSVs into Postgres quickly, for seeding large datasets.
+
+COPY streams a CSV file straight into a table: no Python object per row
+and no INSERT statements. Keeping indexes and foreign keys up to date row
+by row costs more than the copy itself, so without_constraints() drops
+them for the load and builds each once at the end -- that's also when
+duplicate or dangling rows in the CSVs show up, as errors.
+
+    with without_constraints(['users', 'messages']):
+        copy_csv('users', 'generator/users.csv')
+        copy_csv('messages', 'generator/messages.csv')
+    reset_sequences(['users', 'messages'])
+
+Everything runs in the session's transaction; commit when done.
+"""
+
+import csv
+import sys
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from models import db
+
+# seconds between progress lines
+PROGRESS_INTERVAL = 1.0
+
+# memory for building each index at the end of a load
+INDEX_BUILD_MEMORY = '512MB'
+
+
+class Progress:
+    """A CSV file that reports rows/sec as COPY reads it."""
+
+    def __init__(self, file, label, out=sys.stderr):
+        self.file = file
+        self.label = label
+        self.out = out
+        self.rows = 0
+        self.started = self.reported = time.perf_counter()
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.rows += data.count(b'\n')
+
+        now = time.perf_counter()
+        if now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            self.report(end='')
+
+        return data
+
+    def report(self, end='\n'):
+        elapsed = time.perf_counter() - self.started
+        # minus the header; close enough while a file with newlines in
+        # quoted fields is still loading
+        rows = max(self.rows - 1, 0)
+        print(f"\r{self.label}: {rows:,} rows in {elapsed:.1f}s "
+              f"({rows / max(elapsed, 1e-6):,.0f} rows/s)",
+              end=end, file=self.out, flush=True)
+
+
+def copy_csv(table, path):
+    """COPY the CSV at `path` into `table`; its header names the columns."""
+
+    with open(path, newline='') as f:
+        columns = next(csv.reader(f))
+
+    quoted = ', '.join(f'"{column}"' for column in columns)
+    cursor = db.session.connection().connection.cursor()
+
+    with open(path, 'rb') as f:
+        progress = Progress(f, table)
+        cursor.copy_expert(
+            f"COPY {table} ({quoted}) FROM STDIN WITH (FORMAT csv, HEADER true)",
+            progress)
+        progress.rows = cursor.rowcount + 1
+        progress.report()
+
+    return cursor.rowcount
+
+
+def constraints_and_indexes(tables):
+    """(constraints, indexes) on `tables`, as (table, name, definition) lists.
+
+    Constraints are foreign keys and unique constraints -- not primary
+    keys, which ON CONFLICT and sequence resets need, and which serial ids
+    append to cheaply. Indexes are those no constraint owns.
+    """
+
+    constraints = db.session.execute(text("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = ANY(CAST(:tables AS regclass[])) AND contype IN ('f', 'u')
+        ORDER BY contype
+    """), {'tables': tables}).fetchall()
+
+    indexes = db.session.execute(text("""
+        SELECT indrelid::regclass::text, indexrelid::regclass::text,
+               pg_get_indexdef(indexrelid)
+        FROM pg_index
+        WHERE indrelid = ANY(CAST(:tables AS regclass[]))
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid)
+    """), {'tables': tables}).fetchall()
+
+    return constraints, indexes
+
+
+@contextmanager
+def without_constraints(tables, out=sys.stderr):
+    """Drop `tables`' foreign keys and secondary indexes until the block ends.
+
+    Foreign keys into `tables` from other tables are dropped too, since
+    they'd block the drops. Unique constraints come back before foreign
+    keys, which may need them.
+    """
+
+    db.session.execute(text(f"SET LOCAL maintenance_work_mem = '{INDEX_BUILD_MEMORY}'"))
+
+    referencing = [name for name, in db.session.execute(text("""
+        SELECT DISTINCT conrelid::regclass::text
+        FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = ANY(CAST(:tables AS regclass[]))
+    """), {'tables': tables})]
+
+    constraints, indexes = constraints_and_indexes(sorted(set(tables) | set(referencing)))
+
+    # foreign keys sort before the unique constraints they may depend on
+    for table, name, _ in constraints:
+        db.session.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+    for _, name, _ in indexes:
+        db.session.execute(text(f'DROP INDEX {name}'))
+
+    yield
+
+    began = time.perf_counter()
+
+    for _, _, definition in indexes:
+        db.session.execute(text(definition))
+    for table, name, definition in reversed(constraints):
+        db.session.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'))
+
+    print(f"{len(indexes)} indexes and {len(constraints)} constraints rebuilt in "
+          f"{time.perf_counter() - began:.1f}s", file=out)
+
+
+def reset_sequences(tables):
+    """Set the id sequences of `tables` past their largest ids."""
+
+    serial = db.session.execute(text("""
+        SELECT table_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = ANY(:tables)
+          AND column_name = 'id' AND column_default LIKE 'nextval(%'
+    """), {'tables': tables}).scalars().all()
+
+    for table in serial:
+        db.session.execute(text(f"""
+            SELECT setval(pg_get_serial_sequence('{table}', 'id'),
+                          coalesce(max(id), 1), max(id) IS NOT NULL)
+            FROM {table}
+        """))
@@ -0,0 +1,67 @@
+"""A small in-process cache for data that's expensive to fetch per request."""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """A thread-safe cache holding at most `maxsize` entries.
+
+    When full, the least recently used entry is evicted. If `ttl` (seconds)
+    is given, entries also expire that long after they were set -- which
+    bounds how stale a value can get in other processes that never see its
+    invalidation.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        """Return the value for `key`, or `default` if missing or expired."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return default
+
+            value, expires = entry
+
+            if expires is not None and expires <= self.clock():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store `value` for `key`, evicting the oldest entry if full."""
+
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """Forget `key`, if it's cached."""
+
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Forget everything."""
+
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
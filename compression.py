@@ -0,0 +1,177 @@
+"""WSGI middleware that gzip- or brotli-compresses responses.
+
+Compresses text responses (HTML, CSS, JS, JSON, SVG) in the best encoding
+the client accepts: brotli (from the `Brotli` package in requirements.txt;
+without it, only gzip is offered), else gzip. Bodies are compressed chunk by chunk and flushed after each
+one, so streamed responses still reach the client as they're produced.
+
+Responses are left alone when they're already encoded (e.g. precompressed
+assets), smaller than `min_size`, partial (206) or bodiless, or marked
+`Cache-Control: no-transform`. Compressed responses get a weak ETag, as
+the bytes no longer match the uncompressed representation.
+
+The app can also leave a response uncompressed by setting
+environ[SKIP_COMPRESSION] while handling its request. Compressing a page
+that holds a secret (like a CSRF token) alongside input an attacker
+controls leaks the secret through the compressed size (BREACH).
+"""
+
+import zlib
+
+from werkzeug.datastructures import Headers, ResponseCacheControl
+from werkzeug.http import (parse_accept_header, parse_cache_control_header,
+                           parse_set_header)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml',
+    'image/svg+xml',
+}
+
+UNCOMPRESSIBLE_STATUSES = {204, 206, 304}
+
+# WSGI environ key; set it to leave the request's response uncompressed
+SKIP_COMPRESSION = 'warbler.skip_compression'
+
+
+class GzipCompressor:
+    """Streaming gzip, flushing at each chunk boundary."""
+
+    def __init__(self, level):
+        # wbits=31: zlib's deflate with a gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return (self.compressor.compress(chunk)
+                + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    """Streaming brotli, flushing at each chunk boundary."""
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, chunk):
+        return self.compressor.process(chunk) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class CompressionMiddleware:
+    """Compress `app`'s responses for clients that accept it."""
+
+    def __init__(self, app, min_size=500, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def encoding_for(self, environ):
+        """The best encoding `environ`'s client accepts, or None."""
+
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+
+        return None
+
+    def compressor_for(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+    def compressible(self, status, headers):
+        """Could a response with this status and these headers be compressed?"""
+
+        mimetype = headers.get('Content-Type', '').split(';')[0].strip()
+        cache_control = parse_cache_control_header(
+            headers.get('Cache-Control'), cls=ResponseCacheControl)
+        length = headers.get('Content-Length')
+
+        return (int(status.split()[0]) not in UNCOMPRESSIBLE_STATUSES
+                and mimetype in COMPRESSIBLE_TYPES
+                and 'Content-Encoding' not in headers
+                and not cache_control.no_transform
+                and (length is None or int(length) >= self.min_size))
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return self.app(environ, start_response)
+
+        encoding = self.encoding_for(environ)
+        state = {}
+
+        def compressing_start_response(status, response_headers, exc_info=None):
+            headers = Headers(response_headers)
+            state['started'] = True
+
+            if not environ.get(SKIP_COMPRESSION) and self.compressible(status, headers):
+                # caches must keep compressed and plain copies apart
+                vary = parse_set_header(headers.get('Vary'))
+                vary.add('Accept-Encoding')
+                headers['Vary'] = vary.to_header()
+
+                if encoding:
+                    state['compressor'] = self.compressor_for(encoding)
+                    headers['Content-Encoding'] = encoding
+                    headers.pop('Content-Length', None)
+
+                    etag = headers.get('ETag')
+                    if etag and not etag.startswith('W/'):
+                        headers['ETag'] = f'W/{etag}'
+
+            write = start_response(status, headers.to_wsgi_list(), exc_info)
+
+            def compressing_write(data):
+                compressor = state.get('compressor')
+                write(compressor.compress(data) if compressor else data)
+
+            return compressing_write
+
+        body = self.app(environ, compressing_start_response)
+
+        # most apps start the response before returning the body; if this
+        # one isn't being compressed, hand it back untouched
+        if state.get('started') and 'compressor' not in state:
+            return body
+
+        return self.compress_body(body, state)
+
+    def compress_body(self, body, state):
+        """Yield `body`, compressed if start_response chose to."""
+
+        try:
+            for chunk in body:
+                compressor = state.get('compressor')
+
+                if compressor is None:
+                    yield chunk
+                    continue
+
+                if not chunk:
+                    continue
+
+                compressed = compressor.compress(chunk)
+                if compressed:
+                    yield compressed
+
+            compressor = state.get('compressor')
+            if compressor is not None:
+                yield compressor.finish()
+
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
@@ -0,0 +1,166 @@
+"""Configuration profiles: development, testing and production.
+
+The profile comes from WARBLER_CONFIG, or, if that isn't set, is
+development when FLASK_ENV=development and production otherwise. Every
+setting can still be overridden from the environment.
+
+Database settings:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW   connections kept open, and extra ones
+                                    allowed under load, per worker process
+    DB_POOL_TIMEOUT                 seconds to wait for a free connection
+    DB_POOL_RECYCLE                 seconds before a connection is replaced
+    DB_POOL_PRE_PING                check connections before handing them out
+    DB_STATEMENT_TIMEOUT            milliseconds before Postgres cancels a
+                                    statement run for a request (0 for none);
+                                    CLI commands and `flask worker` jobs run
+                                    without one
+    DB_PGBOUNCER                    set when connecting through PgBouncer in
+                                    transaction-pooling mode: PgBouncer does
+                                    the pooling, and the statement timeout is
+                                    set per transaction rather than per
+                                    connection
+"""
+
+import os
+
+from sqlalchemy.pool import NullPool
+
+from dbpool import InstrumentedQueuePool
+
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+
+    if value is None:
+        return default
+
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_url():
+    url = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
+
+    # fix incorrect database URIs currently returned by Heroku's pg setup
+    return url.replace('postgres://', 'postgresql://')
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_DATABASE_URI = database_url()
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = env_flag('SQLALCHEMY_ECHO')
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', True)
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 10000))
+    DB_PGBOUNCER = env_flag('DB_PGBOUNCER')
+
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) or None
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+
+    CURRENT_USER_CACHE_SIZE = int(os.environ.get('CURRENT_USER_CACHE_SIZE', 1024))
+    CURRENT_USER_CACHE_TTL = float(os.environ.get('CURRENT_USER_CACHE_TTL', 60))
+    MESSAGE_FRAGMENT_CACHE_SIZE = int(os.environ.get('MESSAGE_FRAGMENT_CACHE_SIZE', 10000))
+
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+    COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+
+    # background jobs (see jobs.py); JOBS_RUN_INLINE runs them in the
+    # request instead of queueing them for `flask worker`
+    JOBS_RUN_INLINE = env_flag('JOBS_RUN_INLINE')
+    JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 600))
+    JOB_RETRY_BASE = float(os.environ.get('JOB_RETRY_BASE', 10))
+    JOB_RETRY_MAX = float(os.environ.get('JOB_RETRY_MAX', 3600))
+
+    # token for /_status/pool; the endpoint is off without one
+    STATUS_TOKEN = os.environ.get('STATUS_TOKEN')
+
+    # per-request query stats (see instrumentation.py)
+    SERVER_TIMING = env_flag('SERVER_TIMING')
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+    SQL_STATS_LOG_LEVEL = os.environ.get('SQL_STATS_LOG_LEVEL', 'INFO')
+
+
+class DevelopmentConfig(Config):
+    """Local development: log every statement."""
+
+    SQLALCHEMY_ECHO = env_flag('SQLALCHEMY_ECHO', True)
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+    SERVER_TIMING = env_flag('SERVER_TIMING', True)
+
+
+class TestingConfig(Config):
+    """The test suite: quiet, fast password hashing, small pool."""
+
+    TESTING = True
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 5))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 2))
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+    SERVER_TIMING = True
+    SQL_STATS_LOG_LEVEL = os.environ.get('SQL_STATS_LOG_LEVEL', 'WARNING')
+    JOBS_RUN_INLINE = env_flag('JOBS_RUN_INLINE', True)
+
+
+class ProductionConfig(Config):
+    """Deployed: the shared defaults, which are tuned for production."""
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def profile_name():
+    default = 'development' if os.environ.get('FLASK_ENV') == 'development' else 'production'
+    return os.environ.get('WARBLER_CONFIG', default)
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the DB_* settings in `config`."""
+
+    if config['DB_PGBOUNCER']:
+        # PgBouncer pools connections and rejects startup options; the
+        # statement timeout is set with SET LOCAL (see dbpool.init_app)
+        return {'poolclass': NullPool}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+    if config['DB_STATEMENT_TIMEOUT']:
+        options['connect_args'] = {
+            'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}",
+        }
+
+    return options
+
+
+def configure(app, name=None):
+    """Load the `name` profile (by default, the environment's) into `app`."""
+
+    name = name or profile_name()
+
+    try:
+        profile = PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown WARBLER_CONFIG {name!r}; "
+                         f"expected one of {', '.join(PROFILES)}.")
+
+    app.config.from_object(profile)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
@@ -0,0 +1,83 @@
+"""The logged-in user, cached between requests.
+
+Every request needs a few fields of the logged-in user (id, username,
+avatar) for the nav and permission checks, but few change anything about
+them. add_user_to_g gets a CurrentUser snapshot of those fields from an
+LRU/TTL cache, so most requests make no database round-trip for it; routes
+that mutate the user call .load() for the full ORM object.
+
+Routes that change the cached fields (profile edits, password changes,
+deletion) must call forget() so this process re-reads them. Other worker
+processes pick the change up when their entry's TTL runs out.
+"""
+
+from collections import namedtuple
+
+from werkzeug.exceptions import NotFound
+
+from cache import LRUCache
+from models import User
+
+SNAPSHOT_FIELDS = ['id', 'username', 'email', 'image_url',
+                   'header_image_url', 'bio', 'location']
+
+
+class CurrentUser(namedtuple('CurrentUser', SNAPSHOT_FIELDS)):
+    """Read-only snapshot of the logged-in user's core fields."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{field: getattr(user, field) for field in SNAPSHOT_FIELDS})
+
+    def load(self):
+        """The full User for this snapshot, for routes that change it.
+
+        Repeat calls in a request are answered from the session.
+        """
+
+        user = User.query.get(self.id)
+
+        if user is None or user.deleted_at:
+            raise NotFound()
+
+        return user
+
+
+class CurrentUserCache:
+    """CurrentUser snapshots by user id, bounded in size and age."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.snapshots = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id):
+        """The CurrentUser for `user_id`, loading it on a cache miss.
+
+        Raises NotFound if there's no such user (or they deleted their
+        account).
+        """
+
+        snapshot = self.snapshots.get(user_id)
+
+        if snapshot is None:
+            user = User.query.get(user_id)
+
+            if user is None or user.deleted_at:
+                raise NotFound()
+
+            snapshot = self.remember(user)
+
+        return snapshot
+
+    def remember(self, user):
+        """Cache (and return) a fresh snapshot of `user`."""
+
+        snapshot = CurrentUser.from_user(user)
+        self.snapshots.set(user.id, snapshot)
+        return snapshot
+
+    def forget(self, user_id):
+        """Drop `user_id`'s snapshot after its cached fields change."""
+
+        self.snapshots.delete(user_id)
@@ -0,0 +1,146 @@
+"""Connection pool instrumentation and PgBouncer support.
+
+InstrumentedQueuePool is SQLAlchemy's QueuePool, timing how long each
+checkout waits for a connection. pool_stats collects those times with the
+pool's size, checked-out count and overflow, which is what sizing
+gunicorn workers (and their threads) against the database's connection
+limit needs: a pool that's often saturated, or checkouts that wait, mean
+more request threads than connections.
+
+The numbers are per worker process; /_status/pool reports the worker that
+answers.
+"""
+
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+from flask import has_request_context
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# checkout waits kept for percentiles
+RECENT_WAITS = 1000
+
+
+class PoolStats:
+    """Checkout counts and wait times, shared by a process's pools."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = 0
+            self.waited = 0
+            self.timeouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+            self.recent_waits = deque(maxlen=RECENT_WAITS)
+
+    def record_checkout(self, wait, saturated):
+        """Record a checkout that took `wait` seconds.
+
+        `saturated` means every connection was in use when it began, so it
+        had to wait for one to come back.
+        """
+
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.recent_waits.append(wait)
+
+            if saturated:
+                self.waited += 1
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def snapshot(self, pool):
+        """The stats so far, plus `pool`'s current state, as a dict."""
+
+        with self.lock:
+            waits = sorted(self.recent_waits)
+            stats = {
+                'pid': os.getpid(),
+                'checkouts': self.checkouts,
+                'waited': self.waited,
+                'timeouts': self.timeouts,
+                'mean_wait_ms': round(self.total_wait / self.checkouts * 1000, 3)
+                                if self.checkouts else 0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+            }
+
+        if waits:
+            stats['p95_wait_ms'] = round(
+                waits[min(len(waits) - 1, int(0.95 * len(waits)))] * 1000, 3)
+            stats['median_wait_ms'] = round(statistics.median(waits) * 1000, 3)
+
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + pool._max_overflow
+            stats.update(size=pool.size(),
+                         max_overflow=pool._max_overflow,
+                         checked_out=pool.checkedout(),
+                         overflow=max(pool.overflow(), 0),
+                         saturation=round(pool.checkedout() / capacity, 2))
+        else:
+            stats['pool'] = type(pool).__name__
+
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait in pool_stats.
+
+    A checkout's time includes opening a new connection when the pool
+    makes one.
+    """
+
+    def _do_get(self):
+        saturated = self._pool.empty() and self._overflow >= self._max_overflow
+        began = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_timeout()
+            raise
+
+        pool_stats.record_checkout(time.perf_counter() - began, saturated)
+
+        return connection
+
+
+def init_app(app, engine):
+    """Set up `engine` for `app`'s DB_* settings.
+
+    The statement timeout is for requests. It's a connection option (see
+    config.engine_options), so requests pay nothing for it, and CLI
+    commands and jobs, which share the engine and legitimately run long
+    statements, lift it with SET LOCAL for each transaction they begin.
+
+    Through PgBouncer's transaction pooling, a connection's session
+    settings would leak to whichever client gets it next, so there the
+    timeout is set with SET LOCAL at the start of each request transaction
+    instead.
+    """
+
+    timeout = app.config['DB_STATEMENT_TIMEOUT']
+    pgbouncer = app.config['DB_PGBOUNCER']
+
+    if timeout:
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(conn):
+            if has_request_context():
+                if pgbouncer:
+                    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+            elif not pgbouncer:
+                conn.exec_driver_sql("SET LOCAL statement_timeout = 0")
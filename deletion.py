@@ -0,0 +1,198 @@
+"""Account deletion: tombstone in the request, purge in the background.
+
+Deleting a User through the ORM loads and cascades every message, like
+and follow they have inside the request, which for a long-lived account
+can outlast the statement timeout. Instead, tombstone() sets
+users.deleted_at, which hides the account and its messages at once (see
+User.active and Message.visible), and records an AccountDeletion. purge()
+then deletes the rows a batch at a time, each batch committed along with
+the AccountDeletion's progress counts, so an interrupted purge just picks
+up where it stopped:
+
+1. their messages' timeline entries, through the author index
+2. follows either way, fixing the other users' counters
+3. likes of their messages, fixing the likers' likes_count
+4. their messages
+5. their likes, and their own timeline
+6. the user row
+
+Clearing the authored timeline entries first keeps every batch to
+batch_size rows: unfollowing, or deleting a message, would otherwise drop
+a timeline entry for each of the message's readers.
+
+delete_user enqueues a purge-account job (see tasks.py) in the same
+transaction as the tombstone; a large account's purge can outlast the job
+timeout, so each batch heartbeats the job. `flask purge-accounts` purges
+any accounts left pending in the current process.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+
+from jobs import queue
+from models import db, AccountDeletion, Follows, Like, Message, TimelineEntry, User
+
+BATCH_SIZE = 1000
+
+
+def tombstone(user_id):
+    """Hide `user_id`'s account and record it for purging; commit after.
+
+    Two single-row writes, however much the account has posted.
+    """
+
+    now = datetime.utcnow()
+
+    (User.query
+     .filter_by(id=user_id)
+     .update({User.deleted_at: now}, synchronize_session=False))
+
+    db.session.execute(insert(AccountDeletion)
+                       .values(user_id=user_id, requested_at=now)
+                       .on_conflict_do_nothing())
+
+
+def delete_authored_entries(user_id, batch_size):
+    """Delete a batch of the timeline entries for `user_id`'s messages."""
+
+    batch = (select(TimelineEntry.user_id, TimelineEntry.message_id)
+             .where(TimelineEntry.author_id == user_id)
+             .limit(batch_size))
+
+    return execute_delete(delete(TimelineEntry)
+                          .where(tuple_(TimelineEntry.user_id,
+                                        TimelineEntry.message_id).in_(batch)))
+
+
+def delete_follows(user_id, batch_size):
+    """Unfollow a batch of the follows to or from `user_id`.
+
+    Their messages are off everyone's timelines by now, and their own
+    timeline goes last, so only the counters need fixing.
+    """
+
+    edges = (db.session
+             .query(Follows.user_following_id, Follows.user_being_followed_id)
+             .filter(or_(Follows.user_following_id == user_id,
+                         Follows.user_being_followed_id == user_id))
+             .limit(batch_size)
+             .all())
+
+    return Follows.remove(edges, timelines=False)
+
+
+def delete_likes_received(user_id, batch_size):
+    """Delete a batch of likes of `user_id`'s messages, off the likers' counts."""
+
+    batch = (select(Like.id)
+             .join(Message, Message.id == Like.message_id)
+             .where(Message.user_id == user_id)
+             .limit(batch_size))
+
+    removed = (delete(Like)
+               .where(Like.id.in_(batch))
+               .returning(Like.user_id)
+               .cte('removed'))
+
+    likers = (select(removed.c.user_id, func.count().label('count'))
+              .group_by(removed.c.user_id)
+              .subquery())
+
+    counted = (update(User)
+               .where(User.id == likers.c.user_id)
+               .values(likes_count=User.likes_count - likers.c.count)
+               .returning(User.id)
+               .cte('counted'))
+
+    deleted, _ = db.session.execute(select(
+        select(func.count()).select_from(removed).scalar_subquery(),
+        select(func.count()).select_from(counted).scalar_subquery())).one()
+
+    return deleted
+
+
+def delete_messages(user_id, batch_size):
+    """Delete a batch of `user_id`'s messages."""
+
+    batch = select(Message.id).where(Message.user_id == user_id).limit(batch_size)
+
+    return execute_delete(delete(Message).where(Message.id.in_(batch)))
+
+
+def delete_likes_given(user_id, batch_size):
+    """Delete a batch of `user_id`'s likes."""
+
+    batch = select(Like.id).where(Like.user_id == user_id).limit(batch_size)
+
+    return execute_delete(delete(Like).where(Like.id.in_(batch)))
+
+
+def delete_timeline(user_id, batch_size):
+    """Delete a batch of the entries on `user_id`'s home timeline."""
+
+    batch = (select(TimelineEntry.message_id)
+             .where(TimelineEntry.user_id == user_id)
+             .limit(batch_size))
+
+    return execute_delete(delete(TimelineEntry)
+                          .where(TimelineEntry.user_id == user_id,
+                                 TimelineEntry.message_id.in_(batch)))
+
+
+def execute_delete(stmt):
+    """Run a DELETE without syncing the session, returning its row count."""
+
+    result = db.session.execute(stmt.execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+# (step, AccountDeletion counter), in the order they run
+STEPS = [
+    (delete_authored_entries, 'timeline_entries_deleted'),
+    (delete_follows, 'follows_deleted'),
+    (delete_likes_received, 'likes_deleted'),
+    (delete_messages, 'messages_deleted'),
+    (delete_likes_given, 'likes_deleted'),
+    (delete_timeline, 'timeline_entries_deleted'),
+]
+
+
+def purge(user_id, batch_size=BATCH_SIZE):
+    """Delete tombstoned `user_id`'s rows a batch at a time, then the user.
+
+    Commits after every batch. Returns the finished AccountDeletion.
+    """
+
+    if db.session.query(User.active().filter_by(id=user_id).exists()).scalar():
+        raise ValueError(f"User #{user_id} hasn't deleted their account.")
+
+    for step, progress in STEPS:
+        while deleted := step(user_id, batch_size):
+            counter = getattr(AccountDeletion, progress)
+            (AccountDeletion.query
+             .filter_by(user_id=user_id)
+             .update({counter: counter + deleted}, synchronize_session=False))
+            queue.heartbeat()
+            db.session.commit()
+
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+    (AccountDeletion.query
+     .filter_by(user_id=user_id)
+     .update({AccountDeletion.finished_at: datetime.utcnow()},
+             synchronize_session=False))
+    db.session.commit()
+
+    return AccountDeletion.query.get(user_id)
+
+
+def pending():
+    """Ids of the deleted accounts not yet purged, oldest request first."""
+
+    ids = (db.session
+           .query(AccountDeletion.user_id)
+           .filter(AccountDeletion.finished_at.is_(None))
+           .order_by(AccountDeletion.requested_at))
+
+    return [user_id for user_id, in ids]
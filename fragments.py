@@ -0,0 +1,41 @@
+"""Cache of rendered message markup shared by every viewer.
+
+A message's list item looks the same to everyone -- author avatar and
+username, date, text -- except for the like star. The shared part is
+rendered once and cached per message id together with the author's
+profile_version; templates layer the viewer's star on top. A profile edit
+bumps profile_version, so the author's cached items re-render on next use.
+"""
+
+from markupsafe import Markup
+
+from cache import LRUCache
+
+
+class FragmentCache:
+    """Rendered message bodies, keyed by message id, in a bounded LRU."""
+
+    def __init__(self, jinja_env, maxsize=10000,
+                 template='messages/_item_body.html'):
+        self.jinja_env = jinja_env
+        self.template = template
+        self.bodies = LRUCache(maxsize=maxsize)
+
+    def message_body(self, msg):
+        """The shared markup of `msg`'s list item, rendering it if needed."""
+
+        version = msg.user.profile_version
+        cached = self.bodies.get(msg.id)
+
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        html = Markup(self.jinja_env.get_template(self.template).render(msg=msg))
+        self.bodies.set(msg.id, (version, html))
+
+        return html
+
+    def forget_message(self, message_id):
+        """Drop a message's markup, e.g. once it's deleted."""
+
+        self.bodies.delete(message_id)
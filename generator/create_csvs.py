@@ -1,15 +1,31 @@
 """Generate CSVs of random data for Warbler.
 
 Students won't need to run this for the exercise; they will just use the CSV
-files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+files in this directory. Run it to make a dataset of another size:
+
+    python generator/create_csvs.py --users 1000000 --messages 100000000 \\
+        --out generator/generated --workers 8
+    python seed.py generator/generated
+
+It writes users.csv, messages.csv, follows.csv and likes.csv. Output is the
+same for the same --seed and sizes, however many workers make it, and needs
+no network access. Rows are written as they're made, a chunk of users or
+messages per task, so memory stays flat whatever the size.
+
+Popularity follows a power law: a few users have most of the followers and
+a few messages most of the likes, as on a real site. Active posters are
+skewed the same way.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
+import os
+import random
+import shutil
+import sys
+from datetime import datetime
+from multiprocessing import Pool
+
 from helpers import get_random_datetime
 
 MAX_WARBLER_LENGTH = 140
@@ -17,14 +33,20 @@ MAX_WARBLER_LENGTH = 140
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+# bcrypt of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-fake = Faker()
+# rows per task; a worker holds one chunk's dedupe sets at a time
+CHUNK_SIZE = 100_000
 
-# Generate random profile image URLs to use for users
+# bigger is more skewed: with 3, the top 1% of users get ~20% of follows
+POPULARITY_SKEW = 3
+ACTIVITY_SKEW = 2
+
+# timestamps run back two years from here, so output doesn't depend on today
+LATEST = datetime(2021, 7, 1)
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +54,206 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    f"https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_{name}_1280.jpg"
+    for name in ["mnh0n9pHJW1st5lhmo1", "mnh0uemhCk1st5lhmo1", "mnh121HEWa1st5lhmo1",
+                 "mnh17lfd9R1st5lhmo1", "mnh1d7s3UD1st5lhmo1", "mnh1jdFvHR1st5lhmo1",
+                 "mnh1uhYnog1st5lhmo1", "mnh25vNOvI1st5lhmo1", "mnh29fxz111st5lhmo1",
+                 "mnh2m1hnS81st5lhmo1", "mo1h6tGOZf1st5lhmo1"]
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+WORDS = """
+    able about across act add after again against age ago agree air all almost
+    along already also always among animal answer any appear area arm around
+    art ask away back bad bag ball bank bar base beat beautiful bed begin
+    behind best better big bird black blue board boat body book born both box
+    bring brother build business buy call camera car card care carry case
+    catch cause center chair chance change child choice city class clear close
+    coach cold color come common cost could country course cover cup cut dark
+    daughter day deal dinner direction dog door draw dream drive drop early
+    east easy eat edge end energy enjoy enough evening event every eye face
+    fact fall family far fast father field fill film find fine fire first fish
+    floor fly food foot force forest forget form forward free friend front
+    fruit full fun future game garden glass go good great green ground group
+    grow hair half hand happy hard head hear heart heat help here high hill
+    history hold home hope horse hot hour house idea image inside island job
+    join just keep key kid kind kitchen know lake land language large last
+    late laugh lead learn leave left letter life light line list listen little
+    live long look lose love low machine main make man many map market matter
+    meet memory middle minute miss moment money month moon morning mother
+    mountain move movie music name nature near never new news next night north
+    note nothing notice now number ocean off offer office often old open order
+    other outside page paint paper park part party pass past pay peace people
+    perhaps person pick picture piece place plan plant play point poor power
+    pretty pull push put question quick quiet rain reach read ready real
+    reason red remember rest rich ride right river road rock room rule run
+    safe sail same save say school science sea season seat second see send
+    serve set shape share ship shore short show side sign simple sing sister
+    sit size sky sleep slow small smile snow soft song soon sound south space
+    speak spring stand star start station stay step still stone stop store
+    story street strong student study summer sun sure table take talk teach
+    team tell test thank thing think through time today together tomorrow top
+    town track trade train travel tree trip true try turn under until up use
+    valley visit voice wait walk wall want war warm watch water wave way
+    weather week west wheel white whole wind window winter wish wonder wood
+    word work world write year yellow young
+    """.split()
+
+PLACES = """
+    Ashford Bayview Brookfield Cedar Clearwater Fairview Franklin Georgetown
+    Greenville Hillcrest Lakeside Madison Maplewood Milford Oakland Riverside
+    Salem Springfield Westfield Woodland
+    """.split()
+
+
+def chunk_rng(seed, table, chunk):
+    """An RNG for one chunk of one table: chunks don't depend on each other."""
+
+    return random.Random(f"{seed}:{table}:{chunk}")
+
+
+def popular(rng, count, skew=POPULARITY_SKEW):
+    """A 1-based rank under `count`, low ranks much more likely than high."""
+
+    return 1 + int(count * rng.random() ** skew)
+
+
+# multipliers for scatter(): primes bigger than any `count`, so coprime to it
+FOLLOWED_ORDER = 2_654_435_761
+POSTING_ORDER = 2_246_822_519
+
+
+def scatter(rank, count, order=FOLLOWED_ORDER):
+    """Map a rank to an id so popular users aren't just the oldest.
+
+    Multiplying by a number coprime to `count` permutes 1..count (mod count);
+    different multipliers give unrelated orders.
+    """
+
+    return rank * order % count + 1
+
+
+def degree(rng, mean):
+    """How many follows or likes a user makes: skewed, averaging ~`mean`."""
+
+    return int(rng.expovariate(1 / mean)) if mean else 0
+
+
+def sentence(rng, length):
+    words = rng.choices(WORDS, k=length)
+    return " ".join(words).capitalize() + "."
+
+
+def user_rows(rng, first, last, args):
+    for i in range(first, last):
+        username = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{i}"
+        yield dict(
+            email=f"{username}@example.com",
+            username=username,
+            image_url=rng.choice(image_urls),
+            password=PASSWORD,
+            bio=sentence(rng, rng.randint(4, 10)),
+            header_image_url=rng.choice(header_image_urls),
+            location=f"{rng.choice(['', 'North ', 'South ', 'East ', 'West '])}{rng.choice(PLACES)}",
+        )
+
+
+def message_rows(rng, first, last, args):
+    for _ in range(first, last):
+        text = sentence(rng, rng.randint(3, 25))[:MAX_WARBLER_LENGTH]
+        yield dict(
+            text=text,
+            timestamp=get_random_datetime(rng, LATEST),
+            # who posts most is unrelated to who's most followed: if the
+            # same few users did both, timelines would be enormous
+            user_id=scatter(popular(rng, args.users, ACTIVITY_SKEW), args.users, POSTING_ORDER),
+        )
+
+
+def follow_rows(rng, first, last, args):
+    # a follower's follows are deduped; chunks are by follower, so that's
+    # enough for (followed, follower) pairs to be unique
+    for follower in range(first + 1, last + 1):
+        followed = set()
+        for _ in range(min(degree(rng, args.follows_per_user), args.users - 1)):
+            user_id = scatter(popular(rng, args.users), args.users)
+            if user_id != follower and user_id not in followed:
+                followed.add(user_id)
+                yield dict(user_being_followed_id=user_id, user_following_id=follower)
+
+
+def like_rows(rng, first, last, args):
+    for user_id in range(first + 1, last + 1):
+        liked = set()
+        for _ in range(min(degree(rng, args.likes_per_user), args.messages)):
+            message_id = scatter(popular(rng, args.messages), args.messages)
+            if message_id not in liked:
+                liked.add(message_id)
+                yield dict(user_id=user_id, message_id=message_id)
+
+
+TABLES = {
+    'users': (USERS_CSV_HEADERS, user_rows, 'users'),
+    'messages': (MESSAGES_CSV_HEADERS, message_rows, 'messages'),
+    'follows': (FOLLOWS_CSV_HEADERS, follow_rows, 'users'),
+    'likes': (LIKES_CSV_HEADERS, like_rows, 'users'),
+}
+
+
+def write_chunk(task):
+    """Write one chunk of a table to its own part file; returns its path."""
+
+    table, chunk, args = task
+    headers, rows, _ = TABLES[table]
+    first = chunk * CHUNK_SIZE
+    last = min(first + CHUNK_SIZE, getattr(args, TABLES[table][2]))
+
+    path = os.path.join(args.out, f"{table}.csv.part{chunk:06d}")
+    with open(path, 'w', newline='') as part:
+        csv.DictWriter(part, fieldnames=headers, lineterminator='\n').writerows(
+            rows(chunk_rng(args.seed, table, chunk), first, last, args))
+
+    return path
+
+
+def generate(table, pool, args):
+    """Write `table`'s CSV, its chunks made in parallel and joined in order."""
+
+    headers, _, size_from = TABLES[table]
+    chunks = -(-getattr(args, size_from) // CHUNK_SIZE)
+    tasks = [(table, chunk, args) for chunk in range(chunks)]
+
+    with open(os.path.join(args.out, f"{table}.csv"), 'w', newline='') as out:
+        csv.DictWriter(out, fieldnames=headers, lineterminator='\n').writeheader()
+
+        for done, path in enumerate(pool.imap(write_chunk, tasks), 1):
+            with open(path, newline='') as part:
+                shutil.copyfileobj(part, out)
+            os.remove(path)
+            print(f"\r{table}: {done}/{chunks} chunks", end='', file=sys.stderr)
+
+    print(file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows-per-user', type=float, default=17)
+    parser.add_argument('--likes-per-user', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='generator/generated',
+                        help="directory to write to (the CSVs alongside this "
+                             "script are the ones seed.py loads by default)")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    with Pool(args.workers) as pool:
+        for table in TABLES:
+            generate(table, pool, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,14 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import datetime, timedelta
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(rng, latest=None, year_gap=2):
+    """Get a random datetime within a few years before `latest` (or now)."""
 
-    now = datetime.now()
+    now = latest or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
 
-    return datetime.fromtimestamp(random_timestamp)
+    # naive datetime arithmetic, not epoch timestamps, which depend on the
+    # machine's timezone; the same seed gives the same datetimes anywhere
+    return now - timedelta(seconds=rng.uniform(0, (now - then).total_seconds()))
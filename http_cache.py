@@ -0,0 +1,126 @@
+"""HTTP caching policy: validators for pages, long-lived static files.
+
+Pages are dynamic, so browsers may keep a copy but must revalidate it
+(`no-cache`). Routes describe what a page shows -- row ids, profile
+versions, counters, the viewer's likes and follows -- with not_modified()
+once their queries have run; it derives an ETag from that and, when the
+client already has that version, returns a 304 before any template is
+rendered.
+
+Pages vary with the session cookie (the logged-in user, flashes, CSRF
+tokens), so every page carries `Vary: Cookie`, and logged-in pages are
+`private` so shared caches never hand them to anyone else. Form posts,
+redirects and errors are `no-store`. Responses that set their own
+Cache-Control, like static files, keep it.
+"""
+
+import hashlib
+import time
+from pathlib import Path
+
+from flask import current_app, g, request, session
+
+# CSRF tokens expire; a revalidated page must never carry a stale one
+CSRF_TOKEN_TIME_LIMIT = 3600
+
+CACHEABLE_STATUSES = (200, 304)
+
+
+def etag_for(*parts):
+    """A strong ETag for a page built from `parts` (any reprs)."""
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def message_versions(messages):
+    """What a page shows of `messages`: ids and their authors' versions."""
+
+    return [(msg.id, msg.user.profile_version) for msg in messages]
+
+
+def user_versions(users):
+    """What a page shows of `users`: ids, profile versions and counters."""
+
+    return [(user.id, user.profile_version, user.messages_count,
+             user.following_count, user.followers_count, user.likes_count)
+            for user in users]
+
+
+def not_modified(*parts):
+    """Set the page's ETag from `parts`; a 304 if the client has it already.
+
+    `parts` describe everything the page shows that can change. The URL,
+    the logged-in user and what g.viewer has been scoped to are added here,
+    so call this after g.viewer.scope(). Returns None when the page needs
+    rendering.
+    """
+
+    # flashes are shown once, so a page carrying them is never reused
+    if '_flashes' in session:
+        return None
+
+    csrf_limit = (current_app.config.get('WTF_CSRF_TIME_LIMIT')
+                  or CSRF_TOKEN_TIME_LIMIT)
+
+    g.etag = etag_for(
+        current_app.extensions['http_cache'],
+        request.full_path,
+        g.user,
+        sorted(g.viewer.liked_ids),
+        sorted(g.viewer.following_ids),
+        session.get('csrf_token'),
+        # a revalidated page's CSRF token is at most half its lifetime old
+        int(time.time() // (csrf_limit / 2)),
+        *parts,
+    )
+
+    # If-None-Match compares weakly; compression weakens the ETag
+    if request.if_none_match.contains_weak(g.etag):
+        return '', 304
+
+    return None
+
+
+def templates_fingerprint(app):
+    """Hash of the app's templates, so a deploy invalidates every ETag."""
+
+    digest = hashlib.sha1()
+    folder = Path(app.root_path, app.template_folder)
+
+    for path in sorted(folder.rglob('*.html')):
+        digest.update(path.read_bytes())
+
+    return digest.hexdigest()
+
+
+def init_cache_policy(app):
+    """Apply the caching policy to `app`'s responses."""
+
+    app.extensions['http_cache'] = templates_fingerprint(app)
+
+    @app.after_request
+    def add_cache_headers(response):
+        """Set Cache-Control, Vary and (for pages) ETag on `response`."""
+
+        # static files and built assets set their own (send_file gives
+        # them an ETag and Last-Modified too)
+        if 'Cache-Control' in response.headers:
+            return response
+
+        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
+        if (request.method not in ('GET', 'HEAD')
+                or response.status_code not in CACHEABLE_STATUSES):
+            response.cache_control.no_store = True
+            return response
+
+        response.cache_control.no_cache = True
+
+        if g.get('user'):
+            response.cache_control.private = True
+
+        response.vary.add('Cookie')
+
+        if g.get('etag'):
+            response.set_etag(g.etag)
+
+        return response
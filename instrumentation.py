@@ -0,0 +1,189 @@
+"""Database instrumentation helpers.
+
+init_app() records, for every request, how many statements ran, how long
+they took and how often each statement shape repeated. It reports them in
+a Server-Timing header (when SERVER_TIMING is on) and a JSON log line on
+the `warbler.sql` logger, and warns when one shape runs more than
+QUERY_REPEAT_THRESHOLD times -- usually an N+1 in a template or loop.
+
+Streamed pages send their headers before their rows are read, so their
+Server-Timing only covers queries run before the body; the log line
+covers the whole request.
+"""
+
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+from assets import STATIC_ENDPOINTS
+from models import db
+
+logger = logging.getLogger('warbler.sql')
+
+# how much of a statement shape to show in a warning
+FINGERPRINT_PREVIEW = 200
+
+
+class QueryCounter:
+    """Collects the SQL statements run while it's active."""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Count the queries run inside a `with` block.
+
+        with count_queries() as queries:
+            client.get("/")
+        assert queries.count <= 5
+    """
+
+    counter = QueryCounter()
+    event.listen(db.engine, 'before_cursor_execute', counter.record)
+
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', counter.record)
+
+
+@contextmanager
+def query_budget(max_queries):
+    """Fail if the `with` block runs more than `max_queries` queries.
+
+        with query_budget(4):
+            client.get("/users/1/followers").get_data()
+
+    Read streamed responses inside the block; their queries run as the
+    body is read. The failure lists the statements, grouped by shape.
+    """
+
+    with count_queries() as queries:
+        yield queries
+
+    if queries.count > max_queries:
+        shapes = Counter(fingerprint(statement) for statement in queries.statements)
+        details = "\n".join(f"  {count} x {shape[:FINGERPRINT_PREVIEW]}"
+                            for shape, count in shapes.most_common())
+        raise AssertionError(f"{queries.count} queries, over the budget of "
+                             f"{max_queries}:\n{details}")
+
+
+def fingerprint(statement):
+    """The shape of `statement`: literals, parameters and IN lists elided."""
+
+    shape = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    shape = re.sub(r"%\(\w+\)s|%s|\b\d+\b", "?", shape)
+    shape = re.sub(r"\?(?:\s*,\s*\?)+", "?", shape)
+
+    return " ".join(shape.split())
+
+
+class RequestQueryStats:
+    """The statements run during one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.status = None
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.db_time += elapsed
+        self.shapes[fingerprint(statement)] += 1
+
+    def repeated(self, threshold):
+        """(shape, count) of statement shapes run more than `threshold` times."""
+
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count > threshold]
+
+    def server_timing(self):
+        elapsed = time.perf_counter() - self.started
+
+        return (f'db;dur={self.db_time * 1000:.2f};desc="{self.count} queries", '
+                f'app;dur={elapsed * 1000:.2f}')
+
+    def log_record(self):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': self.status,
+            'queries': self.count,
+            'db_ms': round(self.db_time * 1000, 2),
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'distinct_queries': len(self.shapes),
+        }
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = g.get('query_stats') if has_app_context() else None
+
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - context._query_started)
+
+
+def init_app(app, engine):
+    """Record per-request query stats for `app`'s queries on `engine`."""
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(app.config['SQL_STATS_LOG_LEVEL'])
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_query_stats():
+        if request.endpoint not in STATIC_ENDPOINTS:
+            g.query_stats = RequestQueryStats()
+
+    @app.after_request
+    def add_server_timing(response):
+        stats = g.get('query_stats')
+
+        if stats is not None:
+            stats.status = response.status_code
+
+            if app.config['SERVER_TIMING']:
+                response.headers['Server-Timing'] = stats.server_timing()
+
+        return response
+
+    @app.teardown_request
+    def log_query_stats(exc):
+        stats = g.pop('query_stats', None)
+
+        if stats is None:
+            return
+
+        logger.info(json.dumps(stats.log_record()))
+
+        for shape, count in stats.repeated(app.config['QUERY_REPEAT_THRESHOLD']):
+            logger.warning("Possible N+1: %s %s ran the same statement %d times: %s",
+                           request.method, request.path, count,
+                           shape[:FINGERPRINT_PREVIEW])
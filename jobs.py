@@ -0,0 +1,415 @@
+"""A durable job queue in Postgres, and the workers that run it.
+
+Request handlers hand slow work off with queue.enqueue() and return; `flask
+worker` runs it, and must be running wherever the app is deployed (it's the
+Procfile's worker process). Jobs are rows in the jobs table (see models.Job):
+
+- Workers claim the next due job with SELECT ... FOR UPDATE SKIP LOCKED,
+  so any number of them, threads or processes, share the queue without
+  waiting on each other or claiming a job twice. Higher priority goes
+  first, then whatever has waited longest.
+- A claimed job is committed as running before its handler starts, and
+  the handler's work commits on its own. If the handler raises, the job
+  goes back in the queue with exponential backoff (JOB_RETRY_BASE seconds,
+  doubling up to JOB_RETRY_MAX) until it has had max_attempts; then it's
+  failed, keeping the error. A job still running JOB_TIMEOUT seconds after
+  it started, or after its last heartbeat(), is taken to have lost its
+  worker and is requeued. Handlers that may run longer call
+  queue.heartbeat() in each transaction they commit.
+- Enqueueing with an idempotency key that's already been used is a no-op.
+
+Enqueue in the transaction that makes the work necessary, so the job
+commits or rolls back with it. Handlers must be safe to run again: a job is
+retried if its handler fails part way, or if its worker dies after the
+work commits but before the job is marked done.
+
+Tasks are registered with @queue.task (see tasks.py). With JOBS_RUN_INLINE
+on, as in tests, enqueue() runs the handler there and then instead.
+"""
+
+import logging
+import random
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import timedelta
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, Job
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PRIORITY = 0
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_TIMEOUT = 600
+DEFAULT_RETRY_BASE = 10
+DEFAULT_RETRY_MAX = 3600
+
+
+class Task:
+    """A registered handler and the defaults for its jobs."""
+
+    def __init__(self, name, handler, priority, max_attempts):
+        self.name = name
+        self.handler = handler
+        self.priority = priority
+        self.max_attempts = max_attempts
+
+
+class JobQueue:
+    """Registers tasks, enqueues jobs for them and runs claimed jobs."""
+
+    def __init__(self):
+        self.tasks = {}
+        # the job each worker thread is running, for heartbeat()
+        self.running = threading.local()
+        self.configure()
+
+    def configure(self, run_inline=False, timeout=DEFAULT_TIMEOUT,
+                  retry_base=DEFAULT_RETRY_BASE, retry_max=DEFAULT_RETRY_MAX):
+        """Set inline running, the job timeout and the retry backoff."""
+
+        self.run_inline = run_inline
+        self.timeout = timeout
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+
+    def init_app(self, app):
+        """Configure from the app's JOBS_RUN_INLINE, JOB_TIMEOUT,
+        JOB_RETRY_BASE and JOB_RETRY_MAX settings."""
+
+        self.configure(
+            run_inline=app.config.get('JOBS_RUN_INLINE', False),
+            timeout=app.config.get('JOB_TIMEOUT', DEFAULT_TIMEOUT),
+            retry_base=app.config.get('JOB_RETRY_BASE', DEFAULT_RETRY_BASE),
+            retry_max=app.config.get('JOB_RETRY_MAX', DEFAULT_RETRY_MAX),
+        )
+
+    def task(self, name, priority=DEFAULT_PRIORITY, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Register the decorated function as the handler for `name` jobs.
+
+        It's called with the job's payload as keyword arguments.
+        """
+
+        def register(handler):
+            self.tasks[name] = Task(name, handler, priority, max_attempts)
+            return handler
+
+        return register
+
+    def enqueue(self, name, payload=None, key=None, priority=None, delay=0):
+        """Queue a `name` job; commit to hand it to the workers.
+
+        `payload` is a JSON-able dict of the handler's keyword arguments.
+        If a job with idempotency `key` was ever enqueued, this one isn't.
+        Returns the new job's id, or None if it wasn't queued (a repeated
+        key, or running inline).
+        """
+
+        try:
+            task = self.tasks[name]
+        except KeyError:
+            raise ValueError(f"No task named {name!r}.")
+
+        payload = payload or {}
+
+        if self.run_inline:
+            task.handler(**payload)
+            return None
+
+        stmt = (insert(Job)
+                .values(name=name,
+                        payload=payload,
+                        idempotency_key=key,
+                        priority=task.priority if priority is None else priority,
+                        max_attempts=task.max_attempts,
+                        run_at=func.now() + timedelta(seconds=delay))
+                .on_conflict_do_nothing(index_elements=['idempotency_key'])
+                .returning(Job.id))
+
+        return db.session.execute(stmt).scalar()
+
+    def claim(self):
+        """Claim the next due job and commit it as running.
+
+        Returns a row of the job's id, name, payload, attempts (counting
+        this one) and max_attempts, or None if nothing is due.
+        """
+
+        next_id = (select(Job.id)
+                   .where(Job.status == 'queued', Job.run_at <= func.now())
+                   .order_by(Job.priority.desc(), Job.run_at, Job.id)
+                   .limit(1)
+                   .with_for_update(skip_locked=True)
+                   .scalar_subquery())
+
+        stmt = (update(Job)
+                .where(Job.id == next_id)
+                .values(status='running',
+                        attempts=Job.attempts + 1,
+                        started_at=func.now())
+                .returning(Job.id, Job.name, Job.payload, Job.attempts,
+                           Job.max_attempts)
+                .execution_options(synchronize_session=False))
+
+        job = db.session.execute(stmt).first()
+        db.session.commit()
+
+        return job
+
+    def run(self, job):
+        """Run a claimed job's handler and record how it went.
+
+        Returns True if it succeeded.
+        """
+
+        self.running.job = job
+
+        try:
+            task = self.tasks.get(job.name)
+            if task is None:
+                raise LookupError(f"No task named {job.name!r}.")
+
+            task.handler(**job.payload)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            log.exception("Job #%s (%s) failed on attempt %s of %s.",
+                          job.id, job.name, job.attempts, job.max_attempts)
+            self.retry_or_fail(job, traceback.format_exc())
+            return False
+        finally:
+            self.running.job = None
+
+        self.settle(job, status='done')
+        return True
+
+    def heartbeat(self):
+        """Restart the running job's timeout; commit after.
+
+        For handlers that commit in steps and may outlast the timeout: call
+        it in each step's transaction. Does nothing outside a job, as when
+        a task runs inline or from the CLI.
+        """
+
+        job = getattr(self.running, 'job', None)
+
+        if job is None:
+            return
+
+        stmt = (update(Job)
+                .where(Job.id == job.id,
+                       Job.status == 'running',
+                       Job.attempts == job.attempts)
+                .values(started_at=func.now())
+                .execution_options(synchronize_session=False))
+
+        db.session.execute(stmt)
+
+    def work(self):
+        """Claim and run one job. Returns None if none was due, else
+        whether it succeeded."""
+
+        job = self.claim()
+
+        if job is None:
+            return None
+
+        return self.run(job)
+
+    def retry_or_fail(self, job, error):
+        """Requeue a job that raised `error`, with backoff, or fail it if
+        that was its last attempt."""
+
+        if job.attempts >= job.max_attempts:
+            self.settle(job, status='failed', last_error=error)
+        else:
+            self.settle(job, status='queued', last_error=error,
+                        run_at=func.now() + timedelta(seconds=self.backoff(job.attempts)))
+
+    def backoff(self, attempts):
+        """Seconds to wait before retrying after `attempts` tries, jittered
+        so jobs that failed together don't all retry together."""
+
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def settle(self, job, status, **values):
+        """Record the outcome of `job`'s current attempt, and commit.
+
+        If the job timed out and another worker has claimed it since, this
+        attempt's outcome is dropped.
+        """
+
+        if status != 'queued':
+            values['finished_at'] = func.now()
+
+        stmt = (update(Job)
+                .where(Job.id == job.id,
+                       Job.status == 'running',
+                       Job.attempts == job.attempts)
+                .values(status=status, **values)
+                .execution_options(synchronize_session=False))
+
+        db.session.execute(stmt)
+        db.session.commit()
+
+    def requeue_stale(self):
+        """Requeue jobs running for longer than the timeout since they
+        started or last heartbeat (or fail them, if they're out of
+        attempts). Returns how many."""
+
+        stmt = (update(Job)
+                .where(Job.status == 'running',
+                       Job.started_at < func.now() - timedelta(seconds=self.timeout))
+                .values(status=case((Job.attempts >= Job.max_attempts, 'failed'),
+                                    else_='queued'),
+                        last_error=f"Still running after {self.timeout} seconds.",
+                        finished_at=case((Job.attempts >= Job.max_attempts, func.now()),
+                                         else_=None))
+                .execution_options(synchronize_session=False))
+
+        count = db.session.execute(stmt).rowcount
+        db.session.commit()
+
+        return count
+
+    def stats(self):
+        """The queue's state, as a dict of:
+
+        due         queued jobs ready to run now
+        lag         seconds the longest-waiting due job has waited
+        by_task     {name: {status: count}} of the queued, running and
+                    failed jobs (not done ones, which pile up until pruned)
+        """
+
+        lag = (db.session
+               .query(func.extract('epoch', func.now() - func.min(Job.run_at)),
+                      func.count())
+               .filter(Job.status == 'queued', Job.run_at <= func.now())
+               .one())
+
+        counts = (db.session
+                  .query(Job.name, Job.status, func.count())
+                  .filter(Job.status != 'done')
+                  .group_by(Job.name, Job.status))
+
+        by_task = {}
+        for name, status, count in counts:
+            by_task.setdefault(name, {})[status] = count
+
+        db.session.commit()
+
+        return {
+            'due': lag[1],
+            'lag': float(lag[0] or 0),
+            'by_task': by_task,
+        }
+
+    def prune(self, older_than):
+        """Delete done jobs finished more than `older_than` (a timedelta)
+        ago. Their idempotency keys are then free to use again."""
+
+        count = (Job.query
+                 .filter(Job.status == 'done',
+                         Job.finished_at < func.now() - older_than)
+                 .delete(synchronize_session=False))
+        db.session.commit()
+
+        return count
+
+
+class Worker:
+    """Runs a queue's jobs on `concurrency` threads until stopped.
+
+    Each thread claims a job, runs it and claims the next; when none are
+    due it sleeps for about `poll_interval` seconds. Every `report_interval`
+    seconds the worker requeues stale jobs and reports its throughput and
+    the queue's lag through `echo`.
+    """
+
+    def __init__(self, app, queue, concurrency=1, poll_interval=1.0,
+                 report_interval=60, echo=print):
+        self.app = app
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+        self.echo = echo
+
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.busy_seconds = 0.0
+
+    def run(self):
+        """Start the consumer threads and block until stop() is called
+        (or KeyboardInterrupt); then let running jobs finish."""
+
+        threads = [threading.Thread(target=self.consume, name=f'worker-{n}')
+                   for n in range(self.concurrency)]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            with self.app.app_context():
+                started = time.monotonic()
+                while not self.stopping.wait(self.report_interval):
+                    self.queue.requeue_stale()
+                    self.report(time.monotonic() - started)
+                    started = time.monotonic()
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        """Stop claiming jobs."""
+
+        self.stopping.set()
+
+    def consume(self):
+        """One consumer thread's loop, in its own app context and session."""
+
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                started = time.monotonic()
+
+                try:
+                    succeeded = self.queue.work()
+                except Exception:
+                    # e.g. the database went away; back off and try again
+                    db.session.rollback()
+                    self.app.logger.exception("Couldn't claim a job.")
+                    succeeded = None
+
+                if succeeded is None:
+                    self.stopping.wait(self.poll_interval * random.uniform(0.5, 1.5))
+                    continue
+
+                with self.lock:
+                    self.counts['done' if succeeded else 'failed'] += 1
+                    self.busy_seconds += time.monotonic() - started
+
+                db.session.remove()
+
+    def report(self, elapsed):
+        """Echo the jobs run since the last report, and the queue's lag."""
+
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            busy, self.busy_seconds = self.busy_seconds, 0.0
+
+        ran = counts['done'] + counts['failed']
+        stats = self.queue.stats()
+
+        self.echo(f"Ran {ran} jobs in {elapsed:.0f}s ({ran / elapsed:.1f}/s, "
+                  f"{busy / ran if ran else 0:.2f}s each), {counts['failed']} failed; "
+                  f"{stats['due']} due, lag {stats['lag']:.1f}s.")
+
+
+queue = JobQueue()
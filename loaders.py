@@ -0,0 +1,60 @@
+"""Request-scoped batch loading of rows referenced from templates.
+
+Templates walk relationships like `msg.user` once per item, and each of
+those is a lazy load -- one query per message on a timeline page. A route
+instead hands the ids it's about to render to a loader, which fetches them
+with one query per model and keeps them for the rest of the request.
+
+Because loaded rows stay in the session's identity map, SQLAlchemy answers
+many-to-one lookups like `msg.user` from it without going to the database.
+"""
+
+from flask import g
+
+from models import User
+
+
+class BatchLoader:
+    """Loads rows of one model by id, remembering them for the request."""
+
+    def __init__(self, model):
+        self.model = model
+        self.loaded = {}
+
+    def load_many(self, ids):
+        """Return the rows for `ids` (None for missing ones), in order.
+
+        Ids already loaded this request don't hit the database again; the
+        rest are fetched together in one query.
+        """
+
+        missing = {id for id in ids if id is not None and id not in self.loaded}
+
+        if missing:
+            rows = self.model.query.filter(self.model.id.in_(missing))
+            self.loaded.update((row.id, row) for row in rows)
+
+        return [self.loaded.get(id) for id in ids]
+
+    def load(self, id):
+        """Return the row for `id`, or None."""
+
+        return self.load_many([id])[0]
+
+
+def loader(model):
+    """The current request's BatchLoader for `model`."""
+
+    loaders = g.setdefault('loaders', {})
+
+    if model not in loaders:
+        loaders[model] = BatchLoader(model)
+
+    return loaders[model]
+
+
+def prime_authors(messages):
+    """Load the authors of `messages` in one query, so `msg.user` is free."""
+
+    loader(User).load_many([msg.user_id for msg in messages])
+    return messages
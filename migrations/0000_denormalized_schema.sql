@@ -0,0 +1,88 @@
+-- The tables and columns added since the original schema, which databases
+-- made before the migrations existed don't have: materialized timelines,
+-- the denormalized counters, profile_version and the search vectors.
+--
+-- Databases made by create_all() already have them all, and may have been
+-- stamped before this file existed, so every statement here is a no-op if
+-- its object exists; the backfills only run for what was just created.
+--
+-- Adding the generated search columns rewrites users and messages, holding
+-- their locks until this commits.
+
+DO $$
+BEGIN
+    IF to_regclass('timeline_entries') IS NULL THEN
+        CREATE TABLE timeline_entries (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            author_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (user_id, message_id)
+        );
+
+        -- as TimelineEntry.backfill: each user's own messages, and those
+        -- of everyone they follow
+        INSERT INTO timeline_entries (user_id, message_id, author_id, timestamp)
+        SELECT user_id, id, user_id, timestamp FROM messages
+        UNION ALL
+        SELECT follows.user_following_id, messages.id, messages.user_id, messages.timestamp
+        FROM follows JOIN messages ON messages.user_id = follows.user_being_followed_id
+        ON CONFLICT DO NOTHING;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_timeline_entries_user_id_timestamp
+    ON timeline_entries (user_id, timestamp, message_id);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_name = 'users' AND column_name = 'messages_count') THEN
+        ALTER TABLE users
+            ADD COLUMN messages_count INTEGER DEFAULT '0' NOT NULL,
+            ADD COLUMN following_count INTEGER DEFAULT '0' NOT NULL,
+            ADD COLUMN followers_count INTEGER DEFAULT '0' NOT NULL,
+            ADD COLUMN likes_count INTEGER DEFAULT '0' NOT NULL;
+
+        -- as User.reset_counts
+        WITH sources AS (
+            SELECT user_id AS id, 'messages_count' AS counter FROM messages
+            UNION ALL
+            SELECT user_following_id, 'following_count' FROM follows
+            UNION ALL
+            SELECT user_being_followed_id, 'followers_count' FROM follows
+            UNION ALL
+            SELECT user_id, 'likes_count' FROM likes
+        )
+        UPDATE users
+        SET messages_count = counts.messages_count,
+            following_count = counts.following_count,
+            followers_count = counts.followers_count,
+            likes_count = counts.likes_count
+        FROM (SELECT id,
+                     count(*) FILTER (WHERE counter = 'messages_count') AS messages_count,
+                     count(*) FILTER (WHERE counter = 'following_count') AS following_count,
+                     count(*) FILTER (WHERE counter = 'followers_count') AS followers_count,
+                     count(*) FILTER (WHERE counter = 'likes_count') AS likes_count
+              FROM sources
+              GROUP BY id) AS counts
+        WHERE users.id = counts.id;
+    END IF;
+END
+$$;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_version INTEGER DEFAULT '0' NOT NULL;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(username, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(bio, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(location, '')), 'C')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_users_search_vector ON users USING gin (search_vector);
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('english', text)) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING gin (search_vector);
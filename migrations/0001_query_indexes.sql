@@ -0,0 +1,51 @@
+-- no-transaction
+--
+-- Indexes for the queries app.py runs on every page view; see the
+-- __table_args__ in models.py for what each one serves. Built
+-- concurrently, so the tables stay writable meanwhile.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_id_timestamp
+    ON messages (user_id, timestamp, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_user_following_id
+    ON follows (user_following_id, user_being_followed_id);
+
+-- Nothing stopped a message being liked twice by the same user before.
+-- Keep each pair's first like and take the rest off the likers' counts.
+WITH duplicates AS (
+    DELETE FROM likes
+    USING likes AS first
+    WHERE likes.user_id = first.user_id
+      AND likes.message_id = first.message_id
+      AND likes.id > first.id
+    RETURNING likes.user_id
+)
+UPDATE users
+SET likes_count = likes_count - removed.count
+FROM (SELECT user_id, count(*) AS count FROM duplicates GROUP BY user_id) AS removed
+WHERE users.id = removed.user_id;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_likes_user_id_message_id
+    ON likes (user_id, message_id);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conname = 'uq_likes_user_id_message_id') THEN
+        ALTER TABLE likes ADD CONSTRAINT uq_likes_user_id_message_id
+            UNIQUE USING INDEX uq_likes_user_id_message_id;
+    END IF;
+END
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_likes_user_id_id
+    ON likes (user_id, id) INCLUDE (message_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_likes_message_id
+    ON likes (message_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_timeline_entries_message_id
+    ON timeline_entries (message_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_timeline_entries_author_id_user_id
+    ON timeline_entries (author_id, user_id);
@@ -0,0 +1,15 @@
+-- Deleting an account tombstones it (users.deleted_at) and records it in
+-- account_deletions; deletion.py then purges its rows in batches.
+
+ALTER TABLE users ADD COLUMN deleted_at TIMESTAMP WITHOUT TIME ZONE;
+
+CREATE TABLE account_deletions (
+    user_id INTEGER NOT NULL,
+    requested_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    finished_at TIMESTAMP WITHOUT TIME ZONE,
+    follows_deleted INTEGER DEFAULT '0' NOT NULL,
+    likes_deleted INTEGER DEFAULT '0' NOT NULL,
+    messages_deleted INTEGER DEFAULT '0' NOT NULL,
+    timeline_entries_deleted INTEGER DEFAULT '0' NOT NULL,
+    PRIMARY KEY (user_id)
+);
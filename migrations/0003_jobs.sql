@@ -0,0 +1,23 @@
+-- The queue jobs.py's workers claim background work from.
+
+CREATE TABLE jobs (
+    id BIGSERIAL NOT NULL,
+    name TEXT NOT NULL,
+    payload JSONB DEFAULT '{}' NOT NULL,
+    idempotency_key TEXT,
+    priority INTEGER DEFAULT '0' NOT NULL,
+    status TEXT DEFAULT 'queued' NOT NULL,
+    attempts INTEGER DEFAULT '0' NOT NULL,
+    max_attempts INTEGER DEFAULT '5' NOT NULL,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+    run_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (id),
+    UNIQUE (idempotency_key)
+);
+
+CREATE INDEX ix_jobs_queued ON jobs (priority DESC, run_at, id) WHERE status = 'queued';
+
+CREATE INDEX ix_jobs_running ON jobs (started_at) WHERE status = 'running';
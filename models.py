@@ -4,16 +4,37 @@ from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (delete, exists, func, literal, or_, select, true, tuple_, union_all,
+                        update)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR, insert
+
+from passwords import PasswordHasher
 
 bcrypt = Bcrypt()
+passwords = PasswordHasher(bcrypt)
 db = SQLAlchemy()
 
+# Messages of a newly (un)followed user that Follows.add and remove put on
+# (or take off) the follower's timeline in the request: a homepage's worth.
+# The backfill-timeline job (see tasks.py) does the rest.
+TIMELINE_BACKFILL = 50
+
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
 
     __tablename__ = 'follows'
 
+    # The primary key serves a user's followers; this serves who they
+    # follow (and paging through them by followed id).
+    __table_args__ = (
+        db.Index(
+            'ix_follows_user_following_id',
+            'user_following_id',
+            'user_being_followed_id',
+        ),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -26,12 +47,163 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    @classmethod
+    def add(cls, edges, limit=TIMELINE_BACKFILL):
+        """Follow each (follower_id, followed_id) pair in `edges`.
+
+        One statement inserts the follows that don't exist yet, copies the
+        followed users' newest `limit` messages (all, if None) into their
+        followers' timelines and adds what was inserted to both sides'
+        counters, so repeating it (or racing it) changes nothing. Pairs
+        naming a missing or deleted user are skipped. Returns the number
+        of follows added.
+        """
+
+        pairs = cls.pairs(edges)
+        user_ids = select(User.id).where(User.deleted_at.is_(None))
+
+        added = (insert(cls)
+                 .from_select(['user_following_id', 'user_being_followed_id'],
+                              select(pairs.c.follower_id, pairs.c.followed_id)
+                              .where(pairs.c.follower_id.in_(user_ids),
+                                     pairs.c.followed_id.in_(user_ids))
+                              .distinct())
+                 .on_conflict_do_nothing()
+                 .returning(cls.user_following_id, cls.user_being_followed_id)
+                 .cte('added'))
+
+        newest = (select(Message.id, Message.user_id, Message.timestamp)
+                  .where(Message.user_id == added.c.user_being_followed_id)
+                  .order_by(Message.timestamp.desc(), Message.id.desc())
+                  .limit(limit)
+                  .lateral('newest'))
+
+        timelines = (insert(TimelineEntry)
+                     .from_select(TimelineEntry.COLUMNS,
+                                  select(added.c.user_following_id,
+                                         newest.c.id,
+                                         newest.c.user_id,
+                                         newest.c.timestamp)
+                                  .select_from(added.join(newest, true())))
+                     .on_conflict_do_nothing()
+                     .returning(TimelineEntry.user_id)
+                     .cte('timelines'))
+
+        return cls._apply(added, timelines, sign=1)
+
+    @classmethod
+    def remove(cls, edges, limit=TIMELINE_BACKFILL, timelines=True):
+        """Unfollow each (follower_id, followed_id) pair in `edges`.
+
+        The counterpart of add(): one statement deletes the follows that
+        exist, drops the unfollowed users' newest `limit` messages (all, if
+        None) from the followers' timelines and takes what was deleted off
+        the counters. With `timelines` false the timelines are left alone,
+        for callers that have already cleared them. Returns the number of
+        follows removed.
+        """
+
+        pairs = cls.pairs(edges)
+
+        removed = (delete(cls)
+                   .where(cls.user_following_id == pairs.c.follower_id,
+                          cls.user_being_followed_id == pairs.c.followed_id)
+                   .returning(cls.user_following_id, cls.user_being_followed_id)
+                   .cte('removed'))
+
+        if not timelines:
+            return cls._apply(removed, None, sign=-1)
+
+        if limit is None:
+            entries = (TimelineEntry.user_id == removed.c.user_following_id,
+                       TimelineEntry.author_id == removed.c.user_being_followed_id)
+        else:
+            newest = (select(Message.id)
+                      .where(Message.user_id == removed.c.user_being_followed_id)
+                      .order_by(Message.timestamp.desc(), Message.id.desc())
+                      .limit(limit)
+                      .lateral('newest'))
+            entries = (tuple_(TimelineEntry.user_id, TimelineEntry.message_id)
+                       .in_(select(removed.c.user_following_id, newest.c.id)
+                            .select_from(removed.join(newest, true()))),)
+
+        # a user's own messages always stay on their timeline
+        timelines = (delete(TimelineEntry)
+                     .where(*entries, TimelineEntry.user_id != TimelineEntry.author_id)
+                     .returning(TimelineEntry.user_id)
+                     .cte('timelines'))
+
+        return cls._apply(removed, timelines, sign=-1)
+
+    @classmethod
+    def pairs(cls, edges):
+        """`edges` as a table of (follower_id, followed_id) rows.
+
+        The ids are sent as two array parameters and unnested in the
+        database, so a batch of any size is a single statement.
+        """
+
+        edges = list(edges)
+        follower_ids = [follower_id for follower_id, _ in edges]
+        followed_ids = [followed_id for _, followed_id in edges]
+
+        return (func.unnest(literal(follower_ids, ARRAY(db.Integer)),
+                            literal(followed_ids, ARRAY(db.Integer)))
+                .table_valued('follower_id', 'followed_id')
+                .render_derived(name='pairs'))
+
+    @classmethod
+    def _apply(cls, changed, timelines, sign):
+        """Run the `changed` follows CTE with its timeline CTE (if any) and counters.
+
+        Each changed follow moves its follower's following_count and the
+        followed user's followers_count by `sign`, in one UPDATE over the
+        per-user totals.
+        """
+
+        sides = union_all(
+            select(changed.c.user_following_id.label('user_id'),
+                   literal(1).label('following'),
+                   literal(0).label('followers')),
+            select(changed.c.user_being_followed_id, literal(0), literal(1)),
+        ).subquery()
+
+        totals = (select(sides.c.user_id,
+                         func.sum(sides.c.following).label('following'),
+                         func.sum(sides.c.followers).label('followers'))
+                  .group_by(sides.c.user_id)
+                  .subquery())
+
+        counted = (update(User)
+                   .where(User.id == totals.c.user_id)
+                   .values(following_count=User.following_count
+                           + sign * totals.c.following,
+                           followers_count=User.followers_count
+                           + sign * totals.c.followers)
+                   .returning(User.id)
+                   .cte('counted'))
+
+        # a CTE only runs if the statement refers to it
+        changes, *_ = db.session.execute(select(
+            *(select(func.count()).select_from(cte).scalar_subquery()
+              for cte in (changed, timelines, counted) if cte is not None))).one()
+
+        return changes
+
 
 class User(db.Model):
     """User in the system."""
 
     __tablename__ = 'users'
 
+    __table_args__ = (
+        db.Index(
+            'ix_users_search_vector',
+            'search_vector',
+            postgresql_using='gin',
+        ),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -72,6 +244,67 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Bumped whenever the profile fields shown next to the user's messages
+    # change, so cached message markup (see fragments.py) knows it's stale.
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Set when the user deletes their account: from then on they're
+    # hidden (see User.active) until deletion.py purges their rows.
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # Denormalized counts for profile and sidebar stats. Keep them current
+    # with User.adjust_counts in the same transaction as the write; use
+    # User.recount (`flask reconcile-counters`) to repair any drift.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    COUNTERS = ['messages_count', 'following_count', 'followers_count', 'likes_count']
+
+    # Maintained by Postgres from username, bio and location (weighted in
+    # that order) for user search; see search.search_users.
+    search_vector = db.Column(
+        TSVECTOR,
+        db.Computed(
+            "setweight(to_tsvector('simple', coalesce(username, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(bio, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(location, '')), 'C')",
+            persisted=True,
+        ),
+    )
+
     messages = db.relationship('Message', order_by='Message.timestamp.desc()')
     
     likes = db.relationship('Message', secondary='likes', backref='users')
@@ -95,24 +328,35 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def serialize(self):
+        """Serialize the public parts of a user to a dict."""
+
+        return {
+            "id": self.id,
+            "username": self.username,
+            "image_url": self.image_url,
+            "header_image_url": self.header_image_url,
+            "bio": self.bio,
+            "location": self.location,
+        }
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        # a primary key lookup, rather than loading every follower
+        return Follows.query.get((self.id, other_user.id)) is not None
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.query.get((other_user.id, self.id)) is not None
     
     # rename function to validate if we should be changing the passwords
     # return true or false then call change_password
     def change_password(self, current, new_password, confirm_password):
         """If the user is logged in and they provide the right password and their new passwords match, change their password."""
         
-        password_matches = bcrypt.check_password_hash(self.password, current)
+        password_matches = passwords.check(self.password, current)
     
         if (password_matches) and (new_password == confirm_password):
             return User.hash_password(new_password)
@@ -122,8 +366,132 @@ class User(db.Model):
     def hash_password(cls, password):
         """Returns a hashed password."""
         
-        return bcrypt.generate_password_hash(password).decode('UTF-8')
+        return passwords.hash(password)
     
+    @classmethod
+    def adjust_counts(cls, user_ids, **deltas):
+        """Add `deltas` to the counters of `user_ids`.
+
+        `user_ids` is a single id or a collection/subquery of ids, e.g.
+        User.adjust_counts(user.id, followers_count=1). This is one UPDATE
+        computed in the database, so concurrent writes can't lose counts.
+        """
+
+        if isinstance(user_ids, int):
+            users = cls.query.filter(cls.id == user_ids)
+        else:
+            users = cls.query.filter(cls.id.in_(user_ids))
+
+        values = {getattr(cls, name): getattr(cls, name) + delta
+                  for name, delta in deltas.items()}
+
+        return users.update(values, synchronize_session=False)
+
+    @classmethod
+    def actual_counts(cls):
+        """Map each counter to a subquery counting it from the source rows."""
+
+        return {
+            'messages_count': (select(func.count(Message.id))
+                               .where(Message.user_id == cls.id)
+                               .scalar_subquery()),
+            'following_count': (select(func.count())
+                                .select_from(Follows)
+                                .where(Follows.user_following_id == cls.id)
+                                .scalar_subquery()),
+            'followers_count': (select(func.count())
+                                .select_from(Follows)
+                                .where(Follows.user_being_followed_id == cls.id)
+                                .scalar_subquery()),
+            'likes_count': (select(func.count(Like.id))
+                            .where(Like.user_id == cls.id)
+                            .scalar_subquery()),
+        }
+
+    @classmethod
+    def recount(cls, user_ids=None, fix=True):
+        """Find (and by default fix) users whose counters have drifted.
+
+        Recomputes every counter from the messages, follows and likes tables
+        for `user_ids` (or all users). Returns a list of
+        (user_id, {counter: (stored, actual)}) for each user that was off.
+        """
+
+        actual = cls.actual_counts()
+
+        stored_and_actual = []
+        for name in cls.COUNTERS:
+            stored_and_actual += [getattr(cls, name), actual[name].label(name)]
+
+        drifted = (db.session
+                   .query(cls.id, *stored_and_actual)
+                   .filter(or_(*[getattr(cls, name) != actual[name]
+                                 for name in cls.COUNTERS])))
+
+        if user_ids is not None:
+            drifted = drifted.filter(cls.id.in_(user_ids))
+
+        report = []
+        for row in drifted.all():
+            diffs = {}
+            for i, name in enumerate(cls.COUNTERS):
+                stored, count = row[1 + 2 * i], row[2 + 2 * i]
+                if stored != count:
+                    diffs[name] = (stored, count)
+            report.append((row.id, diffs))
+
+        if fix and report:
+            (cls.query
+             .filter(cls.id.in_([user_id for user_id, _ in report]))
+             .update({getattr(cls, name): actual[name] for name in cls.COUNTERS},
+                     synchronize_session=False))
+
+        return report
+
+    @classmethod
+    def reset_counts(cls):
+        """Set every user's counters from the source rows, in one pass.
+
+        recount() checks users one by one, which suits a few users or a
+        little drift; this is for after a bulk load, when every counter is
+        wrong.
+        """
+
+        sources = [
+            (Message.user_id, 'messages_count'),
+            (Follows.user_following_id, 'following_count'),
+            (Follows.user_being_followed_id, 'followers_count'),
+            (Like.user_id, 'likes_count'),
+        ]
+
+        rows = union_all(*[
+            select(column.label('id'),
+                   *[literal(int(name == counter)).label(name) for name in cls.COUNTERS])
+            for column, counter in sources
+        ]).subquery()
+
+        counts = (select(rows.c.id,
+                         *[func.sum(rows.c[name]).label(name) for name in cls.COUNTERS])
+                  .group_by(rows.c.id)
+                  .subquery())
+
+        # users with no rows at all aren't in `counts`
+        (cls.query
+         .filter(or_(*[getattr(cls, name) != 0 for name in cls.COUNTERS]))
+         .update({getattr(cls, name): 0 for name in cls.COUNTERS},
+                 synchronize_session=False))
+
+        db.session.execute(update(cls)
+                           .where(cls.id == counts.c.id)
+                           .values({name: counts.c[name] for name in cls.COUNTERS})
+                           .execution_options(synchronize_session=False))
+
+    @classmethod
+    def active(cls):
+        """Query for the users who haven't deleted their account."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
+
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
@@ -131,7 +499,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash(password)
 
         user = User(
             username=username,
@@ -152,14 +520,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the user's hash was made with an outdated work factor, it's
+        replaced with a fresh one; commit to save it.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.active().filter_by(username=username).first()
 
         if user:
-            print(user)
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash(password)
                 return user
 
         return False
@@ -170,6 +542,21 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    __table_args__ = (
+        db.Index(
+            'ix_messages_search_vector',
+            'search_vector',
+            postgresql_using='gin',
+        ),
+        # a user's messages, newest first, as profiles page through them
+        db.Index(
+            'ix_messages_user_id_timestamp',
+            'user_id',
+            'timestamp',
+            'id',
+        ),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -192,14 +579,50 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Maintained by Postgres for message search; see search.search_messages.
+    search_vector = db.Column(
+        TSVECTOR,
+        db.Computed("to_tsvector('english', text)", persisted=True),
+    )
+
     user = db.relationship('User')
-    
+
+    @classmethod
+    def visible(cls):
+        """Query for the messages of users who haven't deleted their account."""
+
+        return (cls.query
+                .join(User, User.id == cls.user_id)
+                .filter(User.deleted_at.is_(None)))
+
 
 class Like(db.Model):
     """An individual like/connection between a user and a message."""
 
     __tablename__ = 'likes'
 
+    __table_args__ = (
+        # one like per user and message; also answers "which of these
+        # messages has this user liked?"
+        db.UniqueConstraint(
+            'user_id',
+            'message_id',
+            name='uq_likes_user_id_message_id',
+        ),
+        # a user's likes page, newest like first, without visiting the table
+        db.Index(
+            'ix_likes_user_id_id',
+            'user_id',
+            'id',
+            postgresql_include=['message_id'],
+        ),
+        # the users who liked a message, for deleting it
+        db.Index(
+            'ix_likes_message_id',
+            'message_id',
+        ),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -217,6 +640,420 @@ class Like(db.Model):
         nullable=False,
     )
 
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like `message_id` for `user_id`, or unlike it if they already do.
+
+        One statement deletes the like if there is one, otherwise inserts
+        it, and adjusts the user's likes_count by what changed, so
+        concurrent toggles can't duplicate a like or skew the count.
+        Returns (liked, message's like count, user's likes_count) after.
+        """
+
+        removed = (delete(cls)
+                   .where(cls.user_id == user_id, cls.message_id == message_id)
+                   .returning(cls.id)
+                   .cte('removed'))
+
+        # a like inserted concurrently wins; this toggle then changes nothing
+        added = (insert(cls)
+                 .from_select(['user_id', 'message_id'],
+                              select(literal(user_id), literal(message_id))
+                              .where(~exists(select(removed.c.id))))
+                 .on_conflict_do_nothing(index_elements=['user_id', 'message_id'])
+                 .returning(cls.id)
+                 .cte('added'))
+
+        change = (select(func.count()).select_from(added).scalar_subquery()
+                  - select(func.count()).select_from(removed).scalar_subquery())
+
+        counted = (update(User)
+                   .where(User.id == user_id)
+                   .values(likes_count=User.likes_count + change)
+                   .returning(User.likes_count)
+                   .cte('counted'))
+
+        # the count reads the likes as they were before this statement
+        message_likes = (select(func.count())
+                         .select_from(cls)
+                         .where(cls.message_id == message_id)
+                         .scalar_subquery())
+
+        row = db.session.execute(select(~exists(select(removed.c.id)),
+                                        message_likes + change,
+                                        counted.c.likes_count)).one()
+
+        return tuple(row)
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Entries are written when a message is posted (fan-out-on-write), so the
+    homepage reads a user's timeline with one range scan over
+    (user_id, timestamp) instead of collecting the messages of everyone they
+    follow on every page view.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_entries_user_id_timestamp',
+            'user_id',
+            'timestamp',
+            'message_id',
+        ),
+        # for removing a deleted message from every timeline
+        db.Index(
+            'ix_timeline_entries_message_id',
+            'message_id',
+        ),
+        # for removing an unfollowed user's messages from a timeline
+        db.Index(
+            'ix_timeline_entries_author_id_user_id',
+            'author_id',
+            'user_id',
+        ),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+    @classmethod
+    def fan_out(cls, message, followers=True):
+        """Add `message` to its author's timeline and to each follower's.
+
+        The message must already be flushed so it has an id and timestamp.
+        With `followers` False, only the author's timeline gets it (the
+        followers' are left to the fan-out job; see tasks.py).
+        """
+
+        own = select(
+            literal(message.user_id),
+            literal(message.id),
+            literal(message.user_id),
+            literal(message.timestamp),
+        )
+
+        rows = own
+
+        if followers:
+            to_followers = (select(
+                                Follows.user_following_id,
+                                literal(message.id),
+                                literal(message.user_id),
+                                literal(message.timestamp))
+                            .where(Follows.user_being_followed_id == message.user_id))
+            rows = union_all(own, to_followers)
+
+        stmt = (insert(cls)
+                .from_select(cls.COLUMNS, rows)
+                .on_conflict_do_nothing())
+
+        return db.session.execute(stmt).rowcount
+
+    @classmethod
+    def remove_message(cls, message_id):
+        """Drop a message from every timeline it was fanned out to."""
+
+        return (cls.query
+                .filter(cls.message_id == message_id)
+                .delete(synchronize_session=False))
+
+    @classmethod
+    def copy_author(cls, user_id, author_id, batch_size, before=None):
+        """Copy a batch of `author_id`'s messages onto `user_id`'s timeline.
+
+        Takes the newest `batch_size` messages older than the `before`
+        (timestamp, id) cursor, and copies them only if `user_id` still
+        follows `author_id`. Returns the number copied and the cursor for
+        the next batch, None when there are no more.
+        """
+
+        batch = select(Message.id, Message.user_id, Message.timestamp).where(
+            Message.user_id == author_id)
+
+        if before is not None:
+            batch = batch.where(tuple_(Message.timestamp, Message.id) < tuple(before))
+
+        batch = (batch
+                 .order_by(Message.timestamp.desc(), Message.id.desc())
+                 .limit(batch_size)
+                 .cte('batch'))
+
+        following = (select(Follows.user_following_id)
+                     .where(Follows.user_following_id == user_id,
+                            Follows.user_being_followed_id == author_id)
+                     .exists())
+
+        copied = (insert(cls)
+                  .from_select(cls.COLUMNS,
+                               select(literal(user_id), batch.c.id, batch.c.user_id,
+                                      batch.c.timestamp)
+                               .where(following))
+                  .on_conflict_do_nothing()
+                  .returning(cls.message_id)
+                  .cte('copied'))
+
+        last = (select(batch.c.timestamp, batch.c.id)
+                .order_by(batch.c.timestamp, batch.c.id)
+                .limit(1)
+                .subquery())
+
+        count, size, timestamp, message_id = db.session.execute(select(
+            select(func.count()).select_from(copied).scalar_subquery(),
+            select(func.count()).select_from(batch).scalar_subquery(),
+            select(last.c.timestamp).scalar_subquery(),
+            select(last.c.id).scalar_subquery())).one()
+
+        return count, ((timestamp, message_id) if size == batch_size else None)
+
+    @classmethod
+    def drop_author(cls, user_id, author_id, batch_size):
+        """Delete a batch of `author_id`'s messages from `user_id`'s
+        timeline, unless `user_id` follows them again. Returns how many."""
+
+        batch = (select(cls.message_id)
+                 .where(cls.user_id == user_id, cls.author_id == author_id)
+                 .limit(batch_size))
+
+        following = (select(Follows.user_following_id)
+                     .where(Follows.user_following_id == user_id,
+                            Follows.user_being_followed_id == author_id)
+                     .exists())
+
+        stmt = (delete(cls)
+                .where(cls.user_id == user_id,
+                       cls.user_id != author_id,
+                       cls.message_id.in_(batch),
+                       ~following)
+                .execution_options(synchronize_session=False))
+
+        return db.session.execute(stmt).rowcount
+
+    @classmethod
+    def backfill(cls):
+        """Build every timeline from the messages and follows tables.
+
+        Safe to re-run: entries that already exist are left alone. Returns
+        the number of entries written.
+        """
+
+        own = select(
+            Message.user_id.label('user_id'),
+            Message.id,
+            Message.user_id.label('author_id'),
+            Message.timestamp,
+        )
+
+        followed = (select(
+                        Follows.user_following_id,
+                        Message.id,
+                        Message.user_id,
+                        Message.timestamp)
+                    .join(Message,
+                          Message.user_id == Follows.user_being_followed_id))
+
+        stmt = (insert(cls)
+                .from_select(cls.COLUMNS, union_all(own, followed))
+                .on_conflict_do_nothing())
+
+        return db.session.execute(stmt).rowcount
+
+    @classmethod
+    def messages_for(cls, user_id):
+        """Query for the messages on a user's home timeline.
+
+        Order (and page) it by (TimelineEntry.timestamp,
+        TimelineEntry.message_id) to read it straight off the index.
+        """
+
+        return (Message
+                .visible()
+                .join(cls, cls.message_id == Message.id)
+                .filter(cls.user_id == user_id))
+
+
+class AccountDeletion(db.Model):
+    """A deleted account whose rows are being purged, and how far it's got.
+
+    Counts go up with each batch deletion.purge commits; finished_at is set
+    once the user row itself is gone.
+    """
+
+    __tablename__ = 'account_deletions'
+
+    # no foreign key: the record outlives the user
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    requested_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    follows_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    messages_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    timeline_entries_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    PROGRESS = ['follows_deleted', 'likes_deleted', 'messages_deleted',
+                'timeline_entries_deleted']
+
+
+class Job(db.Model):
+    """A unit of background work for jobs.py's workers.
+
+    Times are timestamptz set from the database's clock, which every worker
+    shares.
+    """
+
+    __tablename__ = 'jobs'
+
+    __table_args__ = (
+        # what a worker claims next: highest priority, then longest waiting
+        db.Index(
+            'ix_jobs_queued',
+            db.text('priority DESC'),
+            'run_at',
+            'id',
+            postgresql_where=db.text("status = 'queued'"),
+        ),
+        # finding jobs whose worker died mid-run
+        db.Index(
+            'ix_jobs_running',
+            'started_at',
+            postgresql_where=db.text("status = 'running'"),
+        ),
+    )
+
+    STATUSES = ['queued', 'running', 'done', 'failed']
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    payload = db.Column(
+        JSONB,
+        nullable=False,
+        server_default='{}',
+    )
+
+    # a second job with the same key isn't enqueued
+    idempotency_key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    priority = db.Column(
+        db.Integer,
+        nullable=False,
+        server_default='0',
+    )
+
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        server_default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        server_default='0',
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        server_default='5',
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+    )
+
+    # not claimed before this; pushed back after each failed attempt
+    run_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+    )
+
+    # when the current attempt started, or last called JobQueue.heartbeat()
+    started_at = db.Column(
+        db.DateTime(timezone=True),
+    )
+
+    finished_at = db.Column(
+        db.DateTime(timezone=True),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -226,3 +1063,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    passwords.init_app(app)
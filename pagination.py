@@ -0,0 +1,112 @@
+"""Keyset (cursor) pagination for Warbler's list views.
+
+Pages are ordered newest-first on a unique key -- (timestamp, id) for
+messages, id for users, (rank, id) for search results -- and the next page
+starts strictly after the last row shown. Unlike OFFSET, every page costs
+the same index range scan no matter how deep into a list the reader has
+scrolled.
+"""
+
+from datetime import datetime
+
+from flask import request, url_for
+from sqlalchemy import DateTime, Float, tuple_
+from werkzeug.exceptions import BadRequest
+
+MESSAGES_PER_PAGE = 50
+USERS_PER_PAGE = 30
+
+CURSOR_SEPARATOR = '_'
+
+
+class Page:
+    """One page of results plus the cursor for the next (older) page."""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Turn a row's sort key into an opaque, URL-safe cursor string."""
+
+    return CURSOR_SEPARATOR.join(
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in values
+    )
+
+
+def decode_cursor(cursor, columns):
+    """Turn a cursor back into values matching the sort `columns`.
+
+    Raises BadRequest if the cursor doesn't fit the columns.
+    """
+
+    parts = cursor.split(CURSOR_SEPARATOR)
+
+    if len(parts) != len(columns):
+        raise BadRequest("Invalid page cursor.")
+
+    def parse(part, column):
+        if isinstance(column.type, DateTime):
+            return datetime.fromisoformat(part)
+        if isinstance(column.type, Float):
+            return float(part)
+        return int(part)
+
+    try:
+        return [parse(part, column) for part, column in zip(parts, columns)]
+    except ValueError:
+        raise BadRequest("Invalid page cursor.")
+
+
+def keyset(query, columns, cursor, per_page):
+    """`query` for the page after `cursor`, plus one row to spare."""
+
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        query = query.filter(tuple_(*columns) < tuple_(*values))
+
+    return (query
+            .order_by(*[column.desc() for column in columns])
+            .limit(per_page + 1))
+
+
+def paginate(query, columns, key, cursor=None, per_page=MESSAGES_PER_PAGE):
+    """Return a Page of `query` ordered by `columns`, newest first.
+
+    `columns` is the unique sort key, e.g. (Message.timestamp, Message.id).
+    `key` maps a result row to its values for those columns. `cursor` is the
+    next_cursor of the previous page, or None for the first page.
+    """
+
+    rows = keyset(query, columns, cursor, per_page).all()
+
+    # the extra row only tells us whether there's another page
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(key(rows[-1]))
+    else:
+        next_cursor = None
+
+    return Page(rows, next_cursor)
+
+
+def next_page_url(page):
+    """URL of the page after `page` for the current route.
+
+    Keeps the current query string (e.g. a search term), but never the
+    fragment flag, so the link also works without JavaScript.
+    """
+
+    args = request.args.to_dict()
+    args.pop('fragment', None)
+    args['before'] = page.next_cursor
+
+    return url_for(request.endpoint, **request.view_args, **args)
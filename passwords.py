@@ -0,0 +1,92 @@
+"""Password hashing and checking, a bounded number at a time.
+
+bcrypt is deliberately slow, and a burst of logins hashing at once on a
+threaded worker's request threads (gunicorn --threads; see the Procfile)
+starves everything else it's serving of CPU. Here the hashing runs on the
+request's own thread (bcrypt releases the GIL while it works) but holds
+one of PASSWORD_HASH_WORKERS slots per process while it does. A request
+that can't get a slot within PASSWORD_HASH_QUEUE_TIMEOUT seconds gets a
+503 instead of queueing indefinitely, and the other request threads carry
+on serving.
+
+The work factor is BCRYPT_LOG_ROUNDS; needs_rehash tells when a stored hash
+was made with a different one, so it can be upgraded at the next login.
+"""
+
+import os
+from threading import BoundedSemaphore
+
+from werkzeug.exceptions import ServiceUnavailable
+
+DEFAULT_ROUNDS = 12
+DEFAULT_QUEUE_TIMEOUT = 5.0
+
+
+class PasswordHasherBusy(ServiceUnavailable):
+    """Every hashing slot stayed busy for the whole queue timeout."""
+
+    description = "Too many people are logging in right now; try again shortly."
+
+
+class PasswordHasher:
+    """Runs a Flask-Bcrypt instance's hashing, at most `max_workers` at once."""
+
+    def __init__(self, bcrypt, rounds=DEFAULT_ROUNDS, max_workers=None,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.bcrypt = bcrypt
+        self.configure(rounds, max_workers, queue_timeout)
+
+    def configure(self, rounds=DEFAULT_ROUNDS, max_workers=None,
+                  queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        """Set the work factor, concurrency limit and queue timeout."""
+
+        self.rounds = rounds
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_timeout = queue_timeout
+        self.slots = BoundedSemaphore(self.max_workers)
+
+    def init_app(self, app):
+        """Configure from the app's BCRYPT_LOG_ROUNDS, PASSWORD_HASH_WORKERS
+        and PASSWORD_HASH_QUEUE_TIMEOUT settings."""
+
+        self.configure(
+            rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+            max_workers=app.config.get('PASSWORD_HASH_WORKERS'),
+            queue_timeout=app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT',
+                                         DEFAULT_QUEUE_TIMEOUT),
+        )
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` once a slot is free, and return its result.
+
+        Raises PasswordHasherBusy if no slot frees up within the timeout.
+        """
+
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusy(retry_after=1)
+
+        try:
+            return fn(*args)
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured work factor."""
+
+        pw_hash = self.run(self.bcrypt.generate_password_hash,
+                           password, self.rounds)
+        return pw_hash.decode('UTF-8')
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self.run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different work factor than ours?"""
+
+        # bcrypt hashes look like $2b$12$<salt and hash>
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
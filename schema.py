@@ -0,0 +1,175 @@
+"""Schema migrations for existing databases.
+
+A new database gets the current schema from db.create_all(), and is then
+stamped as having every migration (see stamp()). An existing one is
+brought up to date by upgrade(), which runs the SQL files in migrations/
+it hasn't run yet, in order, and records each in the schema_migrations
+table:
+
+    flask db status     list migrations and whether they've run
+    flask db upgrade    run the pending ones
+    flask db stamp      record every migration as run, without running it
+
+Files are named NNNN_description.sql. Each runs in one transaction unless
+its first line is `-- no-transaction`; then each statement commits on its
+own, which CREATE INDEX CONCURRENTLY needs. A statement ends at a line
+ending in ";" outside a $$-quoted block. Write no-transaction migrations so
+they can be re-run after failing part way (IF NOT EXISTS and the like). A
+CREATE INDEX CONCURRENTLY that failed leaves an invalid index behind, which
+IF NOT EXISTS would then skip, so upgrade() drops an invalid index of the
+same name before running one.
+"""
+
+import os
+import re
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+NO_TRANSACTION = '-- no-transaction'
+
+CREATE_INDEX_CONCURRENTLY = re.compile(
+    r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)',
+    re.IGNORECASE | re.MULTILINE)
+
+
+class Migration:
+    """One NNNN_description.sql file in migrations/."""
+
+    def __init__(self, path):
+        self.path = path
+        self.version, self.name = MIGRATION_FILE.match(os.path.basename(path)).groups()
+
+        with open(path) as f:
+            self.sql = f.read()
+
+        self.transactional = not self.sql.startswith(NO_TRANSACTION)
+
+    def __repr__(self):
+        return f"<Migration {self.version}_{self.name}>"
+
+    def statements(self):
+        """The file's statements, split at line-ending semicolons."""
+
+        statements = []
+        current = []
+
+        for line in self.sql.splitlines():
+            current.append(line)
+            statement = "\n".join(current)
+
+            if line.rstrip().endswith(';') and statement.count('$$') % 2 == 0:
+                statements.append(statement.strip())
+                current = []
+
+        if "\n".join(current).strip():
+            statements.append("\n".join(current).strip())
+
+        return statements
+
+
+def migrations():
+    """Every migration in migrations/, oldest first."""
+
+    return [Migration(os.path.join(MIGRATIONS_DIR, filename))
+            for filename in sorted(os.listdir(MIGRATIONS_DIR))
+            if MIGRATION_FILE.match(filename)]
+
+
+def migration_engine(engine):
+    """An unpooled engine for `engine`'s database, so that migrations'
+    AUTOCOMMIT connections and session settings stay out of the app's pool."""
+
+    return create_engine(engine.url, poolclass=NullPool)
+
+
+def ensure_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def drop_invalid_index(conn, statement):
+    """If `statement` builds an index concurrently and a failed earlier
+    build left that index invalid, drop it so the statement rebuilds it."""
+
+    match = CREATE_INDEX_CONCURRENTLY.search(statement)
+    if match is None:
+        return
+
+    invalid = conn.execute(text("""
+        SELECT 1 FROM pg_index
+        WHERE indexrelid = to_regclass(:name) AND NOT indisvalid
+    """), {'name': match.group(1)}).scalar()
+
+    if invalid:
+        conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY {match.group(1)}")
+
+
+def record(conn, migration):
+    conn.execute(text("""
+        INSERT INTO schema_migrations (version, name) VALUES (:version, :name)
+        ON CONFLICT DO NOTHING
+    """), {'version': migration.version, 'name': migration.name})
+
+
+def status(engine):
+    """(migration, applied_at or None) for every migration."""
+
+    with engine.begin() as conn:
+        ensure_table(conn)
+        applied = dict(conn.execute(text(
+            "SELECT version, applied_at FROM schema_migrations")).fetchall())
+
+    return [(migration, applied.get(migration.version)) for migration in migrations()]
+
+
+def upgrade(engine, echo=print):
+    """Run every pending migration; returns the ones run."""
+
+    pending = [migration for migration, applied_at in status(engine)
+               if applied_at is None]
+
+    migrator = migration_engine(engine)
+
+    try:
+        for migration in pending:
+            began = time.perf_counter()
+            echo(f"Applying {migration.version}_{migration.name}...")
+
+            if migration.transactional:
+                with migrator.begin() as conn:
+                    for statement in migration.statements():
+                        conn.exec_driver_sql(statement)
+                    record(conn, migration)
+            else:
+                with migrator.connect().execution_options(
+                        isolation_level='AUTOCOMMIT') as conn:
+                    for statement in migration.statements():
+                        drop_invalid_index(conn, statement)
+                        conn.exec_driver_sql(statement)
+                    record(conn, migration)
+
+            echo(f"  done in {time.perf_counter() - began:.1f}s")
+    finally:
+        migrator.dispose()
+
+    return pending
+
+
+def stamp(engine):
+    """Record every migration as run, e.g. after db.create_all()."""
+
+    with engine.begin() as conn:
+        ensure_table(conn)
+        for migration in migrations():
+            record(conn, migration)
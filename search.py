@@ -0,0 +1,126 @@
+"""Ranked search backed by Postgres full-text indexes.
+
+Queries are answered from GIN indexes over generated tsvector columns
+instead of `LIKE '%...%'` scans of whole tables. Results are ranked and
+paged with a (rank, id) cursor.
+"""
+
+import re
+
+from sqlalchemy import cast, func
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+
+from models import Message, User
+from pagination import Page, paginate, MESSAGES_PER_PAGE, USERS_PER_PAGE
+
+# punctuation (including "_") splits words, as it does in to_tsvector
+SEARCH_TERM = re.compile(r'[^\W_]+')
+
+MAX_SEARCH_TERMS = 8
+
+# shorter terms would match as prefixes of most of the index, so they only
+# match whole words
+MIN_PREFIX_LENGTH = 3
+
+# NUL can't be sent to Postgres at all; the rest are never meaningful
+CONTROL_CHARACTERS = re.compile(r'[\x00-\x1f\x7f-\x9f]')
+
+
+def clean_search(text):
+    """`text` with control characters removed and spaces trimmed.
+
+    Returns '' if nothing is left, so callers can treat it as blank.
+    """
+
+    return CONTROL_CHARACTERS.sub(' ', text).strip()
+
+
+def prefix_query(search):
+    """Build a prefix-matching tsquery for `search`, or None if it's blank.
+
+    Terms are extracted here rather than passed to to_tsquery as-is, so user
+    input can't inject tsquery operators. Terms under MIN_PREFIX_LENGTH
+    characters match exactly.
+    """
+
+    terms = SEARCH_TERM.findall(search.lower())[:MAX_SEARCH_TERMS]
+
+    if not terms:
+        return None
+
+    return func.to_tsquery('simple', ' & '.join(
+        f"{term}:*" if len(term) >= MIN_PREFIX_LENGTH else term
+        for term in terms))
+
+
+def search_users(search, cursor=None, per_page=USERS_PER_PAGE):
+    """Return a Page of users matching `search`, best matches first.
+
+    Each term of MIN_PREFIX_LENGTH or more characters matches as a word
+    prefix ("tuck" finds "tuckerdiane"), and shorter ones as words, in the
+    username, bio or location; a hit in the username ranks above one in the
+    bio, which ranks above one in the location.
+    """
+
+    query = prefix_query(search)
+
+    if query is None:
+        return Page([], None)
+
+    # ts_rank is a float4; as a float8 it survives the trip through a
+    # cursor exactly, so the next page starts right after this one
+    rank = cast(func.ts_rank(User.search_vector, query), DOUBLE_PRECISION)
+
+    matches = (User
+               .active()
+               .add_columns(rank.label('rank'))
+               .filter(User.search_vector.op('@@')(query)))
+
+    page = paginate(matches,
+                    (rank, User.id),
+                    key=lambda row: (row.rank, row.User.id),
+                    cursor=cursor,
+                    per_page=per_page)
+    page.items = [row.User for row in page.items]
+
+    return page
+
+
+def search_messages(search, author_id=None, since=None, until=None,
+                    cursor=None, per_page=MESSAGES_PER_PAGE):
+    """Return a Page of messages matching `search`, best matches first.
+
+    `search` is web-search style: words are stemmed ("warbling" finds
+    "warbled"), "quoted phrases" match in order, and -word excludes. The
+    results can be narrowed to one author and to messages posted at or after
+    `since` and before `until` (datetimes).
+    """
+
+    search = clean_search(search)
+
+    if not search:
+        return Page([], None)
+
+    query = func.websearch_to_tsquery('english', search)
+    rank = cast(func.ts_rank(Message.search_vector, query), DOUBLE_PRECISION)
+
+    matches = (Message
+               .visible()
+               .add_columns(rank.label('rank'))
+               .filter(Message.search_vector.op('@@')(query)))
+
+    if author_id is not None:
+        matches = matches.filter(Message.user_id == author_id)
+    if since is not None:
+        matches = matches.filter(Message.timestamp >= since)
+    if until is not None:
+        matches = matches.filter(Message.timestamp < until)
+
+    page = paginate(matches,
+                    (rank, Message.id),
+                    key=lambda row: (row.rank, row.Message.id),
+                    cursor=cursor,
+                    per_page=per_page)
+    page.items = [row.Message for row in page.items]
+
+    return page
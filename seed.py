@@ -1,19 +1,45 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
+    python seed.py [DIRECTORY]
+
+loads the CSVs in DIRECTORY (by default, generator/) with COPY; likes.csv
+is optional. See bulkload.py.
+"""
+
+import os
+import sys
+import time
 from app import db
-from models import User, Message, Follows
+from bulkload import copy_csv, reset_sequences, without_constraints
+from models import User, TimelineEntry
+from schema import stamp
+
+TABLES = ['users', 'messages', 'follows', 'likes']
+
+data_dir = sys.argv[1] if len(sys.argv) > 1 else 'generator'
 
 db.drop_all()
 db.create_all()
+stamp(db.engine)
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+with without_constraints(TABLES + ['timeline_entries']):
+    for table in TABLES:
+        path = os.path.join(data_dir, f'{table}.csv')
+        if os.path.exists(path) or table != 'likes':
+            copy_csv(table, path)
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    began = time.perf_counter()
+    entries = TimelineEntry.backfill()
+    print(f"timeline_entries: {entries:,} rows in {time.perf_counter() - began:.1f}s",
+          file=sys.stderr)
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+reset_sequences(TABLES)
+
+began = time.perf_counter()
+User.reset_counts()
+print(f"counters: {time.perf_counter() - began:.1f}s", file=sys.stderr)
+
+db.session.commit()
 
+db.session.execute("ANALYZE")
 db.session.commit()
@@ -0,0 +1,25 @@
+/* Like and unlike without leaving the page.
+ *
+ * A star posts its form with `?fragment=1`, and the server answers with
+ * the form as it now stands (star filled or emptied), which replaces the
+ * old one. Without JavaScript the form posts normally and the server
+ * redirects back.
+ */
+
+$(function () {
+  $(document).on('click', '.messages-like button', function (evt) {
+    evt.preventDefault();
+
+    var $form = $(this).closest('.messages-like');
+    if ($form.data('pending')) return;
+    $form.data('pending', true);
+
+    $.post($(this).attr('formaction') + '?fragment=1', $form.serialize())
+      .done(function (html) {
+        $form.replaceWith(html);
+      })
+      .fail(function () {
+        $form.data('pending', false);
+      });
+  });
+});
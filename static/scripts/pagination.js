@@ -0,0 +1,51 @@
+/* Infinite scroll for paginated lists.
+ *
+ * Each list ends with an `.older-page` element linking to the next page.
+ * When it scrolls into view we fetch that page's items as a fragment
+ * (`?fragment=1`) and swap them in; the fragment brings its own
+ * `.older-page` link if there is a page after it. Without JavaScript the
+ * link still works as a plain "next page" link.
+ */
+
+$(function () {
+  function fragmentUrl(href) {
+    return href + (href.indexOf('?') === -1 ? '?' : '&') + 'fragment=1';
+  }
+
+  function loadOlder($olderPage) {
+    if ($olderPage.data('loading')) return;
+    $olderPage.data('loading', true);
+
+    var href = $olderPage.find('.older-link').attr('href');
+
+    $.get(fragmentUrl(href)).done(function (html) {
+      $olderPage.replaceWith(html);
+      watch();
+    }).fail(function () {
+      $olderPage.data('loading', false);
+    });
+  }
+
+  var observer = 'IntersectionObserver' in window
+    ? new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+          if (entry.isIntersecting) {
+            observer.unobserve(entry.target);
+            loadOlder($(entry.target));
+          }
+        });
+      })
+    : null;
+
+  function watch() {
+    if (!observer) return;
+    $('.older-page').each(function () { observer.observe(this); });
+  }
+
+  $(document).on('click', '.older-link', function (evt) {
+    evt.preventDefault();
+    loadOlder($(this).closest('.older-page'));
+  });
+
+  watch();
+});
@@ -0,0 +1,59 @@
+"""Background work handed off by request handlers, run by `flask worker`.
+
+See jobs.py for how jobs are queued and retried; every handler here must
+be safe to run more than once.
+"""
+
+import deletion
+from jobs import queue
+from models import db, Follows, Message, TimelineEntry
+
+# timeline entries copied or deleted per transaction
+TIMELINE_BATCH_SIZE = 1000
+
+
+@queue.task('fan-out', priority=10)
+def fan_out(message_id):
+    """Copy a new message into its author's followers' timelines."""
+
+    message = Message.query.get(message_id)
+
+    # deleted before it could be fanned out
+    if message is not None:
+        TimelineEntry.fan_out(message)
+
+
+@queue.task('backfill-timeline')
+def backfill_timeline(user_id, author_ids):
+    """Finish what Follows.add or remove started on `user_id`'s timeline.
+
+    For each of `author_ids` that `user_id` follows, copy in the messages
+    beyond the newest few the request copied; for each they don't, take
+    the rest of the author's messages off. Each batch commits.
+    """
+
+    for author_id in author_ids:
+        following = db.session.query(
+            Follows.query.filter_by(user_following_id=user_id,
+                                    user_being_followed_id=author_id).exists()).scalar()
+
+        if following:
+            cursor = None
+            while True:
+                _, cursor = TimelineEntry.copy_author(user_id, author_id,
+                                                      TIMELINE_BATCH_SIZE, before=cursor)
+                queue.heartbeat()
+                db.session.commit()
+                if cursor is None:
+                    break
+        else:
+            while TimelineEntry.drop_author(user_id, author_id, TIMELINE_BATCH_SIZE):
+                queue.heartbeat()
+                db.session.commit()
+
+
+@queue.task('purge-account', priority=-10)
+def purge_account(user_id):
+    """Delete a deleted account's rows, a batch at a time."""
+
+    deletion.purge(user_id)
@@ -0,0 +1,188 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, Like, TimelineEntry
+from instrumentation import count_queries
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        """Make two users; u1 follows u2, who has posted five messages."""
+
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        u1 = User.signup("u1", "u1@test.com", "password", None)
+        u2 = User.signup("u2", "u2@test.com", "password", None)
+        db.session.commit()
+
+        u1.following.append(u2)
+        User.adjust_counts(u1.id, following_count=1)
+        User.adjust_counts(u2.id, followers_count=1)
+
+        for n in range(5):
+            db.session.add(Message(text=f"warble {n}", user_id=u2.id))
+        db.session.flush()
+
+        TimelineEntry.backfill()
+        User.adjust_counts(u2.id, messages_count=5)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def log_in(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def test_timeline(self):
+        """Does the timeline page through followed users' messages?"""
+
+        with self.client as c:
+            self.log_in(c)
+
+            resp = c.get('/api/v1/timeline?limit=3')
+            self.assertEqual(resp.status_code, 200)
+
+            data = resp.get_json()
+            self.assertEqual([m['text'] for m in data['messages']],
+                             ["warble 4", "warble 3", "warble 2"])
+            self.assertEqual(data['messages'][0]['user']['username'], "u2")
+            self.assertFalse(data['messages'][0]['liked'])
+
+            data = c.get('/api/v1/timeline?limit=3&before='
+                         + data['next_cursor']).get_json()
+            self.assertEqual([m['text'] for m in data['messages']],
+                             ["warble 1", "warble 0"])
+            self.assertIsNone(data['next_cursor'])
+
+    def test_timeline_query_count(self):
+        """Is the timeline one query, plus one for the viewer's likes?"""
+
+        with self.client as c:
+            self.log_in(c)
+            c.get('/api/v1/timeline')
+
+            with count_queries() as queries:
+                c.get('/api/v1/timeline')
+
+        self.assertEqual(queries.count, 2)
+
+    def test_profile(self):
+        """Does a profile include counts and the viewer's follow?"""
+
+        with self.client as c:
+            self.log_in(c)
+            user = c.get(f'/api/v1/users/{self.u2_id}').get_json()['user']
+
+        self.assertEqual(user['username'], "u2")
+        self.assertEqual(user['messages_count'], 5)
+        self.assertEqual(user['followers_count'], 1)
+        self.assertTrue(user['following'])
+
+    def test_user_messages_and_likes(self):
+        """Do a user's messages and likes list, with the viewer's likes?"""
+
+        msg = Message.query.filter_by(text="warble 0").one()
+        db.session.add(Like(user_id=self.u1_id, message_id=msg.id))
+        db.session.commit()
+
+        with self.client as c:
+            self.log_in(c)
+
+            messages = c.get(f'/api/v1/users/{self.u2_id}/messages').get_json()
+            self.assertEqual(len(messages['messages']), 5)
+            self.assertTrue(messages['messages'][-1]['liked'])
+
+            likes = c.get(f'/api/v1/users/{self.u1_id}/likes').get_json()
+            self.assertEqual([m['text'] for m in likes['messages']],
+                             ["warble 0"])
+
+    def test_follows(self):
+        """Do followers and following list users?"""
+
+        with self.client as c:
+            self.log_in(c)
+
+            following = c.get(f'/api/v1/users/{self.u1_id}/following').get_json()
+            followers = c.get(f'/api/v1/users/{self.u2_id}/followers').get_json()
+
+        self.assertEqual([u['username'] for u in following['users']], ["u2"])
+        self.assertEqual([u['username'] for u in followers['users']], ["u1"])
+
+    def test_message(self):
+        """Does a single message show without logging in?"""
+
+        msg = Message.query.filter_by(text="warble 0").one()
+
+        resp = self.client.get(f'/api/v1/messages/{msg.id}')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['message']['text'], "warble 0")
+
+    def test_follow_users(self):
+        """Does POSTing user ids follow them all, skipping repeats?"""
+
+        u3 = User.signup("u3", "u3@test.com", "password", None)
+        db.session.commit()
+        u3_id = u3.id
+
+        with self.client as c:
+            self.log_in(c)
+
+            resp = c.post('/api/v1/following',
+                          json={"user_ids": [self.u2_id, u3_id, u3_id, 999999]})
+            self.assertEqual(resp.get_json(), {"added": 1})
+
+            resp = c.post('/api/v1/following', json={"user_ids": ["u2"]})
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.post('/api/v1/following', data={"user_ids": u3_id})
+            self.assertEqual(resp.status_code, 400)
+
+        self.assertEqual(User.query.get(self.u1_id).following_count, 2)
+        self.assertEqual(User.query.get(u3_id).followers_count, 1)
+
+    def test_errors(self):
+        """Are errors JSON?"""
+
+        resp = self.client.get('/api/v1/timeline')
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn('error', resp.get_json())
+
+        resp = self.client.get('/api/v1/messages/0')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.get_json()['error'], "No such message.")
+
+        resp = self.client.get(f'/api/v1/users/{self.u2_id}/messages?limit=1000')
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.get(f'/api/v1/users/{self.u2_id}/messages?before=nope')
+        self.assertEqual(resp.status_code, 400)
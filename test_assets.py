@@ -0,0 +1,115 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+import gzip
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from flask import Flask, render_template_string
+
+from assets import Assets, build
+
+STYLESHEET = b'.hero { background: url("/static/images/hero.png"); }\n' * 20
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving fingerprinted assets."""
+
+    def setUp(self):
+        """Make a static folder with an image and a stylesheet."""
+
+        self.tmp = TemporaryDirectory()
+        self.static = self.tmp.name
+
+        os.makedirs(os.path.join(self.static, 'images'))
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+
+        with open(os.path.join(self.static, 'images', 'hero.png'), 'wb') as f:
+            f.write(b'not really a png')
+        with open(os.path.join(self.static, 'stylesheets', 'style.css'), 'wb') as f:
+            f.write(STYLESHEET)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_app(self):
+        app = Flask(__name__, static_folder=self.static,
+                    static_url_path='/static')
+        assets = Assets(app)
+        return app, assets
+
+    def test_build(self):
+        """Are files fingerprinted, precompressed and listed in the manifest?"""
+
+        manifest = build(self.static)
+        dist = os.path.join(self.static, 'dist')
+
+        self.assertRegex(manifest['stylesheets/style.css'],
+                         r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+
+        with open(os.path.join(dist, 'manifest.json')) as f:
+            self.assertEqual(json.load(f), manifest)
+
+        css_path = os.path.join(dist, manifest['stylesheets/style.css'])
+        with open(css_path, 'rb') as f:
+            css = f.read()
+
+        # the stylesheet points at the fingerprinted image
+        image = os.path.basename(manifest['images/hero.png'])
+        self.assertIn(f'url("../images/{image}")'.encode(), css)
+
+        with gzip.open(css_path + '.gz') as f:
+            self.assertEqual(f.read(), css)
+
+        # images aren't worth compressing again
+        self.assertFalse(os.path.exists(
+            os.path.join(dist, manifest['images/hero.png'] + '.gz')))
+
+    def test_asset_url(self):
+        """Does asset_url use the build when there is one?"""
+
+        app, assets = self.make_app()
+
+        with app.test_request_context():
+            self.assertEqual(render_template_string(
+                "{{ asset_url('stylesheets/style.css') }}"),
+                '/static/stylesheets/style.css')
+
+            manifest = build(self.static)
+            assets.load_manifest()
+
+            self.assertEqual(render_template_string(
+                "{{ asset_url('stylesheets/style.css') }}"),
+                f"/assets/{manifest['stylesheets/style.css']}")
+
+    def test_send_asset(self):
+        """Are assets immutable, and gzipped for clients that accept it?"""
+
+        manifest = build(self.static)
+        app, assets = self.make_app()
+        url = f"/assets/{manifest['stylesheets/style.css']}"
+
+        with app.test_client() as client:
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.content_encoding, 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertIn('Accept-Encoding', resp.vary)
+            self.assertTrue(resp.cache_control.immutable)
+            self.assertEqual(resp.cache_control.max_age, 365 * 24 * 60 * 60)
+            self.assertLess(len(resp.get_data()), len(STYLESHEET))
+            resp.close()
+
+            resp = client.get(url)
+
+            self.assertIsNone(resp.content_encoding)
+            self.assertIn(b'.hero', resp.get_data())
+            resp.close()
+
+            self.assertEqual(client.get('/assets/nope.css').status_code, 404)
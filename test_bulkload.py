@@ -0,0 +1,104 @@
+"""Bulk load tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bulkload.py
+
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import text
+
+from models import db, Message, User
+from bulkload import constraints_and_indexes, copy_csv, reset_sequences, without_constraints
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+from app import app  # noqa: F401
+
+db.create_all()
+
+TABLES = ['users', 'messages']
+
+USERS_CSV = """\
+id,email,username,image_url,password,bio,header_image_url,location
+1,one@test.com,one,/static/images/default-pic.png,hashed,,/static/images/warbler-hero.jpg,
+2,two@test.com,two,/static/images/default-pic.png,hashed,"Hi, I'm two",/static/images/warbler-hero.jpg,Here
+"""
+
+MESSAGES_CSV = """\
+text,timestamp,user_id
+First warble,2021-01-01 10:00:00,1
+"Second, with a comma",2021-01-02 10:00:00,2
+Third warble,2021-01-03 10:00:00,2
+"""
+
+
+class BulkLoadTestCase(TestCase):
+    """Test loading CSVs with COPY while constraints are dropped."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        # the load (and its DDL) is all in the session's transaction
+        db.session.rollback()
+        self.dir.cleanup()
+
+    def write_csv(self, name, content):
+        path = os.path.join(self.dir.name, name)
+
+        with open(path, 'w', newline='') as f:
+            f.write(content)
+
+        return path
+
+    def catalog(self):
+        """The names of the constraints and indexes on TABLES and the
+        tables referencing them."""
+
+        constraints, indexes = constraints_and_indexes(
+            TABLES + ['follows', 'likes', 'timeline_entries'])
+
+        return ({name for _, name, _ in constraints},
+                {name for _, name, _ in indexes})
+
+    def test_copy_without_constraints(self):
+        """Are the CSVs loaded, and every constraint and index restored?"""
+
+        users = self.write_csv('users.csv', USERS_CSV)
+        messages = self.write_csv('messages.csv', MESSAGES_CSV)
+
+        constraints, indexes = self.catalog()
+        self.assertIn('messages_user_id_fkey', constraints)
+        self.assertIn('ix_messages_search_vector', indexes)
+
+        with without_constraints(TABLES, out=io.StringIO()):
+            self.assertEqual(self.catalog(), (set(), set()))
+
+            self.assertEqual(copy_csv('users', users), 2)
+            self.assertEqual(copy_csv('messages', messages), 3)
+
+        reset_sequences(TABLES)
+
+        self.assertEqual(self.catalog(), (constraints, indexes))
+        self.assertEqual(User.query.count(), 2)
+        self.assertEqual(Message.query.filter_by(user_id=2).count(), 2)
+        self.assertEqual(User.query.get(2).bio, "Hi, I'm two")
+
+        # the generated search columns were filled in as the rows went in
+        self.assertEqual(db.session.execute(text(
+            "SELECT count(*) FROM messages "
+            "WHERE search_vector @@ to_tsquery('english', 'warble')")).scalar(), 2)
+
+        # new users' ids carry on past the loaded ones
+        user = User.signup("three", "three@test.com", "password", None)
+        db.session.flush()
+        self.assertEqual(user.id, 3)
@@ -0,0 +1,70 @@
+"""LRU cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+from unittest import TestCase
+
+from cache import LRUCache
+
+
+class FakeClock:
+    """A clock the tests can move forward by hand."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(TestCase):
+    """Test the LRU cache."""
+
+    def test_get_and_set(self):
+        """Does it return what was set, and the default otherwise?"""
+
+        cache = LRUCache()
+        cache.set("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("b", 2), 2)
+
+    def test_evicts_least_recently_used(self):
+        """Does a full cache evict the entry used longest ago?"""
+
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        """Do entries expire `ttl` seconds after they were set?"""
+
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set("a", 1)
+
+        clock.now = 9
+        self.assertEqual(cache.get("a"), 1)
+
+        clock.now = 10
+        self.assertIsNone(cache.get("a"))
+
+    def test_delete(self):
+        """Does delete forget a key, and ignore missing ones?"""
+
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.delete("a")
+        cache.delete("b")
+
+        self.assertIsNone(cache.get("a"))
@@ -0,0 +1,112 @@
+"""Compression middleware tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+import gzip
+import zlib
+from unittest import TestCase
+
+from flask import Flask, Response, request
+
+from compression import CompressionMiddleware, SKIP_COMPRESSION
+
+PAGE = "<p>Hello, warbler!</p>\n" * 100
+
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/page')
+    def page():
+        response = Response(PAGE)
+        response.set_etag('abc')
+        return response
+
+    @app.route('/small')
+    def small():
+        return "<p>Hi</p>"
+
+    @app.route('/encoded')
+    def encoded():
+        return Response(gzip.compress(PAGE.encode()),
+                        headers={'Content-Encoding': 'gzip'},
+                        mimetype='text/css')
+
+    @app.route('/image')
+    def image():
+        return Response(b'\x89PNG' * 500, mimetype='image/png')
+
+    @app.route('/stream')
+    def stream():
+        return Response((f"<p>{n}</p>\n" * 50 for n in range(3)))
+
+    @app.route('/secret')
+    def secret():
+        request.environ[SKIP_COMPRESSION] = True
+        return PAGE
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=500)
+
+    return app
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    """Test which responses are compressed, and how."""
+
+    def setUp(self):
+        self.client = make_app().test_client()
+
+    def get(self, path, encoding='gzip'):
+        return self.client.get(path, headers={'Accept-Encoding': encoding})
+
+    def test_gzip(self):
+        """Are pages gzipped for clients that accept it?"""
+
+        resp = self.get('/page')
+
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertIn('Accept-Encoding', resp.vary)
+        self.assertEqual(resp.headers['ETag'], 'W/"abc"')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(gzip.decompress(resp.get_data()).decode(), PAGE)
+        self.assertLess(len(resp.get_data()), len(PAGE))
+
+    def test_not_accepted(self):
+        """Do clients that don't accept gzip get the plain page?"""
+
+        resp = self.get('/page', encoding='identity')
+
+        self.assertIsNone(resp.content_encoding)
+        self.assertIn('Accept-Encoding', resp.vary)
+        self.assertEqual(resp.headers['ETag'], '"abc"')
+        self.assertEqual(resp.get_data(as_text=True), PAGE)
+
+    def test_skipped(self):
+        """Are small, encoded, binary and opted-out responses left alone?"""
+
+        self.assertIsNone(self.get('/small').content_encoding)
+        self.assertIsNone(self.get('/image').content_encoding)
+        self.assertIsNone(self.get('/secret').content_encoding)
+
+        resp = self.get('/encoded')
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(resp.get_data()).decode(), PAGE)
+
+    def test_streamed(self):
+        """Is each chunk of a streamed response decodable as it arrives?"""
+
+        resp = self.get('/stream')
+        self.assertEqual(resp.content_encoding, 'gzip')
+
+        decompressor = zlib.decompressobj(31)
+        received = ""
+
+        for n, chunk in enumerate(resp.response):
+            received += decompressor.decompress(chunk).decode()
+            if n < 3:
+                self.assertTrue(received.endswith(f"<p>{n}</p>\n"))
+
+        self.assertEqual(received,
+                         "".join(f"<p>{n}</p>\n" * 50 for n in range(3)))
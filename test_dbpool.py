@@ -0,0 +1,152 @@
+"""Config profile and connection pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_dbpool.py
+
+import os
+import threading
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.pool import NullPool
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+from config import configure, engine_options
+from dbpool import InstrumentedQueuePool, init_app, pool_stats
+
+
+def statement_timeout(engine):
+    with engine.begin() as conn:
+        return conn.execute(text("SHOW statement_timeout")).scalar()
+
+
+class ConfigTestCase(TestCase):
+    """Test the config profiles' database settings."""
+
+    def test_profiles(self):
+        """Is echo only on in development, with a pooled engine everywhere?"""
+
+        for name, echo in [('development', True),
+                           ('testing', False),
+                           ('production', False)]:
+            app = Flask(__name__)
+            configure(app, name)
+
+            self.assertEqual(app.config['SQLALCHEMY_ECHO'], echo, name)
+            options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+            self.assertIs(options['poolclass'], InstrumentedQueuePool)
+            self.assertTrue(options['pool_pre_ping'])
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            configure(Flask(__name__), 'staging')
+
+    def test_pgbouncer(self):
+        """Does PgBouncer mode leave pooling to PgBouncer, timing out per transaction?"""
+
+        app = Flask(__name__)
+        configure(app, 'production')
+        app.config['DB_PGBOUNCER'] = True
+        app.config['DB_STATEMENT_TIMEOUT'] = 1234
+
+        self.assertEqual(engine_options(app.config), {'poolclass': NullPool})
+
+        engine = create_engine(os.environ['DATABASE_URL'], poolclass=NullPool)
+        init_app(app, engine)
+
+        with app.test_request_context():
+            self.assertEqual(statement_timeout(engine), "1234ms")
+
+        with app.app_context():
+            self.assertEqual(statement_timeout(engine), "0")
+
+    def test_statement_timeout(self):
+        """Do requests time out, but not CLI commands and jobs?"""
+
+        app = Flask(__name__)
+        configure(app, 'production')
+        app.config['DB_STATEMENT_TIMEOUT'] = 1234
+
+        options = engine_options(app.config)
+        engine = create_engine(os.environ['DATABASE_URL'], poolclass=NullPool,
+                               connect_args=options['connect_args'])
+        init_app(app, engine)
+
+        with app.test_request_context():
+            self.assertEqual(statement_timeout(engine), "1234ms")
+
+        # e.g. in `flask worker`
+        with app.app_context():
+            self.assertEqual(statement_timeout(engine), "0")
+
+
+class InstrumentedQueuePoolTestCase(TestCase):
+    """Test checkout wait and saturation stats."""
+
+    def setUp(self):
+        self.engine = create_engine(os.environ['DATABASE_URL'],
+                                    poolclass=InstrumentedQueuePool,
+                                    pool_size=1,
+                                    max_overflow=0,
+                                    pool_timeout=0.2)
+        pool_stats.reset()
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_wait_and_saturation(self):
+        """Are waits for a busy pool, and its saturation, recorded?"""
+
+        held = self.engine.connect()
+        held.execute(text("SELECT 1"))
+
+        stats = pool_stats.snapshot(self.engine.pool)
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(stats['saturation'], 1.0)
+
+        # a second checkout waits until the first connection comes back
+        threading.Timer(0.05, held.close).start()
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+        stats = pool_stats.snapshot(self.engine.pool)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['waited'], 1)
+        self.assertGreaterEqual(stats['max_wait_ms'], 40)
+
+    def test_timeout(self):
+        """Are checkouts that give up counted?"""
+
+        with self.engine.connect():
+            with self.assertRaises(exc.TimeoutError):
+                self.engine.connect()
+
+        self.assertEqual(pool_stats.snapshot(self.engine.pool)['timeouts'], 1)
+
+
+class PoolStatusTestCase(TestCase):
+    """Test the /_status/pool endpoint."""
+
+    def test_needs_token(self):
+        from app import app
+
+        client = app.test_client()
+        self.assertEqual(client.get('/_status/pool').status_code, 404)
+
+        app.config['STATUS_TOKEN'] = 'sesame'
+        try:
+            resp = client.get('/_status/pool',
+                              headers={'X-Status-Token': 'wrong'})
+            self.assertEqual(resp.status_code, 404)
+
+            resp = client.get('/_status/pool',
+                              headers={'X-Status-Token': 'sesame'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('saturation', resp.get_json())
+        finally:
+            app.config['STATUS_TOKEN'] = None
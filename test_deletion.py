@@ -0,0 +1,158 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deletion.py
+
+import os
+from unittest import TestCase
+
+from models import db, AccountDeletion, Follows, Like, Message, TimelineEntry, User
+import deletion
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class DeletionTestCase(TestCase):
+    """Test tombstoning accounts and purging them in batches."""
+
+    def setUp(self):
+        """Make a user ("gone") with three messages, followed by and
+        following u1, who liked two of the messages and was liked back."""
+
+        Message.query.delete()
+        User.query.delete()
+        AccountDeletion.query.delete()
+
+        self.client = app.test_client()
+
+        gone = User.signup("gone", "gone@test.com", "password", None)
+        u1 = User.signup("u1", "u1@test.com", "password", None)
+        db.session.flush()
+
+        messages = [Message(text=f"gone warble {n}", user_id=gone.id) for n in range(3)]
+        own = Message(text="u1 warble", user_id=u1.id)
+        db.session.add_all(messages + [own])
+        db.session.flush()
+
+        Follows.add([(gone.id, u1.id), (u1.id, gone.id)])
+        db.session.add_all([Like(user_id=u1.id, message_id=messages[0].id),
+                            Like(user_id=u1.id, message_id=messages[1].id),
+                            Like(user_id=gone.id, message_id=own.id)])
+        TimelineEntry.backfill()
+        User.recount()
+        db.session.commit()
+
+        self.gone_id = gone.id
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_delete_hides_account(self):
+        """Is a tombstoned account and its messages hidden before the purge?"""
+
+        deletion.tombstone(self.gone_id)
+        db.session.commit()
+
+        self.assertFalse(User.authenticate("gone", "password"))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            self.assertEqual(c.get(f'/users/{self.gone_id}').status_code, 404)
+            self.assertNotIn("@gone", c.get('/users').get_data(as_text=True))
+            self.assertNotIn("gone warble", c.get('/').get_data(as_text=True))
+            self.assertNotIn("gone warble",
+                             c.get('/messages/search?q=warble').get_data(as_text=True))
+            self.assertEqual(c.get(f'/api/v1/users/{self.gone_id}').status_code, 404)
+            timeline = c.get('/api/v1/timeline').get_json()['messages']
+            self.assertEqual([msg['text'] for msg in timeline], ["u1 warble"])
+
+        # still there until purged
+        self.assertEqual(Message.query.filter_by(user_id=self.gone_id).count(), 3)
+        self.assertEqual(deletion.pending(), [self.gone_id])
+
+    def test_purge(self):
+        """Does purging in small batches delete everything and fix counters?"""
+
+        deletion.tombstone(self.gone_id)
+        db.session.commit()
+
+        progress = deletion.purge(self.gone_id, batch_size=2)
+
+        self.assertIsNotNone(progress.finished_at)
+        self.assertEqual((progress.follows_deleted, progress.likes_deleted,
+                          progress.messages_deleted), (2, 3, 3))
+
+        self.assertIsNone(User.query.get(self.gone_id))
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=self.u1_id).count(), 1)
+        self.assertEqual(User.recount(fix=False), [])
+        self.assertEqual(deletion.pending(), [])
+
+    def test_purge_batches_bounded(self):
+        """Does each purge batch delete at most batch_size rows, cascades
+        included?"""
+
+        deletion.tombstone(self.gone_id)
+        db.session.commit()
+
+        def rows():
+            return sum(model.query.count()
+                       for model in (Follows, Like, Message, TimelineEntry))
+
+        for step, _ in deletion.STEPS:
+            while True:
+                before = rows()
+                deleted = step(self.gone_id, 2)
+                self.assertLessEqual(before - rows(), 2, step.__name__)
+                if not deleted:
+                    break
+
+        # the user row itself goes in the last step
+        self.assertEqual(User.recount([self.u1_id], fix=False), [])
+
+    def test_purge_active_user(self):
+        """Does purge refuse an account that wasn't deleted?"""
+
+        with self.assertRaises(ValueError):
+            deletion.purge(self.u1_id)
+
+        self.assertIsNotNone(User.query.get(self.u1_id))
+
+    def test_delete_user(self):
+        """Does /users/delete log out and purge the account?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.gone_id
+
+            resp = c.post('/users/delete')
+
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(User.query.get(self.gone_id))
+        self.assertEqual(User.query.get(self.u1_id).followers_count, 0)
+
+    def test_purge_accounts_command(self):
+        """Does `flask purge-accounts` finish pending deletions?"""
+
+        deletion.tombstone(self.gone_id)
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['purge-accounts'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Purged 1 accounts.", result.output)
+        self.assertIsNone(User.query.get(self.gone_id))
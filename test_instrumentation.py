@@ -0,0 +1,76 @@
+"""Per-request query instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+import os
+from unittest import TestCase
+
+from models import db, User
+from instrumentation import fingerprint, query_budget
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+from app import app
+
+db.create_all()
+
+
+class FingerprintTestCase(TestCase):
+    """Test statement shapes."""
+
+    def test_fingerprint(self):
+        """Do statements differing only in values share a shape?"""
+
+        self.assertEqual(
+            fingerprint("SELECT * FROM users\n WHERE id IN (%(id_1_1)s, %(id_1_2)s)"),
+            fingerprint("SELECT * FROM users WHERE id IN (%(id_1_1)s)"))
+        self.assertEqual(
+            fingerprint("SELECT 'a' FROM users_1 LIMIT 10"),
+            "SELECT ? FROM users_1 LIMIT ?")
+
+
+class RequestStatsTestCase(TestCase):
+    """Test the Server-Timing header, log line and N+1 warning."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+    def test_server_timing(self):
+        """Does a response report its query count and DB time?"""
+
+        resp = app.test_client().get('/users/0')
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertRegex(resp.headers['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="1 queries", app;dur=[\d.]+$')
+
+    def test_repeated_statement_warning(self):
+        """Is a statement shape repeated past the threshold logged?"""
+
+        threshold = app.config['QUERY_REPEAT_THRESHOLD']
+
+        with self.assertLogs('warbler.sql', level='WARNING') as logs:
+            with app.test_request_context('/users'):
+                app.preprocess_request()
+                for user_id in range(threshold + 1):
+                    User.query.get(user_id)
+                app.do_teardown_request()
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(f"GET /users ran the same statement {threshold + 1} times",
+                      logs.output[0])
+
+    def test_query_budget(self):
+        """Does query_budget fail with the statements over budget?"""
+
+        with self.assertRaises(AssertionError) as error:
+            with app.test_request_context(), query_budget(1):
+                User.query.get(1)
+                User.query.get(2)
+
+        self.assertIn("2 queries, over the budget of 1", str(error.exception))
+        self.assertIn("2 x SELECT", str(error.exception))
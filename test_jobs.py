@@ -0,0 +1,223 @@
+"""Job queue and worker tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+import os
+import threading
+import time
+from unittest import TestCase
+
+from models import db, Follows, Job, Message, TimelineEntry, User
+import jobs
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+ran = []
+
+
+@jobs.queue.task('test-record')
+def record(value):
+    ran.append(value)
+
+
+@jobs.queue.task('test-fail', max_attempts=2)
+def fail():
+    raise RuntimeError("Job went wrong")
+
+
+@jobs.queue.task('test-heartbeat')
+def long_running():
+    # as if it had been running for two minutes, committing as it goes
+    (Job.query
+     .filter_by(status='running')
+     .update({Job.started_at: db.func.now() - db.text("interval '2 minutes'")},
+             synchronize_session=False))
+    db.session.commit()
+
+    jobs.queue.heartbeat()
+    db.session.commit()
+
+    ran.append(jobs.queue.requeue_stale())
+
+
+class JobQueueTestCase(TestCase):
+    """Test enqueueing, claiming, retrying and working through jobs."""
+
+    def setUp(self):
+        Job.query.delete()
+        db.session.commit()
+        ran.clear()
+
+        self.queue = jobs.queue
+        self.queue.configure(run_inline=False, timeout=60, retry_base=30)
+
+    def tearDown(self):
+        db.session.rollback()
+        self.queue.init_app(app)
+
+    def test_enqueue_and_work(self):
+        """Does a queued job run once and end up done?"""
+
+        job_id = self.queue.enqueue('test-record', {'value': 1})
+        db.session.commit()
+
+        self.assertTrue(self.queue.work())
+        self.assertIsNone(self.queue.work())
+        self.assertEqual(ran, [1])
+
+        job = Job.query.get(job_id)
+        self.assertEqual((job.status, job.attempts), ('done', 1))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_idempotency_key(self):
+        """Is a job with a used key queued only once?"""
+
+        self.assertIsNotNone(self.queue.enqueue('test-record', {'value': 1}, key='once'))
+        self.assertIsNone(self.queue.enqueue('test-record', {'value': 2}, key='once'))
+        db.session.commit()
+
+        self.assertEqual(Job.query.count(), 1)
+
+        with self.assertRaises(ValueError):
+            self.queue.enqueue('no-such-task')
+
+    def test_priority_and_delay(self):
+        """Are higher priorities claimed first, and delayed jobs not yet?"""
+
+        self.queue.enqueue('test-record', {'value': 'low'})
+        self.queue.enqueue('test-record', {'value': 'later'}, priority=20, delay=60)
+        self.queue.enqueue('test-record', {'value': 'high'}, priority=10)
+        db.session.commit()
+
+        while self.queue.work():
+            pass
+
+        self.assertEqual(ran, ['high', 'low'])
+
+    def test_skip_locked(self):
+        """Does a claim skip a job another transaction has locked?"""
+
+        first = self.queue.enqueue('test-record', {'value': 1})
+        second = self.queue.enqueue('test-record', {'value': 2})
+        db.session.commit()
+
+        with db.engine.connect() as other:
+            with other.begin():
+                other.exec_driver_sql("SELECT * FROM jobs WHERE id = %s FOR UPDATE",
+                                      (first,))
+                job = self.queue.claim()
+
+        self.assertEqual(job.id, second)
+
+    def test_retry_then_fail(self):
+        """Is a failing job retried after a backoff, then failed?"""
+
+        job_id = self.queue.enqueue('test-fail')
+        db.session.commit()
+
+        self.assertFalse(self.queue.work())
+
+        job = Job.query.get(job_id)
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn("Job went wrong", job.last_error)
+        # backed off: not due yet
+        self.assertIsNone(self.queue.work())
+
+        Job.query.filter_by(id=job_id).update({Job.run_at: db.func.now()})
+        db.session.commit()
+
+        self.assertFalse(self.queue.work())
+
+        db.session.expire_all()
+        job = Job.query.get(job_id)
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(self.queue.stats()['by_task'], {'test-fail': {'failed': 1}})
+
+    def test_requeue_stale(self):
+        """Is a job whose worker died put back in the queue?"""
+
+        job_id = self.queue.enqueue('test-record', {'value': 1})
+        db.session.commit()
+        self.queue.claim()
+
+        Job.query.filter_by(id=job_id).update(
+            {Job.started_at: db.func.now() - db.text("interval '2 minutes'")},
+            synchronize_session=False)
+        db.session.commit()
+
+        self.assertEqual(self.queue.requeue_stale(), 1)
+        self.assertTrue(self.queue.work())
+        self.assertEqual(Job.query.get(job_id).attempts, 2)
+
+    def test_heartbeat(self):
+        """Is a job that heartbeats left running past the timeout?"""
+
+        job_id = self.queue.enqueue('test-heartbeat')
+        db.session.commit()
+
+        self.assertTrue(self.queue.work())
+        self.assertEqual(ran, [0])
+        self.assertEqual(Job.query.get(job_id).attempts, 1)
+
+    def test_worker(self):
+        """Do a worker's threads run every job between them, once each?"""
+
+        for value in range(20):
+            self.queue.enqueue('test-record', {'value': value})
+        db.session.commit()
+
+        reports = []
+        worker = jobs.Worker(app, self.queue, concurrency=3, poll_interval=0.01,
+                             report_interval=0.05, echo=reports.append)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+
+        deadline = time.monotonic() + 10
+        while len(ran) < 20 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        worker.stop()
+        thread.join()
+
+        self.assertEqual(sorted(ran), list(range(20)))
+        self.assertEqual(Job.query.filter_by(status='done').count(), 20)
+        self.assertTrue(reports)
+
+    def test_deferred_work(self):
+        """Are fan-out and account purges left to the queue?"""
+
+        author = User.signup("author", "author@test.com", "password", None)
+        follower = User.signup("follower", "follower@test.com", "password", None)
+        db.session.flush()
+        Follows.add([(follower.id, author.id)])
+        db.session.commit()
+        author_id, follower_id = author.id, follower.id
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = author_id
+
+            c.post('/messages/new', data={"text": "Deferred"})
+
+            self.assertEqual(TimelineEntry.query.filter_by(user_id=author_id).count(), 1)
+            self.assertEqual(TimelineEntry.query.filter_by(user_id=follower_id).count(), 0)
+
+            self.assertTrue(self.queue.work())
+            self.assertEqual(TimelineEntry.query.filter_by(user_id=follower_id).count(), 1)
+
+            c.post('/users/delete')
+
+        self.assertEqual(Message.query.filter_by(user_id=author_id).count(), 1)
+
+        self.assertTrue(self.queue.work())
+        self.assertIsNone(User.query.get(author_id))
+        self.assertEqual(User.query.get(follower_id).following_count, 0)
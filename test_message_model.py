@@ -19,6 +19,7 @@ bcrypt = Bcrypt()
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
 # how to check or set environmental variables (shell variables)
 
 # Now we can import app
@@ -8,7 +8,9 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Like, TimelineEntry
+from pagination import MESSAGES_PER_PAGE
+from instrumentation import count_queries, query_budget
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -16,10 +18,11 @@ from models import db, connect_db, Message, User
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, message_fragments
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -77,6 +80,36 @@ class MessageViewTestCase(TestCase):
 
             msg = Message.query.one()
             self.assertEqual(msg.text, "Hello")
+            self.assertEqual(User.query.get(self.testuser.id).messages_count, 1)
+
+    def test_add_message_fans_out(self):
+        """Does a new message land on the author's and followers' timelines?"""
+
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        follower.following.append(self.testuser)
+        db.session.commit()
+        follower_id = follower.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "Hello followers"})
+
+            msg = Message.query.one()
+            timeline_user_ids = {entry.user_id for entry in
+                                 TimelineEntry.query.filter_by(message_id=msg.id)}
+
+            self.assertEqual(timeline_user_ids, {self.testuser.id, follower_id})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower_id
+
+            resp = c.get("/")
+            self.assertIn("Hello followers", resp.get_data(as_text=True))
             
     
     def test_add_message_logged_out_fail(self):
@@ -111,6 +144,8 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertNotIn("This is a message", html)
             self.assertIsNone(m) # to confirm that m is None because message no longer exists
+            self.assertEqual(TimelineEntry.query.count(), 0)
+            self.assertIsNone(message_fragments.bodies.get(msg.id))
 
 
     def test_delete_logged_out_fail(self):
@@ -143,6 +178,387 @@ class MessageViewTestCase(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn("This is a message", html)
 
+    def test_show_message_not_modified(self):
+        """Does a message page revalidate with a 304 until it changes?"""
+
+        msg = Message(text="This is a message", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get(f"/messages/{msg.id}")
+            etag = resp.headers['ETag']
+
+            self.assertTrue(resp.cache_control.no_cache)
+            self.assertIn('Cookie', resp.vary)
+
+            resp = c.get(f"/messages/{msg.id}",
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b"")
+
+            # the author's avatar is on the page
+            User.query.filter_by(id=self.testuser.id).update(
+                {User.profile_version: User.profile_version + 1})
+            db.session.commit()
+
+            resp = c.get(f"/messages/{msg.id}",
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_homepage_pages_with_cursor(self):
+        """Does the homepage show one page and link to the older ones?"""
+
+        for i in range(MESSAGES_PER_PAGE + 1):
+            msg = Message(text=f"warble {i:03}", user_id=self.testuser.id)
+            db.session.add(msg)
+        db.session.flush()
+        TimelineEntry.backfill()
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertEqual(html.count('class="message-link"'), MESSAGES_PER_PAGE)
+            self.assertIn("Older warbles", html)
+
+            oldest = (Message.query
+                      .order_by(Message.timestamp, Message.id)
+                      .first())
+            self.assertNotIn(f'/messages/{oldest.id}"', html)
+
+            cursor = html.split("before=")[1].split('"')[0]
+            resp = c.get(f"/?before={cursor}&fragment=1")
+            fragment = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("<html", fragment)
+            self.assertIn(f'/messages/{oldest.id}"', fragment)
+            self.assertNotIn("Older warbles", fragment)
+
+    def test_bad_cursor(self):
+        """Does a garbled cursor get a 400 rather than a server error?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get("/?before=not-a-cursor")
+
+        self.assertEqual(resp.status_code, 400)
+
+    def add_followed_authors(self, count):
+        """Have testuser follow `count` new users who each post a message."""
+
+        authors = [User.signup(username=f"author{i}",
+                               email=f"author{i}@test.com",
+                               password="password",
+                               image_url=None)
+                   for i in range(count)]
+        self.testuser.following.extend(authors)
+        db.session.commit()
+
+        db.session.add_all([Message(text=f"by author{i}", user_id=author.id)
+                            for i, author in enumerate(authors)])
+        db.session.commit()
+        TimelineEntry.backfill()
+        db.session.commit()
+
+    def test_homepage_query_count(self):
+        """Does the homepage run a fixed number of queries per page?
+
+        The viewer's counters, the timeline page, one batch of authors and
+        the viewer's likes -- however many authors are on the page. (The
+        viewer themself comes from the current-user cache.)
+        """
+
+        self.add_followed_authors(10)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get("/")  # warm the current-user cache
+
+            with count_queries() as queries:
+                resp = c.get("/")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("by author9", resp.get_data(as_text=True))
+        self.assertEqual(queries.count, 4)
+
+    def test_message_routes_query_budget(self):
+        """Do the message pages stay within their query budgets?
+
+        Budgets hold however many authors and likes are on the page, so an
+        N+1 in a template fails here.
+        """
+
+        self.add_followed_authors(10)
+        self.testuser.likes.extend(Message.query.limit(5).all())
+        db.session.commit()
+
+        msg = Message.query.first()
+        budgets = {
+            "/": 4,
+            f"/messages/{msg.id}": 3,
+            "/messages/search?q=author": 3,
+            f"/users/{self.testuser.id}": 3,
+        }
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get("/")  # warm the current-user cache
+
+            for path, budget in budgets.items():
+                with query_budget(budget):
+                    resp = c.get(path)
+                    resp.get_data()
+
+                self.assertEqual(resp.status_code, 200, path)
+
+    def test_show_message_query_count(self):
+        """Does showing a message run a fixed number of queries?"""
+
+        self.add_followed_authors(3)
+        msg = Message.query.filter_by(text="by author0").one()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get(f"/messages/{msg.id}")  # warm the current-user cache
+
+            with count_queries() as queries:
+                resp = c.get(f"/messages/{msg.id}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(queries.count, 3)
+
+    def test_search_messages(self):
+        """Does message search match stemmed words and honor filters?"""
+
+        other = User.signup(username="otheruser",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+
+        db.session.add_all([
+            Message(text="The birds were warbling", user_id=self.testuser.id),
+            Message(text="A bird warbled at dawn", user_id=other.id),
+            Message(text="Nothing to see here", user_id=other.id),
+        ])
+        db.session.commit()
+
+        with self.client as c:
+            html = c.get("/messages/search?q=warble").get_data(as_text=True)
+
+            self.assertIn("The birds were warbling", html)
+            self.assertIn("A bird warbled at dawn", html)
+            self.assertNotIn("Nothing to see here", html)
+
+            html = (c.get("/messages/search?q=warble&author=otheruser")
+                    .get_data(as_text=True))
+
+            self.assertNotIn("The birds were warbling", html)
+            self.assertIn("A bird warbled at dawn", html)
+
+            html = (c.get("/messages/search?q=warble&until=2000-01-01")
+                    .get_data(as_text=True))
+
+            self.assertIn("Sorry, no warbles found", html)
+
+            resp = c.get("/messages/search?q=warble&since=yesterday")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_search_control_characters(self):
+        """Are NULs and other control characters in a search ignored?"""
+
+        db.session.add(Message(text="Warble away", user_id=self.testuser.id))
+        db.session.commit()
+
+        with self.client as c:
+            for query in ("q=%00", "q=%00%1F&author=%00", "q=%00&author=testuser"):
+                resp = c.get(f"/messages/search?{query}")
+
+                self.assertEqual(resp.status_code, 200, query)
+                self.assertNotIn("Warble away", resp.get_data(as_text=True))
+
+            for query in ("q=warble%00&author=testuser%00", "q=warble&author=%00"):
+                html = c.get(f"/messages/search?{query}").get_data(as_text=True)
+                self.assertIn("Warble away", html, query)
+
+    def test_search_not_compressed_with_csrf_token(self):
+        """Are pages echoing input next to a CSRF token left uncompressed?"""
+
+        db.session.add_all([Message(text=f"Warble number {n}", user_id=self.testuser.id)
+                            for n in range(10)])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+                sess['csrf_token'] = "secret"
+
+            gzip = {'Accept-Encoding': 'gzip'}
+
+            self.assertEqual(c.get("/", headers=gzip).content_encoding, 'gzip')
+            self.assertIsNone(c.get("/messages/search?q=warble", headers=gzip)
+                              .content_encoding)
+
+    def test_cached_message_markup(self):
+        """Is message markup reused, and re-rendered after a profile edit?"""
+
+        msg = Message(text="Cache me", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.flush()
+        TimelineEntry.fan_out(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get("/")
+            version, html = message_fragments.bodies.get(msg_id)
+            self.assertIn("@testuser", html)
+
+            c.get(f"/users/{self.testuser.id}")
+            self.assertIs(message_fragments.bodies.get(msg_id)[1], html)
+
+            c.post('/users/profile', data={"username": "renamed",
+                                           "email": "test@test.com",
+                                           "password": "testuser"})
+            timeline = c.get("/").get_data(as_text=True)
+
+        self.assertIn('<a href="/users/%d">@renamed</a>' % self.testuser.id,
+                      timeline)
+        self.assertEqual(message_fragments.bodies.get(msg_id)[0], version + 1)
+
+    def add_other_message(self):
+        """Add a message by another user; returns its id."""
+
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="other",
+                            image_url=None)
+        db.session.flush()
+        msg = Message(text="Likeable", user_id=other.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        return msg.id
+
+    def test_toggle_like(self):
+        """Does toggling a like add it, then remove it, keeping the count?"""
+
+        msg_id = self.add_other_message()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post(f"/messages/{msg_id}/togglelike")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Like.query.filter_by(message_id=msg_id).count(), 1)
+            self.assertEqual(User.query.get(self.testuser.id).likes_count, 1)
+
+            c.post(f"/messages/{msg_id}/togglelike")
+            db.session.expire_all()
+            self.assertEqual(Like.query.filter_by(message_id=msg_id).count(), 0)
+            self.assertEqual(User.query.get(self.testuser.id).likes_count, 0)
+
+    def test_toggle_like_json(self):
+        """Does a script get the new state and counts in one statement?"""
+
+        msg_id = self.add_other_message()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get("/")  # warm the current-user cache
+
+            with count_queries() as queries:
+                resp = c.post(f"/messages/{msg_id}/togglelike",
+                              headers={"Accept": "application/json"})
+
+            self.assertEqual(resp.json, {"message_id": msg_id, "liked": True,
+                                         "likes": 1, "likes_count": 1})
+            # the author lookup, then the toggle
+            self.assertEqual(queries.count, 2)
+
+            resp = c.post(f"/messages/{msg_id}/togglelike",
+                          headers={"Accept": "application/json"})
+            self.assertEqual(resp.json["liked"], False)
+            self.assertEqual(resp.json["likes"], 0)
+
+    def test_toggle_like_fragment(self):
+        """Does ?fragment=1 answer with just the like form?"""
+
+        msg_id = self.add_other_message()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post(f"/messages/{msg_id}/togglelike?fragment=1")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(html.startswith('<form class="messages-like">'))
+            self.assertIn('class="fas fa-star"', html)
+
+    def test_toggle_like_own_message(self):
+        """Is liking your own message refused?"""
+
+        msg = Message(text="Mine", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post(f"/messages/{msg_id}/togglelike",
+                          headers={"Accept": "application/json"})
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json, {"error": "You can't like your own posts!"})
+            self.assertEqual(Like.query.count(), 0)
+
+    def test_toggle_like_json_errors(self):
+        """Do JSON callers get missing messages and logged-out likes as JSON?"""
+
+        msg_id = self.add_other_message()
+        user_id = self.testuser.id
+        json = {"Accept": "application/json"}
+
+        with self.client as c:
+            resp = c.post(f"/messages/{msg_id}/togglelike", headers=json)
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.json, {"error": "Access unauthorized."})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.post("/messages/0/togglelike", headers=json)
+            self.assertEqual(resp.status_code, 404)
+            self.assertIn("error", resp.json)
+
+            # other callers still get the HTML error page
+            resp = c.post("/messages/0/togglelike")
+            self.assertEqual(resp.status_code, 404)
+            self.assertIsNone(resp.json)
+
     def test_no_show_nonexistent_message(self):
         """Show 404 error if user tries to access a message that doesn't exist"""
 
@@ -0,0 +1,71 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+from threading import Event, Thread
+from unittest import TestCase
+
+from flask_bcrypt import Bcrypt
+
+from passwords import PasswordHasher, PasswordHasherBusy
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing a bounded number at a time."""
+
+    def setUp(self):
+        """Make a fast hasher (bcrypt's minimum work factor)."""
+
+        self.hasher = PasswordHasher(Bcrypt(), rounds=4, max_workers=1,
+                                     queue_timeout=0.05)
+
+    def test_hash_and_check(self):
+        """Does a hash check against its password and nothing else?"""
+
+        pw_hash = self.hasher.hash("password")
+
+        self.assertTrue(pw_hash.startswith("$2b$04$"))
+        self.assertTrue(self.hasher.check(pw_hash, "password"))
+        self.assertFalse(self.hasher.check(pw_hash, "wrong"))
+
+    def test_empty_password(self):
+        """Does hashing an empty password still raise ValueError?"""
+
+        with self.assertRaises(ValueError):
+            self.hasher.hash("")
+
+    def test_needs_rehash(self):
+        """Does it spot hashes made with a different work factor?"""
+
+        pw_hash = self.hasher.hash("password")
+        self.assertFalse(self.hasher.needs_rehash(pw_hash))
+
+        self.hasher.rounds = 5
+        self.assertTrue(self.hasher.needs_rehash(pw_hash))
+        self.assertTrue(self.hasher.needs_rehash("not a hash"))
+
+    def test_busy(self):
+        """Does it refuse work once every slot stays busy past the timeout?"""
+
+        started = Event()
+        release = Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        holder = Thread(target=self.hasher.run, args=(block,))
+        holder.start()
+        started.wait(5)
+
+        try:
+            with self.assertRaises(PasswordHasherBusy):
+                self.hasher.hash("password")
+        finally:
+            release.set()
+            holder.join()
+
+        # the slot is free again once the blocking call finishes
+        self.assertTrue(self.hasher.check(self.hasher.hash("pw"), "pw"))
@@ -0,0 +1,136 @@
+"""Query plan tests: do the hot queries read the indexes meant for them?"""
+
+# run these tests like:
+#
+#    python -m unittest test_query_plans.py
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import select
+
+from models import db, User, Message, Follows, Like, TimelineEntry
+from pagination import encode_cursor, keyset
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+from app import app  # noqa: F401
+
+db.create_all()
+
+CURSOR = encode_cursor((datetime(2021, 1, 1), 100))
+
+
+def explain(statement):
+    """EXPLAIN output for a query or statement, as one string."""
+
+    statement = getattr(statement, 'statement', statement)
+    compiled = statement.compile(dialect=db.engine.dialect,
+                                 compile_kwargs={"render_postcompile": True})
+    rows = db.session.connection().exec_driver_sql(f"EXPLAIN {compiled}",
+                                                   compiled.params)
+
+    return "\n".join(line for line, in rows)
+
+
+class QueryPlanTestCase(TestCase):
+    """Test that each hot query scans its index, in order.
+
+    The test tables are tiny, so the planner is steered off sequential
+    scans, bitmap scans and sorts to show which index it would use on real
+    data. A keyset page should come straight off its index: a Sort node
+    even so means no index gives its order.
+    """
+
+    def setUp(self):
+        for setting in ('enable_seqscan', 'enable_bitmapscan', 'enable_sort'):
+            db.session.execute(f"SET LOCAL {setting} = off")
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def assertUsesIndex(self, statement, *indexes, ordered=False):
+        """Assert `statement` reads one of `indexes` (and, if `ordered`, no Sort)."""
+
+        plan = explain(statement)
+
+        self.assertTrue(any(index in plan for index in indexes),
+                        f"None of {indexes} in:\n{plan}")
+        if ordered:
+            self.assertNotIn("Sort", plan)
+
+    def test_profile_messages(self):
+        """Does a profile's page of messages read ix_messages_user_id_timestamp?"""
+
+        for cursor in (None, CURSOR):
+            page = keyset(Message.query.filter(Message.user_id == 1),
+                          (Message.timestamp, Message.id), cursor, 50)
+            self.assertUsesIndex(page, 'ix_messages_user_id_timestamp', ordered=True)
+
+    def test_home_timeline(self):
+        """Does the home timeline read ix_timeline_entries_user_id_timestamp?"""
+
+        for cursor in (None, CURSOR):
+            page = keyset(TimelineEntry.messages_for(1),
+                          (TimelineEntry.timestamp, TimelineEntry.message_id),
+                          cursor, 50)
+            self.assertUsesIndex(page, 'ix_timeline_entries_user_id_timestamp',
+                                 ordered=True)
+
+    def test_likes_page(self):
+        """Does a user's likes page read ix_likes_user_id_id?"""
+
+        liked = (db.session
+                 .query(Message, Like.id.label('like_id'))
+                 .join(Like, Like.message_id == Message.id)
+                 .filter(Like.user_id == 1))
+
+        page = keyset(liked, (Like.id,), '100', 50)
+        self.assertUsesIndex(page, 'ix_likes_user_id_id', ordered=True)
+
+    def test_following_and_followers(self):
+        """Do following and followers pages read follows' two indexes?"""
+
+        following = keyset(User.query
+                           .join(Follows, Follows.user_being_followed_id == User.id)
+                           .filter(Follows.user_following_id == 1),
+                           (Follows.user_being_followed_id,), None, 30)
+        self.assertUsesIndex(following, 'ix_follows_user_following_id', ordered=True)
+
+        followers = keyset(User.query
+                           .join(Follows, Follows.user_following_id == User.id)
+                           .filter(Follows.user_being_followed_id == 1),
+                           (Follows.user_following_id,), None, 30)
+        # on a few rows, a skip scan of the other index (Postgres 18+) ties
+        # with the primary key; either returns them in order
+        self.assertUsesIndex(followers, 'follows_pkey', 'ix_follows_user_following_id',
+                             ordered=True)
+
+    def test_viewer_lookups(self):
+        """Do "liked by me?" and "followed by me?" read their indexes?"""
+
+        liked = select(Like.message_id).where(Like.user_id == 1,
+                                              Like.message_id.in_([1, 2, 3]))
+        # either serves it; which is cheaper depends on how many likes
+        # the user has
+        self.assertUsesIndex(liked, 'uq_likes_user_id_message_id', 'ix_likes_user_id_id')
+
+        followed = select(Follows.user_being_followed_id).where(
+            Follows.user_following_id == 1,
+            Follows.user_being_followed_id.in_([1, 2, 3]))
+        self.assertUsesIndex(followed, 'ix_follows_user_following_id')
+
+    def test_deletes(self):
+        """Do deleting a message and unfollowing find their rows by index?"""
+
+        likers = select(Like.user_id).where(Like.message_id == 1)
+        self.assertUsesIndex(likers, 'ix_likes_message_id')
+
+        entries = select(TimelineEntry).where(TimelineEntry.message_id == 1)
+        self.assertUsesIndex(entries, 'ix_timeline_entries_message_id')
+
+        unfollowed = select(TimelineEntry).where(TimelineEntry.user_id == 1,
+                                                 TimelineEntry.author_id == 2)
+        self.assertUsesIndex(unfollowed, 'ix_timeline_entries_author_id_user_id')
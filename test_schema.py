@@ -0,0 +1,237 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_schema.py
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
+
+from models import db, User, Message, Like
+import schema
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
+
+from app import app  # noqa: F401
+
+db.create_all()
+
+
+def drop_query_indexes():
+    """Put the tables back as they were before 0001_query_indexes."""
+
+    db.session.execute("""
+        DROP INDEX ix_messages_user_id_timestamp, ix_follows_user_following_id,
+                   ix_likes_user_id_id, ix_likes_message_id,
+                   ix_timeline_entries_message_id, ix_timeline_entries_author_id_user_id;
+        ALTER TABLE likes DROP CONSTRAINT uq_likes_user_id_message_id;
+    """)
+
+
+# The schema as it was before any migration, with a little data in it.
+BASELINE_SCHEMA = """
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY,
+        email TEXT NOT NULL UNIQUE,
+        username TEXT NOT NULL UNIQUE,
+        image_url TEXT,
+        header_image_url TEXT,
+        bio TEXT,
+        location TEXT,
+        password TEXT NOT NULL
+    );
+    CREATE TABLE follows (
+        user_being_followed_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        user_following_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+        PRIMARY KEY (user_being_followed_id, user_following_id)
+    );
+    CREATE TABLE messages (
+        id SERIAL PRIMARY KEY,
+        text VARCHAR(140) NOT NULL,
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE
+    );
+    CREATE TABLE likes (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE
+    );
+
+    INSERT INTO users (id, email, username, bio, password) VALUES
+        (1, 'bird@test.com', 'bird', 'sings at dawn', 'x'),
+        (2, 'fan@test.com', 'fan', NULL, 'x');
+    INSERT INTO follows VALUES (1, 2);
+    INSERT INTO messages (id, text, timestamp, user_id) VALUES
+        (1, 'first warble', now(), 1),
+        (2, 'second warble', now(), 1);
+    INSERT INTO likes (user_id, message_id) VALUES (2, 1), (2, 1), (2, 2);
+"""
+
+BASELINE_DATABASE = 'warbler_test_baseline'
+
+
+class MigrationTestCase(TestCase):
+    """Test running and recording migrations."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+        schema.stamp(db.engine)
+
+    def tearDown(self):
+        db.session.rollback()
+        # leave the schema as create_all made it, whatever happened
+        schema.upgrade(db.engine, echo=lambda line: None)
+
+    def test_statements(self):
+        """Are migrations split into statements, keeping $$ blocks whole?"""
+
+        migration = schema.migrations()[1]
+        statements = migration.statements()
+
+        self.assertEqual(migration.version, '0001')
+        self.assertFalse(migration.transactional)
+        self.assertTrue(all(statement.endswith(';') for statement in statements))
+        self.assertEqual(len([s for s in statements if s.startswith('DO $$')]), 1)
+
+    def test_status_after_stamp(self):
+        """Does a stamped database have no pending migrations?"""
+
+        self.assertTrue(all(applied_at for _, applied_at in schema.status(db.engine)))
+        self.assertEqual(schema.upgrade(db.engine, echo=lambda line: None), [])
+
+    def test_upgrade(self):
+        """Does upgrading add the indexes and drop duplicate likes?"""
+
+        user = User(username="liker", email="liker@test.com", password="x",
+                    likes_count=2)
+        db.session.add(user)
+        db.session.flush()
+        message = Message(text="liked twice", user_id=user.id)
+        db.session.add(message)
+        db.session.flush()
+        user_id, message_id = user.id, message.id
+
+        drop_query_indexes()
+        db.session.execute("DELETE FROM schema_migrations WHERE version = '0001'")
+        db.session.add_all([Like(user_id=user_id, message_id=message_id),
+                            Like(user_id=user_id, message_id=message_id)])
+        db.session.commit()
+        # CREATE INDEX CONCURRENTLY waits out every open transaction
+        db.session.close()
+
+        applied = schema.upgrade(db.engine, echo=lambda line: None)
+
+        self.assertEqual([migration.version for migration in applied], ['0001'])
+        self.assertEqual(Like.query.filter_by(user_id=user_id).count(), 1)
+        self.assertEqual(User.query.get(user_id).likes_count, 1)
+
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('likes')}
+        self.assertLessEqual({'ix_likes_user_id_id', 'ix_likes_message_id',
+                              'uq_likes_user_id_message_id'}, indexes)
+
+    def test_upgrade_rebuilds_invalid_index(self):
+        """Does a re-run replace an index left invalid by a failed build?"""
+
+        user = User(username="liker", email="liker@test.com", password="x")
+        db.session.add(user)
+        db.session.flush()
+        message = Message(text="liked twice", user_id=user.id)
+        db.session.add(message)
+        db.session.flush()
+        user_id, message_id = user.id, message.id
+
+        drop_query_indexes()
+        db.session.execute("DELETE FROM schema_migrations WHERE version = '0001'")
+        db.session.add_all([Like(user_id=user_id, message_id=message_id),
+                            Like(user_id=user_id, message_id=message_id)])
+        db.session.commit()
+        db.session.close()
+
+        # as if 0001 had been run before it dropped duplicates
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            with self.assertRaises(IntegrityError):
+                conn.execute(text("CREATE UNIQUE INDEX CONCURRENTLY uq_likes_user_id_message_id "
+                                  "ON likes (user_id, message_id)"))
+
+        schema.upgrade(db.engine, echo=lambda line: None)
+
+        valid = db.session.execute("""
+            SELECT indisvalid FROM pg_index
+            WHERE indexrelid = 'uq_likes_user_id_message_id'::regclass
+        """).scalar()
+        self.assertTrue(valid)
+
+
+class BaselineUpgradeTestCase(TestCase):
+    """Test bringing a database made before the migrations up to date."""
+
+    def setUp(self):
+        self.admin = create_engine(db.engine.url, poolclass=NullPool,
+                                   isolation_level='AUTOCOMMIT')
+
+        with self.admin.connect() as conn:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {BASELINE_DATABASE}"))
+            conn.execute(text(f"CREATE DATABASE {BASELINE_DATABASE}"))
+
+        self.engine = create_engine(db.engine.url.set(database=BASELINE_DATABASE),
+                                    poolclass=NullPool)
+
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(BASELINE_SCHEMA)
+
+    def tearDown(self):
+        self.engine.dispose()
+        with self.admin.connect() as conn:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {BASELINE_DATABASE}"))
+        self.admin.dispose()
+
+    def test_upgrade_baseline(self):
+        """Does upgrading reach create_all's schema, with backfilled data?"""
+
+        applied = schema.upgrade(self.engine, echo=lambda line: None)
+
+        self.assertEqual([migration.version for migration in applied],
+                         [migration.version for migration in schema.migrations()])
+
+        upgraded, current = inspect(self.engine), inspect(db.engine)
+        for table in db.metadata.tables:
+            self.assertEqual({column['name'] for column in upgraded.get_columns(table)},
+                             {column['name'] for column in current.get_columns(table)},
+                             table)
+            self.assertEqual({index['name'] for index in upgraded.get_indexes(table)},
+                             {index['name'] for index in current.get_indexes(table)},
+                             table)
+
+        with self.engine.connect() as conn:
+            counters = conn.execute(text("""
+                SELECT username, messages_count, following_count, followers_count, likes_count
+                FROM users ORDER BY id
+            """)).fetchall()
+            timelines = conn.execute(text("""
+                SELECT user_id, count(*) FROM timeline_entries GROUP BY user_id ORDER BY user_id
+            """)).fetchall()
+            found = conn.execute(text("""
+                SELECT username FROM users
+                WHERE search_vector @@ to_tsquery('simple', 'dawn')
+            """)).scalars().all()
+            warbles = conn.execute(text("""
+                SELECT count(*) FROM messages
+                WHERE search_vector @@ to_tsquery('english', 'warble')
+            """)).scalar()
+
+        # the duplicate like is gone, and off fan's likes_count
+        self.assertEqual([tuple(row) for row in counters],
+                         [("bird", 2, 0, 1, 0), ("fan", 0, 1, 0, 2)])
+        self.assertEqual([tuple(row) for row in timelines], [(1, 2), (2, 2)])
+        self.assertEqual(found, ["bird"])
+        self.assertEqual(warbles, 2)
+
+        # and there's nothing left to run
+        self.assertEqual(schema.upgrade(self.engine, echo=lambda line: None), [])
@@ -10,7 +10,7 @@ from unittest import TestCase
 
 from sqlalchemy.exc import IntegrityError
 
-from models import db, User, Message, Follows, Bcrypt
+from models import db, User, Message, Follows, Bcrypt, passwords
 bcrypt = Bcrypt()
 
 # BEFORE we import our app, let's set an environmental variable
@@ -19,6 +19,7 @@ bcrypt = Bcrypt()
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
 
 # Now we can import app
 
@@ -132,6 +133,45 @@ class UserModelTestCase(TestCase):
         self.assertEqual(u1.is_followed_by(u2), False)
 
 
+    def test_recount(self):
+        """Does User.recount report and repair drifted counters?"""
+
+        u1 = self.user1
+        u2 = self.user2
+
+        # written behind the counters' back
+        u1.following.append(u2)
+        db.session.add(Message(text="uncounted", user_id=u1.id))
+        db.session.commit()
+
+        report = dict(User.recount())
+        db.session.commit()
+
+        self.assertEqual(report[u1.id], {"following_count": (0, 1),
+                                         "messages_count": (0, 1)})
+        self.assertEqual(report[u2.id], {"followers_count": (0, 1)})
+        self.assertEqual(User.query.get(u1.id).following_count, 1)
+        self.assertEqual(User.recount(), [])
+
+
+    def test_reset_counts(self):
+        """Does User.reset_counts set every counter from the source rows?"""
+
+        u1 = self.user1
+        u2 = self.user2
+
+        u1.following.append(u2)
+        db.session.add(Message(text="uncounted", user_id=u1.id))
+        User.query.filter_by(id=u2.id).update({"likes_count": 3})
+        db.session.commit()
+
+        User.reset_counts()
+        db.session.commit()
+
+        self.assertEqual(User.recount(fix=False), [])
+        self.assertEqual(User.query.get(u2.id).likes_count, 0)
+
+
     def test_signup(self):
         """Does User.signup successfully create a new user given valid credentials?"""
         
@@ -177,6 +217,21 @@ class UserModelTestCase(TestCase):
         self.assertTrue(test_user)
        
        
+    def test_signin_rehashes_outdated_hash(self):
+        """Does a login upgrade a hash made with an old work factor?"""
+
+        old_hash = bcrypt.generate_password_hash("password", 4).decode('UTF-8')
+        self.user1.password = old_hash
+        db.session.commit()
+
+        test_user = User.authenticate(self.user1.username, "password")
+
+        self.assertTrue(test_user)
+        self.assertNotEqual(test_user.password, old_hash)
+        self.assertFalse(passwords.needs_rehash(test_user.password))
+        self.assertTrue(passwords.check(test_user.password, "password"))
+       
+       
     def test_invalid_username_signin(self):
         """Does User.authenticate fail to return a user when given an invalid username?"""
 
@@ -6,9 +6,14 @@
 
 
 import os
+import tempfile
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Job, Message, User, Follows, TimelineEntry, TIMELINE_BACKFILL
+from pagination import USERS_PER_PAGE
+from instrumentation import count_queries, query_budget
+import jobs
+import tasks
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -16,6 +21,7 @@ from models import db, connect_db, Message, User
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+os.environ['WARBLER_CONFIG'] = 'testing'
 
 # Now we can import app
 
@@ -80,6 +86,540 @@ class UserViewTestCase(TestCase):
             self.assertIn(f'@{self.testuser.username}', html)
             
     
+    def test_follow_updates_timeline(self):
+        """Does following pull in messages and unfollowing drop them?"""
+
+        other = User.signup(username="otheruser",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+
+        db.session.add(Message(text="Other's warble", user_id=other_id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post(f'/users/follow/{other_id}')
+            html = c.get('/').get_data(as_text=True)
+            self.assertIn("Other&#39;s warble", html)
+
+            c.post(f'/users/stop-following/{other_id}')
+            html = c.get('/').get_data(as_text=True)
+            self.assertNotIn("Other&#39;s warble", html)
+
+    def test_backfill_timelines(self):
+        """Does the backfill build timelines from existing follows?"""
+
+        other = User.signup(username="otheruser",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        self.testuser.following.append(other)
+        db.session.commit()
+
+        db.session.add_all([
+            Message(text="mine", user_id=self.testuser.id),
+            Message(text="theirs", user_id=other.id),
+        ])
+        db.session.commit()
+
+        self.assertEqual(TimelineEntry.backfill(), 3)
+        self.assertEqual(TimelineEntry.backfill(), 0)
+        db.session.commit()
+
+        timeline = TimelineEntry.messages_for(self.testuser.id).all()
+        self.assertEqual({m.text for m in timeline}, {"mine", "theirs"})
+
+    def test_list_users_pages(self):
+        """Does /users show one page of users with a link to the next?"""
+
+        for i in range(USERS_PER_PAGE):
+            User.signup(username=f"user{i}",
+                        email=f"user{i}@test.com",
+                        password="password",
+                        image_url=None)
+        db.session.commit()
+
+        with self.client as c:
+            html = c.get('/users').get_data(as_text=True)
+
+            self.assertEqual(html.count('class="card-link"'), USERS_PER_PAGE)
+            self.assertNotIn('@testuser<', html)
+
+            cursor = html.split("before=")[1].split('"')[0]
+            html = c.get(f'/users?before={cursor}').get_data(as_text=True)
+
+            self.assertIn('@testuser<', html)
+            self.assertNotIn("before=", html)
+
+    def test_show_likes(self):
+        """Does the likes page list the messages a user has liked?"""
+
+        other = User.signup(username="otheruser",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+
+        msg = Message(text="Likeable warble", user_id=other.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.testuser.likes.append(msg)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f'/users/{self.testuser.id}/likes')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Likeable warble", html)
+            self.assertIn("fas fa-star", html)
+
+    def test_follow_counters(self):
+        """Do follow/unfollow keep both users' counters current?"""
+
+        other = User.signup(username="otheruser",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post(f'/users/follow/{other_id}')
+            c.post(f'/users/follow/{other_id}')
+
+            self.assertEqual(User.query.get(self.testuser.id).following_count, 1)
+            self.assertEqual(User.query.get(other_id).followers_count, 1)
+
+            c.post(f'/users/stop-following/{other_id}')
+
+            self.assertEqual(User.query.get(self.testuser.id).following_count, 0)
+            self.assertEqual(User.query.get(other_id).followers_count, 0)
+
+    def test_follow_writes(self):
+        """Are follow/unfollow single idempotent statements?"""
+
+        other = User.signup(username="otheruser",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get('/users')  # warm the current-user cache
+
+            # the user check, then the one write whatever the state
+            for path in ('follow', 'follow', 'stop-following', 'stop-following'):
+                with count_queries() as queries:
+                    resp = c.post(f'/users/{path}/{other_id}')
+                self.assertEqual(resp.status_code, 302)
+                self.assertEqual(queries.count, 2, path)
+
+            resp = c.post('/users/follow/0')
+            self.assertEqual(resp.status_code, 404)
+
+        self.assertEqual(User.query.get(self.testuser.id).following_count, 0)
+        self.assertEqual(User.query.get(other_id).followers_count, 0)
+
+    def test_assets_skip_current_user(self):
+        """Do static files and built assets skip loading the current user?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            for path in ('/static/stylesheets/style.css', '/assets/stylesheets/style.css'):
+                with count_queries() as queries:
+                    c.get(path)
+                self.assertEqual(queries.count, 0, path)
+
+    def test_bulk_follows(self):
+        """Does Follows.add/remove handle many edges, repeats and missing users?"""
+
+        others = [User.signup(username=f"user{i}",
+                              email=f"user{i}@test.com",
+                              password="password",
+                              image_url=None)
+                  for i in range(3)]
+        db.session.flush()
+        db.session.add(Message(text="Followed warble", user_id=others[0].id))
+        db.session.commit()
+
+        user_id = self.testuser.id
+        other_ids = [other.id for other in others]
+        edges = [(user_id, other_id) for other_id in other_ids]
+
+        self.assertEqual(Follows.add(edges + edges[:1] + [(user_id, 0)]), 3)
+        self.assertEqual(Follows.add(edges), 0)
+        self.assertEqual(Follows.add([(other_ids[1], other_ids[0])]), 1)
+        db.session.commit()
+
+        self.assertEqual(User.query.get(user_id).following_count, 3)
+        self.assertEqual(User.query.get(other_ids[0]).followers_count, 2)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=user_id).count(), 1)
+
+        self.assertEqual(Follows.remove(edges + [(other_ids[0], user_id)]), 3)
+        db.session.commit()
+
+        self.assertEqual(User.query.get(user_id).following_count, 0)
+        self.assertEqual(User.query.get(other_ids[0]).followers_count, 1)
+        self.assertEqual(User.query.get(other_ids[1]).following_count, 1)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=user_id).count(), 0)
+
+    def test_follow_timeline_bounded(self):
+        """Do follow and unfollow move at most TIMELINE_BACKFILL timeline
+        entries in the request, leaving the rest to a job?"""
+
+        author = User.signup(username="prolific",
+                             email="prolific@test.com",
+                             password="password",
+                             image_url=None)
+        db.session.flush()
+        db.session.add_all([Message(text=f"Warble {n}", user_id=author.id)
+                            for n in range(TIMELINE_BACKFILL + 10)])
+        User.recount([author.id])
+        db.session.commit()
+        author_id = author.id
+        Job.query.delete()
+        db.session.commit()
+
+        def entries():
+            return TimelineEntry.query.filter_by(user_id=self.testuser.id,
+                                                 author_id=author_id).count()
+
+        jobs.queue.configure(run_inline=False)
+        tasks.TIMELINE_BATCH_SIZE = 7
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser.id
+
+                c.get('/users')  # warm the current-user cache
+
+                with count_queries() as queries:
+                    c.post(f'/users/follow/{author_id}')
+                # the user check, the follow, and queueing the rest
+                self.assertEqual(queries.count, 3)
+                self.assertEqual(entries(), TIMELINE_BACKFILL)
+
+                self.assertTrue(jobs.queue.work())
+                self.assertEqual(entries(), TIMELINE_BACKFILL + 10)
+
+                c.post(f'/users/stop-following/{author_id}')
+                self.assertEqual(entries(), 10)
+
+                self.assertTrue(jobs.queue.work())
+                self.assertEqual(entries(), 0)
+        finally:
+            tasks.TIMELINE_BATCH_SIZE = 1000
+            jobs.queue.init_app(app)
+
+    def test_import_follows(self):
+        """Does `flask import-follows` add a CSV of follows in batches?"""
+
+        others = [User.signup(username=f"user{i}",
+                              email=f"user{i}@test.com",
+                              password="password",
+                              image_url=None)
+                  for i in range(3)]
+        db.session.commit()
+        user_id = self.testuser.id
+        other_ids = [other.id for other in others]
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write("user_following_id,user_being_followed_id\n")
+            for other_id in other_ids:
+                file.write(f"{user_id},{other_id}\n{other_id},{user_id}\n")
+            file.flush()
+
+            result = app.test_cli_runner().invoke(
+                args=['import-follows', file.name, '--batch-size', '4'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Added 6 follows.", result.output)
+        self.assertEqual(User.query.get(user_id).following_count, 3)
+        self.assertEqual(User.query.get(user_id).followers_count, 3)
+
+    def test_delete_user(self):
+        """Does deleting a user remove them and fix others' counters?"""
+
+        other = User.signup(username="otheruser",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post(f'/users/follow/{other_id}')
+            resp = c.post('/users/delete')
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNone(User.query.get(self.testuser.id))
+            self.assertEqual(User.query.get(other_id).followers_count, 0)
+
+    def test_list_pages_query_count(self):
+        """Do likes/following/followers pages run a fixed number of queries?"""
+
+        others = [User.signup(username=f"user{i}",
+                              email=f"user{i}@test.com",
+                              password="password",
+                              image_url=None)
+                  for i in range(8)]
+        db.session.commit()
+
+        for other in others:
+            self.testuser.following.append(other)
+            other.following.append(self.testuser)
+            db.session.add(Message(text=f"by {other.username}", user_id=other.id))
+        db.session.commit()
+
+        self.testuser.likes.extend(Message.query.all())
+        db.session.commit()
+
+        user_id = self.testuser.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            c.get('/users')  # warm the current-user cache
+
+            # following/followers: the user, the page and one follows lookup
+            for page, expected in [("likes", 4), ("following", 3), ("followers", 3)]:
+                # following/followers stream, so read them in the block
+                with count_queries() as queries:
+                    resp = c.get(f'/users/{user_id}/{page}')
+                    html = resp.get_data(as_text=True)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("@user7", html)
+                self.assertEqual(queries.count, expected, page)
+
+    def test_user_routes_query_budget(self):
+        """Do the user list pages stay within their query budgets?"""
+
+        others = [User.signup(username=f"user{i}",
+                              email=f"user{i}@test.com",
+                              password="password",
+                              image_url=None)
+                  for i in range(12)]
+        db.session.commit()
+
+        for other in others:
+            self.testuser.following.append(other)
+            other.following.append(self.testuser)
+        db.session.commit()
+
+        user_id = self.testuser.id
+        budgets = {
+            "/users": 3,
+            "/users?q=user": 3,
+            f"/users/{user_id}/following": 3,
+            f"/users/{user_id}/followers": 3,
+        }
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            c.get('/users')  # warm the current-user cache
+
+            for path, budget in budgets.items():
+                # the lists stream, so read them inside the budget
+                with query_budget(budget):
+                    resp = c.get(path)
+                    resp.get_data()
+
+                self.assertEqual(resp.status_code, 200, path)
+
+    def test_list_users_follow_state(self):
+        """Does /users mark followed users using one scoped lookup?"""
+
+        others = [User.signup(username=f"user{i}",
+                              email=f"user{i}@test.com",
+                              password="password",
+                              image_url=None)
+                  for i in range(6)]
+        db.session.commit()
+
+        self.testuser.following.extend(others[:2])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get('/users')  # warm the current-user cache
+
+            with count_queries() as queries:
+                html = c.get('/users').get_data(as_text=True)
+
+        self.assertEqual(html.count(">Unfollow<"), 2)
+        self.assertEqual(html.count(">Follow<"), 4)
+        self.assertEqual(queries.count, 2)
+
+    def test_search_users(self):
+        """Does search match word prefixes and rank username hits first?"""
+
+        User.signup(username="birdwatcher",
+                    email="bird@test.com",
+                    password="password",
+                    image_url=None)
+        fan = User.signup(username="someone",
+                          email="fan@test.com",
+                          password="password",
+                          image_url=None)
+        fan.bio = "I love birds"
+        db.session.commit()
+
+        with self.client as c:
+            html = c.get('/users?q=bird').get_data(as_text=True)
+
+            self.assertIn("@birdwatcher", html)
+            self.assertIn("@someone", html)
+            self.assertNotIn("@testuser", html)
+            self.assertLess(html.index("@birdwatcher"), html.index("@someone"))
+
+            html = c.get('/users?q=zzz').get_data(as_text=True)
+            self.assertIn("Sorry, no users found", html)
+
+    def test_search_users_short_terms(self):
+        """Do terms too short to be prefixes only match whole words?"""
+
+        for username in ("al", "alice", "alfred"):
+            User.signup(username=username,
+                        email=f"{username}@test.com",
+                        password="password",
+                        image_url=None)
+        db.session.commit()
+
+        def found(search):
+            page = c.get(f'/users/search?q={search}').json
+            return sorted(user["username"] for user in page["users"])
+
+        with self.client as c:
+            self.assertEqual(found("a"), [])
+            self.assertEqual(found("al"), ["al"])
+            self.assertEqual(found("ali"), ["alice"])
+            self.assertEqual(found("al alf"), [])
+            self.assertEqual(found("alf"), ["alfred"])
+
+    def test_search_users_json(self):
+        """Does the JSON search endpoint page through ranked results?"""
+
+        for i in range(USERS_PER_PAGE + 1):
+            User.signup(username=f"finch{i}",
+                        email=f"finch{i}@test.com",
+                        password="password",
+                        image_url=None)
+        db.session.commit()
+
+        with self.client as c:
+            first = c.get('/users/search?q=finch').json
+            cursor = first["next_cursor"]
+            second = c.get(f'/users/search?q=finch&before={cursor}').json
+
+        usernames = [u["username"] for u in first["users"] + second["users"]]
+
+        self.assertEqual(len(first["users"]), USERS_PER_PAGE)
+        self.assertIsNone(second["next_cursor"])
+        self.assertEqual(len(set(usernames)), USERS_PER_PAGE + 1)
+
+    def test_profile_edit_refreshes_current_user(self):
+        """Does editing a profile replace the cached current user?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            self.assertIn("@testuser", c.get('/').get_data(as_text=True))
+
+            resp = c.post('/users/profile', data={"username": "renamed",
+                                                  "email": "test@test.com",
+                                                  "password": "testuser"})
+            self.assertEqual(resp.status_code, 302)
+
+            html = c.get('/').get_data(as_text=True)
+            self.assertIn("@renamed", html)
+            self.assertNotIn("@testuser", html)
+
+    def test_profile_not_modified(self):
+        """Is a logged-in profile private, and revalidated until it changes?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f'/users/{self.testuser.id}')
+            etag = resp.headers['ETag']
+
+            self.assertTrue(resp.cache_control.private)
+            self.assertTrue(resp.cache_control.no_cache)
+            self.assertIn('Cookie', resp.vary)
+
+            resp = c.get(f'/users/{self.testuser.id}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            resp = c.post('/messages/new', data={"text": "Hello"})
+            self.assertTrue(resp.cache_control.no_store)
+
+            resp = c.get(f'/users/{self.testuser.id}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Hello", resp.get_data(as_text=True))
+
+    def test_user_lists_not_modified(self):
+        """Do the streamed user lists revalidate with a 304 until they change?"""
+
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="password",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+        user_id = self.testuser.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            paths = ['/users', f'/users/{user_id}/following',
+                     f'/users/{other_id}/followers']
+            etags = {path: c.get(path).headers['ETag'] for path in paths}
+
+            for path, etag in etags.items():
+                resp = c.get(path, headers={'If-None-Match': etag})
+                self.assertEqual(resp.status_code, 304, path)
+
+            c.post(f'/users/follow/{other_id}')
+
+            for path, etag in etags.items():
+                resp = c.get(path, headers={'If-None-Match': etag})
+                self.assertEqual(resp.status_code, 200, path)
+                self.assertIn("@other", resp.get_data(as_text=True))
+
     # add additional users
     
     # create followers for users
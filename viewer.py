@@ -0,0 +1,73 @@
+"""What the logged-in user has liked and followed, for the current page.
+
+Templates ask "has the viewer liked this message?" and "does the viewer
+follow this user?" once per item. Rather than loading the viewer's whole
+likes/following relationships (or querying per item), a route scopes the
+ViewerContext to the messages and users on its page: one query fetches the
+matching ids into sets, and every check after that is a set lookup.
+"""
+
+from models import db, Follows, Like
+
+
+class ViewerContext:
+    """Liked-message and followed-user ids of a viewer, scoped to a page."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.liked_ids = set()
+        self.following_ids = set()
+        self.checked_message_ids = set()
+        self.checked_user_ids = set()
+
+    def scope(self, messages=(), users=()):
+        """Look up the viewer's likes of `messages` and follows of `users`.
+
+        Each message/user is only looked up once per request. Returns self.
+        """
+
+        if not self.user_id:
+            return self
+
+        message_ids = {msg.id for msg in messages} - self.checked_message_ids
+        user_ids = {user.id for user in users} - self.checked_user_ids
+
+        if message_ids:
+            liked = (db.session
+                     .query(Like.message_id)
+                     .filter(Like.user_id == self.user_id,
+                             Like.message_id.in_(message_ids)))
+            self.liked_ids.update(id for (id,) in liked)
+            self.checked_message_ids |= message_ids
+
+        if user_ids:
+            following = (db.session
+                         .query(Follows.user_being_followed_id)
+                         .filter(Follows.user_following_id == self.user_id,
+                                 Follows.user_being_followed_id.in_(user_ids)))
+            self.following_ids.update(id for (id,) in following)
+            self.checked_user_ids |= user_ids
+
+        return self
+
+    def likes(self, message):
+        """Has the viewer liked `message`?"""
+
+        if not self.user_id:
+            return False
+
+        if message.id not in self.checked_message_ids:
+            self.scope(messages=[message])
+
+        return message.id in self.liked_ids
+
+    def follows(self, user):
+        """Does the viewer follow `user`?"""
+
+        if not self.user_id:
+            return False
+
+        if user.id not in self.checked_user_ids:
+            self.scope(users=[user])
+
+        return user.id in self.following_ids